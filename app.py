@@ -1,21 +1,61 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
-from database import RaffleDatabase
+from flask import Flask, render_template, jsonify, request, session, redirect, url_for, stream_with_context, send_from_directory, abort, g
+from database import RaffleDatabase, encode_cursor
+from events import TooManySubscribers, format_sse
+from images import process_image, ImageError
+from assets import AssetManifest, CACHE_MAX_AGE
+from ledger import MAX_COINS as MAX_TOTAL, MAX_COINS_PER_TRANSACTION as MAX_PER_TRANSACTION
 import os
+import io
+import re
+import csv
+import json
+import time
+import hmac
+import mimetypes
 import logging
-import uuid
-from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
+from metrics import log
+from rate_limit import TokenBuckets, AdmissionControl, load_rate_limits, retry_after_header
+from functools import wraps
 
-logging.basicConfig(level=logging.INFO)
+# LOG_LEVEL=DEBUG включает подробный журнал (доля событий — LOG_SAMPLE_RATE)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s %(levelname)s %(name)s %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Для сессий
 
+# Число своих прокси перед приложением (nginx и т.п.): только им верим в X-Forwarded-For,
+# иначе request.remote_addr — адрес прокси, и лимиты по IP общие для всех клиентов.
+# 0 — приложение смотрит в сеть напрямую, заголовки X-Forwarded-* игнорируются
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
 # Конфигурация загрузки файлов (ПОСЛЕ создания app)
 UPLOAD_FOLDER = 'static/images'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 MAX_FILE_SIZE = 2 * 1024 * 1024  # 2MB
 
+# Интервал пинга в потоке событий /api/stream (секунды)
+SSE_HEARTBEAT = 15
+
+# Поток событий /api/stream держит поток сервера на каждого клиента, поэтому
+# по умолчанию выключен: синхронные воркеры gunicorn (sync) он займёт целиком.
+# Включайте SSE=on только под потоковым сервером (gunicorn -k gthread) или
+# под ASGI (asgi.py включает его сам). Без него game.js не подключается к потоку.
+app.config['SSE_ENABLED'] = os.environ.get('SSE', 'off') == 'on'
+
+# Максимум строк в одном массовом начислении
+MAX_BULK_ROWS = 50000
+
+# Максимум прокруток в одном запросе /api/draw
+MAX_SPINS_PER_DRAW = 100
+
+# Размер страницы админских списков (по умолчанию и максимум)
+ADMIN_PAGE_SIZE = 100
+MAX_ADMIN_PAGE_SIZE = 1000
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
@@ -25,12 +65,121 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-db = RaffleDatabase()
+# RAFFLE_DB — путь к базе (например, засеянной benchmarks/seed.py)
+db = RaffleDatabase(os.environ.get('RAFFLE_DB', 'raffle.db'))
+
+# Адреса статики с хэшем содержимого (/assets/...), кэшируются браузером на год
+assets = AssetManifest(app.static_folder).build()
+
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': assets.url, 'sse_enabled': app.config['SSE_ENABLED']}
+
+def with_image_urls(prize):
+    """Добавить к призу адреса картинок с хэшем (image/thumb/detail — имена файлов)"""
+    for key in ('image', 'thumb', 'detail'):
+        if prize.get(key):
+            prize[f'{key}_url'] = assets.url(f"images/{prize[key]}")
+    return prize
 
 # Конфигурация админа
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
 
+# Токен для сборщика метрик (Authorization: Bearer ...); без него /metrics — только для админа
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Лимиты частоты: маршрут -> ключ -> (токенов в секунду, ёмкость корзины).
+# Для входа ключ 'user' — пара (никнейм, IP): чужие попытки не блокируют владельца
+RATE_LIMITS = {
+    'draw': {'ip': (20, 60), 'user': (5, 20)},
+    'login': {'ip': (1, 20), 'user': (0.2, 5)},
+    # Только создание аккаунта; повторный вход через /api/register — по лимиту register_or_login
+    'register': {'ip': (0.1, 5)},
+    'register_or_login': {'ip': (1, 20)},
+}
+
+RATE_LIMITS = load_rate_limits(RATE_LIMITS, os.environ.get('RATE_LIMITS', '{}'))
+
+# Корзины — в отдельном файле, общем для воркеров; пишущих запросов одновременно — не больше MAX_CONCURRENT_WRITES на воркер.
+# Вход и регистрация с паролем держат слот всё время хэширования — у каждого свои
+# MAX_CONCURRENT_PASSWORD_REQUESTS слотов, чтобы поток входов не отнимал их у розыгрыша
+# RATE_LIMIT=off отключает корзины (нагрузочные тесты с одного адреса)
+PASSWORD_SLOTS = int(os.environ.get('MAX_CONCURRENT_PASSWORD_REQUESTS', 4))
+admission = AdmissionControl(
+    TokenBuckets(os.environ.get('RATE_LIMIT_DB', 'ratelimit.db')),
+    RATE_LIMITS if os.environ.get('RATE_LIMIT', 'on') != 'off' else {},
+    max_writes=int(os.environ.get('MAX_CONCURRENT_WRITES', 8)),
+    route_writes={'login': PASSWORD_SLOTS, 'register': PASSWORD_SLOTS}
+)
+
+# Фоновая сверка балансов с журналом: раз в RECONCILE_INTERVAL секунд (0 — выключена),
+# занимая не больше RECONCILE_DUTY доли времени одного ядра
+RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL', 0))
+RECONCILE_DUTY = float(os.environ.get('RECONCILE_DUTY', 0.05))
+
+def too_many_requests(retry_after):
+    response = jsonify({
+        'success': False,
+        'message': f'Слишком много запросов, попробуйте через {retry_after_header(retry_after)} с'
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response
+
+def admission_control(route, user_field=None, user_per_ip=False):
+    """Декоратор пишущих маршрутов: лимиты по IP и пользователю (поле user_field в JSON), затем слот записи.
+
+    user_per_ip — корзина пользователя своя на каждый IP (вход по никнейму:
+    перебор с чужих адресов не должен запирать владельца).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            keys = {'ip': request.remote_addr}
+            if user_field:
+                user = (request.get_json(silent=True) or {}).get(user_field)
+                if user is not None and user_per_ip:
+                    user = f'{user}@{request.remote_addr}'
+                keys['user'] = user
+            retry_after = admission.check(route, keys)
+            if retry_after:
+                return too_many_requests(retry_after)
+            if not admission.enter(route):
+                # Все слоты заняты — отказ сразу, а не ожидание до таймаута воркера
+                return too_many_requests(1)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                admission.leave(route)
+        return decorated_function
+    return decorator
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+
+@app.before_request
+def start_reconciler():
+    # Поток запускается в каждом воркере после fork; проходы не задваиваются (watermark)
+    if RECONCILE_INTERVAL > 0:
+        db.reconciler.ensure_running(RECONCILE_INTERVAL, RECONCILE_DUTY)
+
+@app.after_request
+def record_timing(response):
+    # Для потоковых ответов (SSE, выгрузки) это время до первого байта
+    if 'started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        db.metrics.observe('route', route, time.perf_counter() - g.pop('started'), error=response.status_code >= 500)
+    return response
+
+@app.teardown_request
+def record_failure(error=None):
+    # Необработанное исключение: after_request не вызывался
+    if error is not None and 'started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        db.metrics.observe('route', route, time.perf_counter() - g.pop('started'), error=True)
+
 
 # ========== СУЩЕСТВУЮЩИЕ МАРШРУТЫ (НЕ ТРОГАЕМ) ==========
 
@@ -39,6 +188,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/api/register', methods=['POST'])
+@admission_control('register_or_login')
 def register():
     """Регистрация или вход пользователя"""
     data = request.get_json()
@@ -53,25 +203,72 @@ def register():
     if not telegram and not site_url:
         return jsonify({'success': False, 'message': 'Заполните Telegram или ссылку'})
     
+    # Лимит регистраций — только когда аккаунт будет создан: вход вернувшихся
+    # пользователей из-за одного NAT не должен упираться в него
+    if not db.check_nickname_exists(nickname):
+        retry_after = admission.check('register', {'ip': request.remote_addr})
+        if retry_after:
+            return too_many_requests(retry_after)
+    
     result = db.register_or_login(nickname, telegram, site_url)
     return jsonify(result)
 
 @app.route('/api/prizes')
 def get_prizes():
     """Список доступных призов"""
-    prizes = db.get_available_prizes()
-    return jsonify({'success': True, 'prizes': prizes})
+    # Готовый JSON из кэша (сбрасывается при любом изменении призов); при совпадении ETag — 304
+    body, etag = db.get_available_prizes_json(with_image_urls)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """Статика с хэшем в имени: содержимое по адресу не меняется, кэш — на год"""
+    accepted = {encoding for encoding in ('br', 'gzip') if request.accept_encodings[encoding]}
+    found = assets.resolve(filename, accepted)
+    if found is None:
+        abort(404)
+    
+    path, encoding, body = found
+    if encoding:
+        # Предсжатый вариант, собранный при старте
+        response = app.response_class(body, mimetype=mimetypes.guess_type(path)[0])
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(app.static_folder, path, max_age=CACHE_MAX_AGE)
+    
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/draw', methods=['POST'])
+@admission_control('draw', user_field='user_id')
 def draw():
     """Розыгрыш приза"""
     data = request.get_json()
     user_id = data.get('user_id')
+    count = data.get('count', 1)
     
     if not user_id:
         return jsonify({'success': False, 'message': 'Пользователь не найден'})
     
-    result = db.draw_prize(user_id)
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Количество прокруток должно быть числом'})
+    
+    if count < 1 or count > MAX_SPINS_PER_DRAW:
+        return jsonify({'success': False, 'message': f'Можно крутить от 1 до {MAX_SPINS_PER_DRAW} раз за раз'})
+    
+    # Одна прокрутка — прежний формат ответа, несколько — список призов
+    if count == 1:
+        result = db.draw_prize(user_id)
+    else:
+        result = db.draw_prizes(user_id, count)
     return jsonify(result)
 
 # ========== НОВЫЕ ПУБЛИЧНЫЕ МАРШРУТЫ ==========
@@ -79,18 +276,12 @@ def draw():
 @app.route('/api/public-winners')
 def get_public_winners():
     """Публичная таблица победителей (только ники и призы)"""
-    winners = db.get_public_winners()
-    return jsonify({
-        'success': True,
-        'winners': [
-            {
-                'nickname': w[0],
-                'prize_name': w[1],
-                'won_at': w[2]
-            }
-            for w in winners
-        ]
-    })
+    # Готовый JSON из ленты победителей; при совпадении ETag отдаём 304
+    body, etag = db.get_public_winners_feed()
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/user-wins')
 def get_user_wins():
@@ -103,16 +294,55 @@ def get_user_wins():
     return jsonify({
         'success': True,
         'wins': [
-            {
+            with_image_urls({
                 'name': w[0],
                 'image': w[1],
                 'description': w[2],
-                'won_at': w[3]
-            }
+                'won_at': w[3],
+                'thumb': w[4],
+                'detail': w[5]
+            })
             for w in wins
         ]
     })
 
+@app.route('/api/stream')
+def stream():
+    """Поток событий (SSE): новые победители, изменения призов, баланс пользователя"""
+    if not app.config['SSE_ENABLED']:
+        abort(404)
+    
+    try:
+        user_id = int(request.args.get('user_id', ''))
+    except ValueError:
+        user_id = None
+    
+    try:
+        subscription = db.events.subscribe(user_id)
+    except TooManySubscribers as e:
+        return jsonify({'success': False, 'message': str(e)}), 503
+    
+    def generate():
+        try:
+            # Клиент переподключится через 5 секунд, если соединение оборвётся
+            yield 'retry: 5000\n\n'
+            while True:
+                events = subscription.wait(timeout=SSE_HEARTBEAT)
+                if not events:
+                    # Комментарий-пинг держит соединение через прокси
+                    yield ': ping\n\n'
+                    continue
+                for event in events:
+                    yield format_sse(event)
+        finally:
+            db.events.unsubscribe(subscription)
+    
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/game')
 def game():
     """Страница игры (после регистрации)"""
@@ -165,11 +395,27 @@ def admin_panel():
 
 # ========== АДМИН-API МАРШРУТЫ ==========
 
+def page_args():
+    """limit и after из query string для keyset-пагинации"""
+    limit = request.args.get('limit', ADMIN_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_ADMIN_PAGE_SIZE))
+    return limit, request.args.get('after') or None
+
+def next_cursor(rows, limit, *key_columns):
+    """Курсор следующей страницы (None, если страница последняя)"""
+    if len(rows) < limit:
+        return None
+    return encode_cursor(*(rows[-1][i] for i in key_columns))
+
 @app.route('/api/admin/users')
 @admin_required
 def get_users_admin():
-    """Список всех пользователей с контактами (только для админа)"""
-    users = db.get_all_users_admin()
+    """Список пользователей с контактами (только для админа), постранично"""
+    limit, after = page_args()
+    try:
+        users = db.get_all_users_admin(limit, after)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     return jsonify({
         'success': True,
         'users': [
@@ -183,14 +429,19 @@ def get_users_admin():
                 'last_login': u[6]
             }
             for u in users
-        ]
+        ],
+        'next_cursor': next_cursor(users, limit, 0)
     })
 
 @app.route('/api/admin/prizes')
 @admin_required
 def get_prizes_admin():
-    """Все призы (включая разыгранные) для админа"""
-    prizes = db.get_all_prizes_admin()
+    """Все призы (включая разыгранные) для админа, постранично"""
+    limit, after = page_args()
+    try:
+        prizes = db.get_all_prizes_admin(limit, after)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     return jsonify({
         'success': True,
         'prizes': [
@@ -203,14 +454,19 @@ def get_prizes_admin():
                 'created_at': p[5]
             }
             for p in prizes
-        ]
+        ],
+        'next_cursor': next_cursor(prizes, limit, 5, 0)
     })
 
 @app.route('/api/admin/winners')
 @admin_required
 def get_winners_admin():
-    """Полная таблица победителей с контактами (только для админа)"""
-    winners = db.get_full_winners()
+    """Таблица победителей с контактами (только для админа), постранично"""
+    limit, after = page_args()
+    try:
+        winners = db.get_full_winners(limit, after)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     return jsonify({
         'success': True,
         'winners': [
@@ -222,7 +478,8 @@ def get_winners_admin():
                 'won_at': w[4]
             }
             for w in winners
-        ]
+        ],
+        'next_cursor': next_cursor(winners, limit, 4, 5)
     })
 
 @app.route('/api/admin/add_coins', methods=['POST'])
@@ -247,7 +504,6 @@ def add_coins_admin():
         return jsonify({'success': False, 'message': 'Введите положительное количество монет'})
     
     # ЗАЩИТА 2: Ограничение на максимальное количество за раз (10 000)
-    MAX_PER_TRANSACTION = 10000
     if amount > MAX_PER_TRANSACTION:
         return jsonify({
             'success': False, 
@@ -259,17 +515,20 @@ def add_coins_admin():
         return jsonify({'success': False, 'message': 'Пользователь не найден'})
     
     # ЗАЩИТА 3: Проверяем, что у пользователя не слишком много монет
-    MAX_TOTAL = 1000000
     if user['shadow_coins'] + amount > MAX_TOTAL:
         return jsonify({
             'success': False,
             'message': f'У пользователя слишком много монет (макс. {MAX_TOTAL})'
         })
     
-    db.add_shadow_coins(user['id'], amount, reason, admin_id=1)
+    success = db.add_shadow_coins(user['id'], amount, reason, admin_id=1)
+    
+    if not success:
+        return jsonify({'success': False, 'message': 'Ошибка при добавлении монет'})
     
     # Получаем обновленный баланс
     new_balance = db.get_user_coins(user['id'])
+    db.events.publish('balance', {'shadow_coins': new_balance}, user_id=user['id'])
     
     return jsonify({
         'success': True,
@@ -299,7 +558,6 @@ def remove_coins_admin():
         return jsonify({'success': False, 'message': 'Введите положительное количество монет для снятия'})
     
     # Ограничение на максимальное количество за раз
-    MAX_PER_TRANSACTION = 10000
     if amount > MAX_PER_TRANSACTION:
         return jsonify({
             'success': False, 
@@ -325,6 +583,7 @@ def remove_coins_admin():
     
     # Получаем обновленный баланс
     new_balance = db.get_user_coins(user['id'])
+    db.events.publish('balance', {'shadow_coins': new_balance}, user_id=user['id'])
     
     return jsonify({
         'success': True,
@@ -332,6 +591,48 @@ def remove_coins_admin():
         'new_balance': new_balance
     })
 
+@app.route('/api/admin/bulk_add_coins', methods=['POST'])
+@admin_required
+def bulk_add_coins_admin():
+    """Массовое начисление монет: JSON {'entries': [...]} или CSV-файл nickname,amount,reason"""
+    if 'file' in request.files:
+        try:
+            text = request.files['file'].read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return jsonify({'success': False, 'message': 'CSV должен быть в кодировке UTF-8'})
+        rows = [row for row in csv.reader(io.StringIO(text)) if row]
+        # Необязательная строка заголовка
+        if rows and rows[0][0].strip().lower() == 'nickname':
+            rows = rows[1:]
+        entries = [
+            (row[0].strip(), row[1].strip() if len(row) > 1 else None, row[2].strip() if len(row) > 2 else '')
+            for row in rows
+        ]
+    else:
+        data = request.get_json(silent=True) or {}
+        entries = [
+            (e.get('nickname'), e.get('amount'), e.get('reason', ''))
+            for e in data.get('entries', [])
+            if isinstance(e, dict)
+        ]
+    
+    if not entries:
+        return jsonify({'success': False, 'message': 'Нет строк для начисления'})
+    
+    if len(entries) > MAX_BULK_ROWS:
+        return jsonify({'success': False, 'message': f'Слишком много строк (макс. {MAX_BULK_ROWS})'})
+    
+    results = db.bulk_add_shadow_coins(entries, admin_id=1)
+    applied = sum(1 for r in results if r['success'])
+    
+    return jsonify({
+        'success': True,
+        'message': f'Начислено по {applied} из {len(results)} строк',
+        'applied': applied,
+        'failed': len(results) - applied,
+        'results': results
+    })
+
 @app.route('/api/admin/add_prize', methods=['POST'])
 @admin_required
 def add_prize_admin():
@@ -347,6 +648,15 @@ def add_prize_admin():
         if len(description) > 500:
             return jsonify({'success': False, 'message': 'Описание слишком длинное (макс. 500 символов)'})
         
+        # Вес приза: чем больше, тем чаще выпадает (1 — обычный шанс)
+        try:
+            weight = int(request.form.get('weight', 1))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Вес приза должен быть числом'})
+        
+        if weight < 1 or weight > 1000:
+            return jsonify({'success': False, 'message': 'Вес приза должен быть от 1 до 1000'})
+        
         # Проверяем наличие файла
         if 'image' not in request.files:
             return jsonify({'success': False, 'message': 'Не выбрано изображение'})
@@ -360,21 +670,19 @@ def add_prize_admin():
         if not allowed_file(file.filename):
             return jsonify({'success': False, 'message': 'Неподдерживаемый формат файла'})
         
-        # Генерируем безопасное имя файла
-        filename = secure_filename(file.filename)
-        # Добавляем уникальный префикс, чтобы избежать перезаписи
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
+        # Миниатюра, детальное изображение и webp-варианты — один раз, при загрузке.
+        # Имена по хэшу содержимого: одинаковая картинка хранится один раз
+        try:
+            images = process_image(file.read(), app.config['UPLOAD_FOLDER'])
+        except ImageError as e:
+            return jsonify({'success': False, 'message': str(e)})
         
-        # Сохраняем файл
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        print(f"✅ Изображение обработано: {images['image']}")
         
-        print(f"✅ Файл сохранен: {unique_filename}")
+        # Добавляем приз в базу данных (сохраняем только имена файлов)
+        prize_id = db.add_prize(name, images['image'], description, weight, images['thumb'], images['detail'])
         
-        # Добавляем приз в базу данных (сохраняем только имя файла)
-        prize_id = db.add_prize(name, unique_filename, description)
-        
-        return jsonify({'success': True, 'prize_id': prize_id, 'image': unique_filename})
+        return jsonify({'success': True, 'prize_id': prize_id, **images})
         
     except Exception as e:
         print(f"🔥 Ошибка при добавлении приза: {e}")
@@ -384,8 +692,12 @@ def add_prize_admin():
 @admin_required
 def get_transactions_admin():
     """История транзакций"""
-    user_id = request.args.get('user_id')
-    transactions = db.get_transactions(int(user_id) if user_id else None)
+    user_id = request.args.get('user_id', type=int)
+    limit, after = page_args()
+    try:
+        transactions = db.get_transactions(user_id, limit, after)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     return jsonify({
         'success': True,
         'transactions': [
@@ -398,48 +710,168 @@ def get_transactions_admin():
                 'created_at': t[5]
             }
             for t in transactions
-        ]
+        ],
+        'next_cursor': next_cursor(transactions, limit, 5, 0)
     })
 
+@app.route('/api/admin/ledger')
+@admin_required
+def get_ledger_admin():
+    """Сжатая история монет пользователя: дневные итоги, а за день day — исходные строки из архива"""
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Укажите user_id'}), 400
+    day = request.args.get('day')
+    
+    result = {
+        'success': True,
+        'summaries': [
+            {
+                'day': s[0],
+                'credits': s[1],
+                'debits': s[2],
+                'net': s[1] - s[2],
+                'tx_count': s[3],
+                'first_id': s[4],
+                'last_id': s[5],
+                'checksum': s[6]
+            }
+            for s in db.get_ledger_summaries(user_id)
+        ]
+    }
+    if day:
+        # Архив подключается только на время этого запроса
+        result['transactions'] = [
+            {
+                'id': t[0],
+                'user_id': t[1],
+                'amount': t[2],
+                'reason': t[3],
+                'admin_id': t[4],
+                'created_at': t[5]
+            }
+            for t in db.get_archived_transactions(user_id, day)
+        ]
+    return jsonify(result)
+
+@app.route('/api/admin/export/<kind>')
+@admin_required
+def export_admin(kind):
+    """Потоковая выгрузка всей истории winners/transactions в CSV или NDJSON"""
+    if kind not in db.EXPORTS:
+        return jsonify({'success': False, 'message': 'Неизвестная выгрузка'}), 404
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'Формат: csv или ndjson'}), 400
+    
+    columns, _ = db.EXPORTS[kind]
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            # BOM — чтобы Excel открыл кириллицу
+            buffer.write('\ufeff')
+            writer.writerow(columns)
+        # Каждая пачка fetchmany уходит клиенту одним куском
+        for rows in db.export_batches(kind):
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    
+    filename = f"{kind}_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/admin/counts')
+@admin_required
+def get_counts_admin():
+    """Общее количество записей для админских списков (без выборки строк)"""
+    return jsonify({'success': True, 'counts': db.get_table_counts()})
+
 @app.route('/api/admin/stats')
 @admin_required
 def get_stats_admin():
     """Статистика для админ-панели"""
-    with db.get_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Общая статистика
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM prizes WHERE available = 1")
-        available_prizes = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM winners")
-        total_winners = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT SUM(shadow_coins) FROM users")
-        total_coins = cursor.fetchone()[0] or 0
-        
-        # Топ-10 по монетам
-        cursor.execute('''
-            SELECT nickname, shadow_coins FROM users 
-            ORDER BY shadow_coins DESC LIMIT 10
-        ''')
-        top_users = [{'nickname': u[0], 'coins': u[1]} for u in cursor.fetchall()]
-        
-        return jsonify({
-            'success': True,
-            'stats': {
-                'total_users': total_users,
-                'available_prizes': available_prizes,
-                'total_winners': total_winners,
-                'total_coins': total_coins,
-                'top_users': top_users
-            }
-        })
-        
+    return jsonify({'success': True, 'stats': db.get_stats()})
+
+@app.route('/api/admin/db_pool')
+@admin_required
+def get_db_pool_admin():
+    """Счётчики пула соединений (hits/misses/waits) для подбора DB_POOL_SIZE"""
+    return jsonify({'success': True, 'pool': db.pool.stats()})
+
+@app.route('/metrics')
+def metrics():
+    """Метрики процесса в формате Prometheus (админ-сессия или METRICS_TOKEN)"""
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not session.get('admin_logged_in') and not (METRICS_TOKEN and hmac.compare_digest(token, METRICS_TOKEN)):
+        abort(403)
+    
+    pool = db.pool.stats()
+    writes = db.writes.stats()
+    events = db.events.stats()
+    users = db.user_cache.stats()
+    limits = admission.stats()
+    reconcile = db.reconciler.stats()
+    extra = [
+        ('raffle_db_pool_size', 'gauge', 'Открытых соединений в пуле', pool['size']),
+        ('raffle_db_pool_idle', 'gauge', 'Свободных соединений в пуле', pool['idle']),
+        ('raffle_db_pool_waits_total', 'counter', 'Ожиданий свободного соединения', pool['waits']),
+        ('raffle_write_queue_pending', 'gauge', 'Операций в очереди записи', writes['pending']),
+        ('raffle_write_batches_total', 'counter', 'Пачек группового коммита', writes['batches']),
+        ('raffle_write_operations_total', 'counter', 'Операций в пачках', writes['operations']),
+        ('raffle_write_timeouts_total', 'counter', 'Операций, не дождавшихся писателя', writes['timeouts']),
+        ('raffle_writer_failures_total', 'counter', 'Неудачных запусков потока-писателя', writes['writer_failures']),
+        ('raffle_sse_subscribers', 'gauge', 'Подключений к /api/stream', events['subscribers']),
+        ('raffle_user_cache_size', 'gauge', 'Профилей в кэше', users['size']),
+        ('raffle_user_cache_hits_total', 'counter', 'Попаданий в кэш профилей', users['hits']),
+        ('raffle_user_cache_misses_total', 'counter', 'Промахов кэша профилей', users['misses']),
+        ('raffle_admitted_writes_total', 'counter', 'Допущенных пишущих запросов', limits['admitted']),
+        ('raffle_reconcile_lag_rows', 'gauge', 'Строк журнала, ещё не сверенных с балансами', reconcile['lag_rows']),
+        ('raffle_balance_drift_users', 'gauge', 'Пользователей с расхождением баланса и журнала', len(reconcile['drift'])),
+    ] + [
+        (f'raffle_requests_shed_total{{route="{row["route"]}",reason="{row["reason"]}"}}', 'counter',
+         'Отклонённых запросов (429)', row['count'])
+        for row in limits['shed']
+    ]
+    return app.response_class(db.metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/admin/rate_limits')
+@admin_required
+def get_rate_limits_admin():
+    """Сколько запросов отклонено лимитами и пределом одновременных записей"""
+    return jsonify({'success': True, 'limits': RATE_LIMITS, 'admission': admission.stats()})
+
+@app.route('/api/admin/write_queue')
+@admin_required
+def get_write_queue_admin():
+    """Размеры пачек группового коммита и ожидание в очереди (WRITE_BATCH_MAX / WRITE_BATCH_DELAY_MS)"""
+    return jsonify({'success': True, 'write_queue': db.writes.stats()})
+
+@app.route('/api/admin/reconcile')
+@admin_required
+def get_reconcile_admin():
+    """Сверка балансов с журналом: watermark, отставание и пользователи с расхождением"""
+    return jsonify({'success': True, 'reconcile': db.reconciler.stats()})
+
 @app.route('/api/register_with_password', methods=['POST'])
+@admission_control('register')
 def register_with_password():
     """Регистрация с паролем"""
     data = request.get_json()
@@ -459,9 +891,10 @@ def register_with_password():
         return jsonify({'success': False, 'message': 'Заполните Telegram или ссылку'})
     
     result = db.register_with_password(nickname, password, telegram, site_url)
-    return jsonify(result)
+    return password_response(result)
 
 @app.route('/api/login_with_password', methods=['POST'])
+@admission_control('login', user_field='nickname', user_per_ip=True)
 def login_with_password():
     """Вход с паролем"""
     data = request.get_json()
@@ -472,13 +905,22 @@ def login_with_password():
         return jsonify({'success': False, 'message': 'Введите никнейм и пароль'})
     
     result = db.login_with_password(nickname, password)
-    return jsonify(result) 
+    return password_response(result)
+
+def password_response(result):
+    """Ответ на вход/регистрацию: при переполненной очереди хэширования — 503"""
+    if result.get('busy'):
+        response = jsonify(result)
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    return jsonify(result)
 
 @app.route('/api/user-data')
 def get_user_data():
     """Получить актуальные данные пользователя"""
     user_id = request.args.get('user_id')
-    print(f"📊 Запрос данных пользователя: user_id={user_id}")
+    log.debug('user_data', user_id=user_id)
     
     if not user_id:
         return jsonify({'success': False, 'message': 'Не указан пользователь'})
@@ -486,88 +928,69 @@ def get_user_data():
     try:
         user = db.get_user_by_id(user_id)
         if user:
-            print(f"✅ Пользователь найден: {user}")
             return jsonify({'success': True, 'user': user})
         else:
-            print(f"❌ Пользователь не найден: {user_id}")
+            log.info('user_data.not_found', user_id=user_id)
             return jsonify({'success': False, 'message': 'Пользователь не найден'})
     except Exception as e:
-        print(f"🔥 Ошибка: {e}")
+        log.error('user_data.failed', user_id=user_id, error=repr(e))
         return jsonify({'success': False, 'message': str(e)})   
     
-@app.route('/api/update_profile', methods=['POST'])
-def update_profile():
-    """Обновить данные профиля пользователя"""
-    data = request.get_json()
-    user_id = data.get('user_id')
-    nickname = data.get('nickname')
-    telegram = data.get('telegram')
-    site_url = data.get('site_url')
-    
-    if not user_id:
-        return jsonify({'success': False, 'message': 'Пользователь не найден'})
+REMANGA_URL = re.compile(r'^https://remanga\.org/user/[0-9]+/about$')
+
+
+def profile_changes(data):
+    """Проверить меняемые поля профиля; (изменения, None) или (None, сообщение об ошибке).
+
+    Меняются только переданные поля. Пустой ник не меняет ничего,
+    пустой Telegram или ссылка (null или '') очищают поле.
+    """
+    changes = {}
     
     # Проверка ника
+    nickname = data.get('nickname')
     if nickname:
         if len(nickname) < 3:
-            return jsonify({'success': False, 'message': 'Никнейм должен быть не менее 3 символов'})
+            return None, 'Никнейм должен быть не менее 3 символов'
         if len(nickname) > 20:
-            return jsonify({'success': False, 'message': 'Никнейм должен быть не более 20 символов'})
+            return None, 'Никнейм должен быть не более 20 символов'
+        changes['nickname'] = nickname
     
     # Проверка Telegram
-    if telegram and len(telegram) > 15:
-        return jsonify({'success': False, 'message': 'Telegram не может быть длиннее 15 символов'})
+    if 'telegram' in data:
+        telegram = data['telegram'] or None
+        if telegram and len(telegram) > 15:
+            return None, 'Telegram не может быть длиннее 15 символов'
+        changes['telegram'] = telegram
     
     # Проверка ссылки Remanga
-    if site_url:
-        import re
-        remanga_regex = r'^https://remanga\.org/user/[0-9]+/about$'
-        if not re.match(remanga_regex, site_url):
-            return jsonify({'success': False, 'message': 'Неверный формат ссылки Remanga'})
-        if len(site_url) > 100:
-            return jsonify({'success': False, 'message': 'Ссылка слишком длинная'})
-    
-    # Обновляем в базе данных
-    with db.get_connection() as conn:
-        cursor = conn.cursor()
-        
-        if nickname:
-            # Проверяем, не занят ли ник
-            cursor.execute("SELECT id FROM users WHERE nickname = ? AND id != ?", (nickname, user_id))
-            if cursor.fetchone():
-                return jsonify({'success': False, 'message': 'Никнейм уже занят'})
-            cursor.execute("UPDATE users SET nickname = ? WHERE id = ?", (nickname, user_id))
-        
-        if telegram is not None:
-            if telegram:
-                cursor.execute("SELECT id FROM users WHERE telegram = ? AND id != ?", (telegram, user_id))
-                if cursor.fetchone():
-                    return jsonify({'success': False, 'message': 'Telegram уже используется'})
-            cursor.execute("UPDATE users SET telegram = ? WHERE id = ?", (telegram, user_id))
-        
-        if site_url is not None:
-            if site_url:
-                cursor.execute("SELECT id FROM users WHERE site_url = ? AND id != ?", (site_url, user_id))
-                if cursor.fetchone():
-                    return jsonify({'success': False, 'message': 'Ссылка уже используется'})
-            cursor.execute("UPDATE users SET site_url = ? WHERE id = ?", (site_url, user_id))
-        
-        conn.commit()
-        
-        # Возвращаем обновлённые данные
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        return jsonify({
-            'success': True,
-            'user': {
-                'id': user[0],
-                'nickname': user[1],
-                'telegram': user[3],
-                'site_url': user[4],
-                'shadow_coins': user[5]
-            }
-        })
+    if 'site_url' in data:
+        site_url = data['site_url'] or None
+        if site_url:
+            if not REMANGA_URL.match(site_url):
+                return None, 'Неверный формат ссылки Remanga'
+            if len(site_url) > 100:
+                return None, 'Ссылка слишком длинная'
+        changes['site_url'] = site_url
+    
+    return changes, None
+
+
+@app.route('/api/profile', methods=['PATCH'])
+@app.route('/api/update_profile', methods=['POST'])
+def update_profile():
+    """Обновить данные профиля пользователя: все изменённые поля одним запросом"""
+    data = request.get_json(silent=True) or {}
+    user_id = data.get('user_id')
+    
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Пользователь не найден'})
+    
+    changes, error = profile_changes(data)
+    if error:
+        return jsonify({'success': False, 'message': error})
+    
+    return jsonify(db.update_profile(user_id, changes))
     
 
 if __name__ == '__main__':
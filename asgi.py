@@ -0,0 +1,297 @@
+"""Асинхронный режим (ASGI) для того же приложения:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Маршруты опроса (/api/public-winners, /api/prizes, /api/user-data) и
+поток событий /api/stream обслуживаются прямо в цикле asyncio: запросы
+к SQLite уходят в отдельный пул потоков БД, а ожидающие клиенты SSE не
+занимают потоков вовсе. Остальные маршруты — то же Flask-приложение в
+собственном пуле потоков (flask_app). JSON-ответы совпадают с Flask-версией.
+
+Поток событий здесь включён по умолчанию (SSE=off выключает его): в отличие
+от синхронных воркеров gunicorn, он не занимает поток на клиента.
+Для тысяч подключений к /api/stream увеличьте SSE_MAX_CLIENTS.
+"""
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+from app import app, db, with_image_urls, start_reconciler, SSE_HEARTBEAT
+from events import TooManySubscribers, format_sse
+from metrics import log
+
+# Ожидающие клиенты SSE не держат потоков — поток событий можно объявлять клиентам
+app.config['SSE_ENABLED'] = os.environ.get('SSE', 'on') != 'off'
+
+# Потоки для запросов к SQLite из асинхронных маршрутов и для остальных (синхронных) маршрутов Flask.
+# Соединение из пула берётся на одну операцию, а не на поток, поэтому
+# потоков может быть больше DB_POOL_SIZE: лишние ждут свободное соединение
+DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', 4))
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 12))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix='db')
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ для HTTP-запроса ASGI (PEP 3333)"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        # Повторяющиеся заголовки склеиваются через запятую
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+
+async def flask_app(scope, receive, send):
+    """Остальные маршруты: Flask-приложение в пуле потоков wsgi_executor.
+
+    Каждый запрос занимает поток пула только на время обработки; ответ
+    (в том числе потоковый — выгрузки CSV) отдаётся кусками по мере генерации.
+    """
+    loop = asyncio.get_running_loop()
+    with SpooledTemporaryFile(max_size=65536) as body:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and response.get('sent'):
+                    raise exc_info[1].with_traceback(exc_info[2])
+                response['start'] = {
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers],
+                }
+
+            chunks = app(wsgi_environ(scope, body), start_response)
+            try:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if not response.get('sent'):
+                        response['sent'] = True
+                        send_sync(response['start'])
+                    send_sync({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                # close() запускает teardown Flask и закрывает генераторы stream_with_context
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+            if not response.get('sent'):
+                send_sync(response['start'])
+            send_sync({'type': 'http.response.body'})
+
+        await loop.run_in_executor(wsgi_executor, run)
+
+
+async def run_db(fn, *args):
+    """Выполнить синхронный вызов RaffleDatabase в пуле потоков БД"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, fn, *args)
+
+
+def query_param(scope, name):
+    values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get(name)
+    return values[0] if values else None
+
+
+def request_header(scope, name):
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def send_response(send, body, status=200, headers=(), content_type=b'application/json'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())] + list(headers),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, data, status=200):
+    # Тело собирает тот же провайдер, что и jsonify, — ответы побайтно совпадают
+    with app.app_context():
+        body = app.json.response(data).get_data()
+    await send_response(send, body, status)
+
+
+async def send_cached(scope, send, body, etag):
+    """Готовый JSON с ETag; 304, если у клиента та же версия"""
+    quoted = f'"{etag}"'
+    headers = [(b'etag', quoted.encode()), (b'cache-control', b'no-cache')]
+    if_none_match = request_header(scope, b'if-none-match') or ''
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    if quoted in tags or '*' in tags:
+        await send({'type': 'http.response.start', 'status': 304, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await send_response(send, body, headers=headers)
+
+
+# ========== АСИНХРОННЫЕ МАРШРУТЫ ==========
+
+async def public_winners(scope, receive, send):
+    body, etag = await run_db(db.get_public_winners_feed)
+    await send_cached(scope, send, body, etag)
+
+
+async def prizes(scope, receive, send):
+    body, etag = await run_db(db.get_available_prizes_json, with_image_urls)
+    await send_cached(scope, send, body, etag)
+
+
+async def user_data(scope, receive, send):
+    user_id = query_param(scope, 'user_id')
+    if not user_id:
+        await send_json(send, {'success': False, 'message': 'Не указан пользователь'})
+        return
+    try:
+        user = await run_db(db.get_user_by_id, user_id)
+    except Exception as e:
+        log.error('user_data.failed', user_id=user_id, error=repr(e))
+        await send_json(send, {'success': False, 'message': str(e)})
+        return
+    if user:
+        await send_json(send, {'success': True, 'user': user})
+    else:
+        await send_json(send, {'success': False, 'message': 'Пользователь не найден'})
+
+
+async def stream(scope, receive, send):
+    """Поток событий (SSE): ожидание в цикле asyncio, без потока на клиента"""
+    if not app.config['SSE_ENABLED']:
+        await send_json(send, {'success': False, 'message': 'Поток событий выключен'}, status=404)
+        return
+
+    try:
+        user_id = int(query_param(scope, 'user_id') or '')
+    except ValueError:
+        user_id = None
+
+    try:
+        subscription = db.events.subscribe(user_id, loop=asyncio.get_running_loop())
+    except TooManySubscribers as e:
+        await send_json(send, {'success': False, 'message': str(e)}, status=503)
+        return
+
+    async def pump():
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        # Клиент переподключится через 5 секунд, если соединение оборвётся
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        while True:
+            events = await subscription.wait_async(timeout=SSE_HEARTBEAT)
+            # Комментарий-пинг держит соединение через прокси
+            chunk = ''.join(format_sse(event) for event in events) if events else ': ping\n\n'
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        db.events.unsubscribe(subscription)
+
+
+ROUTES = {
+    '/api/public-winners': public_winners,
+    '/api/prizes': prizes,
+    '/api/user-data': user_data,
+    '/api/stream': stream,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Асинхронные маршруты идут мимо before_request Flask
+                start_reconciler()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                db_executor.shutdown(wait=False)
+                wsgi_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] == 'websocket':
+        # WebSocket не поддерживается: отказ до принятия соединения (403 у клиента)
+        await receive()
+        await send({'type': 'websocket.close', 'code': 1003})
+        return
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get(scope.get('path')) if scope.get('method') == 'GET' else None
+    if handler is None:
+        await flask_app(scope, receive, send)
+        return
+
+    # Сервер без lifespan (uvicorn --lifespan off): запуск при первом запросе
+    start_reconciler()
+
+    # Замер как у маршрутов Flask (для /api/stream — длительность подключения)
+    started = time.perf_counter()
+    try:
+        await handler(scope, receive, send)
+    except Exception:
+        db.metrics.observe('route', scope['path'], time.perf_counter() - started, error=True)
+        raise
+    db.metrics.observe('route', scope['path'], time.perf_counter() - started)
@@ -0,0 +1,96 @@
+"""Манифест статики: адреса с хэшем содержимого и предсжатые варианты.
+
+При старте каждый файл из static/ хэшируется, и style.css отдаётся как
+/assets/style.<hash>.css с Cache-Control: immutable на год — при новой
+версии файла меняется адрес, поэтому браузеру не нужно перепроверять
+старый. Текстовые файлы заранее сжимаются gzip и brotli (если установлен
+пакет Brotli) и отдаются по Accept-Encoding.
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:  # без Brotli отдаём только gzip
+    brotli = None
+
+CACHE_MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE = {'.css', '.js', '.html', '.svg', '.json', '.txt', '.map'}
+
+
+class AssetManifest:
+    """Соответствие 'images/card1.webp' <-> 'images/card1.<hash>.webp'.
+
+    Файлы, появившиеся после старта (загруженные картинки призов),
+    хэшируются при первом запросе адреса.
+    """
+
+    def __init__(self, folder, url_prefix='/assets'):
+        self.folder = os.path.abspath(folder)
+        self.url_prefix = url_prefix
+        self._lock = threading.Lock()
+        self._urls = {}        # исходный путь -> путь с хэшем
+        self._files = {}       # путь с хэшем -> исходный путь
+        self._compressed = {}  # путь с хэшем -> {'br': bytes, 'gzip': bytes}
+
+    def build(self):
+        """Захэшировать всё содержимое папки (вызывается при старте)"""
+        for root, dirs, files in os.walk(self.folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.relpath(os.path.join(root, name), self.folder)
+                self._add(path.replace(os.sep, '/'))
+        return self
+
+    def _add(self, path):
+        full = os.path.join(self.folder, path)
+        with open(full, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        base, ext = os.path.splitext(path)
+        hashed = f"{base}.{digest}{ext}"
+
+        variants = {}
+        if ext.lower() in COMPRESSIBLE:
+            # Сжатый вариант храним, только если он заметно меньше оригинала
+            candidates = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates['br'] = brotli.compress(data, quality=11)
+            variants = {
+                encoding: body for encoding, body in candidates.items()
+                if len(body) < len(data) * 0.9
+            }
+
+        with self._lock:
+            self._urls[path] = hashed
+            self._files[hashed] = path
+            if variants:
+                self._compressed[hashed] = variants
+        return hashed
+
+    def url(self, path):
+        """Адрес файла с хэшем; /static/<path>, если файла нет"""
+        hashed = self._urls.get(path)
+        if hashed is None:
+            if '..' in path.split('/') or not os.path.isfile(os.path.join(self.folder, path)):
+                return f"/static/{path}"
+            hashed = self._add(path)
+        return f"{self.url_prefix}/{hashed}"
+
+    def resolve(self, hashed, accepted=()):
+        """(исходный путь, кодировка, сжатое тело) для пути с хэшем; None, если не знаем.
+
+        accepted — кодировки, которые принимает клиент ('br', 'gzip').
+        """
+        path = self._files.get(hashed)
+        if path is None:
+            return None
+        variants = self._compressed.get(hashed, {})
+        for encoding in ('br', 'gzip'):
+            if encoding in variants and encoding in accepted:
+                return path, encoding, variants[encoding]
+        return path, None, None
@@ -0,0 +1,227 @@
+"""Нагрузочный тест API со смесью запросов, похожей на реальную.
+
+В процессе, через тестовый клиент Flask (база засевается заново):
+    python benchmarks/bench_app.py [--concurrency 8] [--seconds 10] [--output app.json]
+
+Против запущенного сервера (gunicorn, uvicorn asgi:application):
+    python benchmarks/seed.py bench.db --users 10000
+    RAFFLE_DB=bench.db RATE_LIMIT=off gunicorn -w 4 --threads 8 app:app
+    python benchmarks/bench_app.py --url http://127.0.0.1:8000 --users 10000
+
+Смесь (MIX): опрос победителей и призов, данные пользователя, прокрутки,
+вход, регистрация и страницы админки. Для каждого сценария — p50/p95/p99
+и пропускная способность; ошибка — ответ 5xx или success: false.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from common import summarize, print_row, report, write_report
+from seed import seed, PASSWORD
+
+# Сценарий -> доля в смеси
+MIX = {
+    'poll_winners': 35,
+    'poll_prizes': 15,
+    'user_data': 15,
+    'spin': 20,
+    'login': 5,
+    'register': 3,
+    'user_wins': 4,
+    'admin_users': 2,
+    'admin_transactions': 1,
+}
+
+
+class TestClientTarget:
+    """Запросы через app.test_client() в том же процессе"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, form=None, headers=None):
+        response = self.client.open(path, method=method, json=body, data=form, headers=headers or {})
+        return response.status_code, response.headers, response.get_data()
+
+
+class HttpTarget:
+    """Запросы к серверу по HTTP/1.1 с keep-alive (по соединению на поток)"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.cookie = None
+
+    def request(self, method, path, body=None, form=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            payload = '&'.join(f'{key}={value}' for key, value in form.items())
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.conn.request(method, path, payload, headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status, response.headers, data
+
+
+class Worker:
+    """Один виртуальный пользователь: свой клиент, свой ETag, свой случайный поток"""
+
+    def __init__(self, target, users, rng, fresh, admin):
+        self.target = target
+        self.users = users
+        self.rng = rng
+        self.fresh = fresh
+        self.etags = {}
+        if admin:
+            target.request('POST', '/admin/login', form={'username': admin[0], 'password': admin[1]})
+
+    def user(self):
+        return self.rng.randint(1, self.users)
+
+    def poll(self, path):
+        # Клиент опрашивает с If-None-Match, как game.js
+        headers = {'If-None-Match': self.etags[path]} if path in self.etags else {}
+        status, headers, data = self.target.request('GET', path, headers=headers)
+        if headers.get('ETag'):
+            self.etags[path] = headers['ETag']
+        return status, None
+
+    def poll_winners(self):
+        return self.poll('/api/public-winners')
+
+    def poll_prizes(self):
+        return self.poll('/api/prizes')
+
+    def user_data(self):
+        return self.json('GET', f'/api/user-data?user_id={self.user()}')
+
+    def user_wins(self):
+        return self.json('GET', f'/api/user-wins?user_id={self.user()}')
+
+    def spin(self):
+        return self.json('POST', '/api/draw', {'user_id': self.user()})
+
+    def login(self):
+        return self.json('POST', '/api/login_with_password', {'nickname': f'user{self.user()}', 'password': PASSWORD})
+
+    def register(self):
+        n = next(self.fresh)
+        return self.json('POST', '/api/register_with_password', {
+            'nickname': f'load{n}', 'password': PASSWORD, 'telegram': f'@load{n}'
+        })
+
+    def admin_users(self):
+        return self.json('GET', '/api/admin/users?limit=100')
+
+    def admin_transactions(self):
+        return self.json('GET', '/api/admin/transactions?limit=100')
+
+    def json(self, method, path, body=None):
+        status, _, data = self.target.request(method, path, body=body)
+        return status, json.loads(data) if status < 500 else None
+
+
+def run(make_target, users, concurrency, seconds, seed_value, admin):
+    names = list(MIX)
+    weights = [MIX[name] for name in names]
+    samples = {name: [] for name in names}
+    errors = dict.fromkeys(names, 0)
+    lock = threading.Lock()
+    # Уникальные ники регистраций, даже если база переиспользуется между запусками
+    fresh = itertools.count(int(time.time() * 1000))
+    deadline = time.perf_counter() + seconds
+    ready = threading.Barrier(concurrency + 1)
+
+    def loop(index):
+        rng = random.Random(seed_value * 1000 + index)
+        worker = Worker(make_target(), users, rng, fresh, admin)
+        local = {name: [] for name in names}
+        failed = dict.fromkeys(names, 0)
+        ready.wait()
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status, data = getattr(worker, name)()
+                ok = status < 500 and (data is None or data.get('success') is not False)
+            except Exception:
+                ok = False
+            local[name].append(time.perf_counter() - started)
+            failed[name] += not ok
+        with lock:
+            for name in names:
+                samples[name].extend(local[name])
+                errors[name] += failed[name]
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    results = [summarize(name, samples[name], elapsed, errors[name]) for name in names]
+    everything = [sample for name in names for sample in samples[name]]
+    results.append(summarize('total', everything, elapsed, sum(errors.values())))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='адрес запущенного сервера (иначе — тестовый клиент Flask)')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--prizes', type=int, default=1000)
+    parser.add_argument('--winners', type=int, default=20000)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--admin', default='admin:admin123', help='логин:пароль админа')
+    parser.add_argument('--output', help='записать отчёт в файл')
+    parser.add_argument('--json', action='store_true', help='вывести отчёт в JSON')
+    args = parser.parse_args()
+    admin = tuple(args.admin.split(':', 1))
+
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'json', 'admin')}
+    if args.url:
+        results = run(lambda: HttpTarget(args.url), args.users, args.concurrency, args.seconds, args.seed, admin)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.db')
+            params['scale'] = seed(path, args.users, args.prizes, args.winners, args.transactions, args.seed)
+            print(f"🌱 База: {params['scale']}")
+            os.environ['RAFFLE_DB'] = path
+            os.environ['RATE_LIMIT_DB'] = os.path.join(tmp, 'ratelimit.db')
+            os.environ.setdefault('RATE_LIMIT', 'off')
+            from app import app
+            results = run(lambda: TestClientTarget(app), args.users, args.concurrency, args.seconds, args.seed, admin)
+
+    for row in results:
+        print_row(row)
+    write_report(report('app', params, results), args.output, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Микробенчмарки методов RaffleDatabase на засеянной базе.
+
+    python benchmarks/bench_db.py [--users 10000] [--iterations 200]
+        [--only get_stats,draw_prize] [--output db.json] [--json]
+
+База каждый раз засевается заново (seed.py) во временной папке, поэтому
+запуски на разных коммитах сравнимы. Изменяющие методы (draw_prize,
+add_shadow_coins, ...) выполняются последними, чтобы не менять данные
+для читающих.
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+
+from common import summarize, print_row, report, write_report
+from seed import seed, PASSWORD
+
+from database import RaffleDatabase
+
+
+def cases(db, users, rng):
+    """(имя, вызов) — читающие методы, затем изменяющие"""
+    user = lambda: rng.randint(1, users)  # noqa: E731
+    nickname = lambda: f'user{user()}'  # noqa: E731
+    fresh = itertools.count(1)
+
+    return [
+        ('get_user_by_id', lambda: db.get_user_by_id(user())),
+        ('get_user_by_nickname', lambda: db.get_user_by_nickname(nickname())),
+        ('get_user_coins', lambda: db.get_user_coins(user())),
+        ('check_nickname_exists', lambda: db.check_nickname_exists(nickname())),
+        ('get_available_prizes', db.get_available_prizes),
+        ('get_available_prizes_json', db.get_available_prizes_json),
+        ('get_public_winners', db.get_public_winners),
+        ('get_public_winners_feed', db.get_public_winners_feed),
+        ('get_user_wins', lambda: db.get_user_wins(user())),
+        ('get_full_winners(100)', lambda: db.get_full_winners(limit=100)),
+        ('get_all_users_admin(100)', lambda: db.get_all_users_admin(limit=100)),
+        ('get_all_prizes_admin(100)', lambda: db.get_all_prizes_admin(limit=100)),
+        ('get_transactions(100)', lambda: db.get_transactions(limit=100)),
+        ('get_transactions(user, 100)', lambda: db.get_transactions(user(), limit=100)),
+        ('get_table_counts', db.get_table_counts),
+        ('get_stats', db.get_stats),
+        ('export_batches(transactions, 1000)', lambda: next(db.export_batches('transactions'), None)),
+        ('login_with_password', lambda: db.login_with_password(nickname(), PASSWORD)),
+        ('register_with_password', lambda: db.register_with_password(
+            f'bench{next(fresh)}', PASSWORD, f'@bench{rng.random()}')),
+        ('add_shadow_coins', lambda: db.add_shadow_coins(user(), 10, 'Бенчмарк')),
+        ('remove_shadow_coins', lambda: db.remove_shadow_coins(user(), 1, 'Бенчмарк')),
+        ('spend_shadow_coin', lambda: db.spend_shadow_coin(user())),
+        ('draw_prize', lambda: db.draw_prize(user())),
+        ('draw_prizes(5)', lambda: db.draw_prizes(user(), 5)),
+    ]
+
+
+def run(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        try:
+            result = fn()
+        except Exception:
+            errors += 1
+        else:
+            # Методы сообщают об отказе словарём или False
+            if result is False or (isinstance(result, dict) and result.get('success') is False):
+                errors += 1
+        samples.append(time.perf_counter() - t)
+    return samples, time.perf_counter() - started, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--prizes', type=int, default=1000)
+    parser.add_argument('--winners', type=int, default=20000)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--only', help='имена сценариев через запятую')
+    parser.add_argument('--output', help='записать отчёт в файл')
+    parser.add_argument('--json', action='store_true', help='вывести отчёт в JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        scale = seed(path, args.users, args.prizes, args.winners, args.transactions, args.seed)
+        print(f"🌱 База: {scale}")
+
+        db = RaffleDatabase(path)
+        rng = random.Random(args.seed)
+        only = set(args.only.split(',')) if args.only else None
+
+        results = []
+        for name, fn in cases(db, args.users, rng):
+            if only and name not in only:
+                continue
+            samples, elapsed, errors = run(fn, args.iterations, args.warmup)
+            row = summarize(name, samples, elapsed, errors)
+            results.append(row)
+            print_row(row)
+
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'json')}
+    write_report(report('db', {**params, 'scale': scale}, results), args.output, args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Сколько входов в секунду выдерживает одно ядро при разных параметрах хэширования.
+
+    python benchmarks/bench_passwords.py [--seconds 2] [--workers 1] [--json]
+
+Для каждой настройки считается проверка пароля (verify) — именно она
+выполняется при каждом входе. С --workers N проверки идут через
+PasswordHasher с N потоками, как в приложении; итог делится на N.
+Подбирайте PASSWORD_SCRYPT_N / PASSWORD_PBKDF2_ITERATIONS так, чтобы
+пиковый поток входов укладывался в PASSWORD_HASH_WORKERS ядер.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher, verify_legacy  # noqa: E402
+
+SETTINGS = [
+    ('scrypt', {'scrypt_n': 2 ** 12}),
+    ('scrypt', {'scrypt_n': 2 ** 13}),
+    ('scrypt', {'scrypt_n': 2 ** 14}),
+    ('scrypt', {'scrypt_n': 2 ** 15}),
+    ('scrypt', {'scrypt_n': 2 ** 16}),
+    ('pbkdf2', {'pbkdf2_iterations': 100000}),
+    ('pbkdf2', {'pbkdf2_iterations': 300000}),
+    ('pbkdf2', {'pbkdf2_iterations': 600000}),
+    ('pbkdf2', {'pbkdf2_iterations': 1000000}),
+]
+
+PASSWORD = 'correct horse battery staple'
+
+
+def measure(verify, seconds, workers):
+    """Число проверок в секунду на одно ядро"""
+    done = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while time.perf_counter() - started < seconds:
+            list(pool.map(lambda _: verify(), range(workers)))
+            done += workers
+    elapsed = time.perf_counter() - started
+    return done / elapsed / workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2.0, help='время на одну настройку')
+    parser.add_argument('--workers', type=int, default=1, help='потоков хэширования')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args()
+
+    results = []
+    for algorithm, cost in SETTINGS:
+        hasher = PasswordHasher(algorithm, workers=args.workers, max_pending=args.workers * 2, **cost)
+        hashed = hasher.current.hash(PASSWORD)
+        rate = measure(lambda: hasher.verify(PASSWORD, hashed), args.seconds, args.workers)
+        results.append({
+            'algorithm': algorithm,
+            'cost': cost,
+            'logins_per_sec_per_core': round(rate, 1),
+            'ms_per_login': round(1000 / rate, 2),
+        })
+        print(f"{algorithm:8} {json.dumps(cost):32} {rate:10.1f} входов/с на ядро  {1000 / rate:8.2f} мс")
+
+    salt = '00112233445566778899aabbccddeeff'
+    legacy = f"{salt}:{hashlib.sha256((PASSWORD + salt).encode()).hexdigest()}"
+    rate = measure(lambda: verify_legacy(PASSWORD, legacy), args.seconds, 1)
+    results.append({
+        'algorithm': 'legacy_sha256',
+        'cost': {},
+        'logins_per_sec_per_core': round(rate, 1),
+        'ms_per_login': round(1000 / rate, 4),
+    })
+    print(f"{'sha256':8} {'(старый формат)':32} {rate:10.1f} входов/с на ядро")
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Общее для бенчмарков: перцентили и отчёт в JSON, сравнимый между коммитами."""
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentile(sorted_samples, p):
+    """Перцентиль методом ближайшего ранга (samples уже отсортированы)"""
+    if not sorted_samples:
+        return 0.0
+    rank = max(1, -(-len(sorted_samples) * p // 100))
+    return sorted_samples[int(rank) - 1]
+
+
+def summarize(name, samples, elapsed, errors=0):
+    """Задержки (секунды) одного сценария -> строка отчёта в миллисекундах"""
+    ordered = sorted(samples)
+    return {
+        'name': name,
+        'count': len(ordered),
+        'errors': errors,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        'ops_per_sec': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def print_row(row):
+    print(
+        f"{row['name']:36} {row['count']:8} "
+        f"p50 {row['p50_ms']:9.3f}  p95 {row['p95_ms']:9.3f}  p99 {row['p99_ms']:9.3f} мс  "
+        f"{row['ops_per_sec']:10.1f} оп/с" + (f"  ошибок: {row['errors']}" if row['errors'] else '')
+    )
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(benchmark, params, results):
+    """Отчёт с параметрами запуска и окружением"""
+    return {
+        'benchmark': benchmark,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+
+
+def write_report(data, output=None, to_stdout=False):
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"💾 Отчёт: {output}")
+    if to_stdout:
+        print(text)
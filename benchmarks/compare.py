@@ -0,0 +1,40 @@
+"""Сравнение двух отчётов бенчмарка (например, до и после изменения).
+
+    python benchmarks/compare.py before.json after.json [--metric p95_ms]
+
+Для каждого сценария — значение в обоих отчётах и изменение в процентах
+(для задержек минус — лучше, для оп/с — хуже).
+"""
+import argparse
+import json
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return data, {row['name']: row for row in data['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--metric', default='p95_ms', help='p50_ms, p95_ms, p99_ms, mean_ms, ops_per_sec')
+    args = parser.parse_args()
+
+    before_data, before = load(args.before)
+    after_data, after = load(args.after)
+    print(f"{args.metric}: {before_data.get('commit')} -> {after_data.get('commit')}")
+
+    for name in list(before) + [name for name in after if name not in before]:
+        old = before.get(name, {}).get(args.metric)
+        new = after.get(name, {}).get(args.metric)
+        if old is None or new is None:
+            print(f"{name:36} {old if old is not None else '—':>12} {new if new is not None else '—':>12}")
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else '—'
+        print(f"{name:36} {old:12.3f} {new:12.3f} {change:>9}")
+
+
+if __name__ == '__main__':
+    main()
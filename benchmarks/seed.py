@@ -0,0 +1,118 @@
+"""Тестовая база заданного размера для бенчмарков.
+
+    python benchmarks/seed.py bench.db [--users 10000] [--prizes 1000]
+        [--winners 20000] [--transactions 100000] [--seed 1]
+
+Данные воспроизводимы: одинаковые параметры и --seed дают одинаковую базу.
+Пользователи — user1..userN с паролем PASSWORD, у каждого стартовое
+начисление, так что прокрутки в бенчмарках не упираются в пустой баланс;
+балансы равны сумме транзакций. --prizes — доступные призы, для каждого
+победителя дополнительно создаётся уже разыгранный приз.
+"""
+import argparse
+import datetime
+import os
+import random
+import time
+
+from common import ROOT  # noqa: F401 — путь к модулям приложения
+
+from database import RaffleDatabase
+
+PASSWORD = 'bench-password'
+START_COINS = 1000
+EPOCH = datetime.datetime(2025, 1, 1)
+DAYS = 90
+
+
+def _timestamp(rng):
+    moment = EPOCH + datetime.timedelta(seconds=rng.randrange(DAYS * 24 * 3600))
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def seed(path, users=10000, prizes=1000, winners=20000, transactions=100000, seed=1):
+    """Создать базу path заново и заполнить её; вернуть фактические размеры"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = random.Random(seed)
+    db = RaffleDatabase(path)
+    # Один хэш на всех: бенчмарк входа меряет проверку, а не засев
+    hashed = db.passwords.hash(PASSWORD)
+    # Засев — одна долгая операция, отдельное соединение вне пула
+    conn = db.pool.open_connection()
+
+    # Картинки берём у стартовых призов — файлы для них есть в static/images
+    templates = conn.execute("SELECT image, thumb, detail FROM prizes").fetchall()
+
+    balances = [START_COINS] * users
+    ledger = [(i + 1, START_COINS, 'Стартовое начисление', 1, _timestamp(rng)) for i in range(users)]
+    for _ in range(max(transactions - users, 0)):
+        user = rng.randrange(users)
+        if balances[user] > 0 and rng.random() < 0.6:
+            amount = -rng.randint(1, min(balances[user], 10))
+            reason = 'Прокрутка рулетки'
+        else:
+            amount = rng.randint(1, 100)
+            reason = 'Начисление'
+        balances[user] += amount
+        ledger.append((user + 1, amount, reason, 1 if amount > 0 else None, _timestamp(rng)))
+
+    with conn:
+        conn.executemany('''
+            INSERT INTO users (id, nickname, password, telegram, site_url, shadow_coins, created_at, last_login)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            (i + 1, f'user{i + 1}', hashed, f'@user{i + 1}',
+             f'https://example.com/user{i + 1}' if i % 3 == 0 else None,
+             balances[i], _timestamp(rng), _timestamp(rng))
+            for i in range(users)
+        ))
+
+        conn.executemany('''
+            INSERT INTO coin_transactions (user_id, amount, reason, admin_id, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', ledger)
+
+        def prize_rows(count, available):
+            for i in range(count):
+                image, thumb, detail = templates[i % len(templates)]
+                yield (f'Приз #{i + 1}', image, f'Описание приза {i + 1}', available,
+                       rng.randint(1, 10), thumb, detail, _timestamp(rng))
+
+        insert_prize = '''
+            INSERT INTO prizes (name, image, description, available, weight, thumb, detail, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+        first_won = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM prizes").fetchone()[0]
+        conn.executemany(insert_prize, prize_rows(winners, 0))
+        conn.executemany(insert_prize, prize_rows(prizes, 1))
+
+        conn.executemany(
+            "INSERT INTO winners (user_id, prize_id, won_at) VALUES (?, ?, ?)",
+            ((rng.randint(1, users), first_won + i, _timestamp(rng)) for i in range(winners))
+        )
+
+    conn.execute("PRAGMA optimize")
+    conn.close()
+    return db.get_table_counts()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default='bench.db')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--prizes', type=int, default=1000, help='доступных призов')
+    parser.add_argument('--winners', type=int, default=20000)
+    parser.add_argument('--transactions', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = seed(args.path, args.users, args.prizes, args.winners, args.transactions, args.seed)
+    print(f"✅ {args.path}: {counts} за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+class _Lease:
+    """Аренда соединения на одну операцию: with pool.connection() as conn.
+
+    Как и у sqlite3.Connection, выход из with фиксирует транзакцию (или
+    откатывает при исключении). Вложенные with в том же потоке получают то
+    же соединение; фиксирует и возвращает его в пул только внешний with,
+    иначе выход из вложенного закоммитил бы половину внешней транзакции.
+    Число потоков не ограничено размером пула: лишние ждут своей очереди.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        return self.pool._acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        local = self.pool._local
+        local.depth -= 1
+        if local.depth > 0:
+            return False  # транзакцию завершит внешний with
+        conn, local.conn = local.conn, None
+        try:
+            conn.__exit__(exc_type, exc, tb)
+        finally:
+            self.pool._release(conn)
+        return False
+
+
+class ConnectionPool:
+    """Ограниченный пул SQLite-соединений, соединение выдаётся на время with.
+
+    PRAGMA настраиваются один раз при открытии соединения. Счётчики
+    hits/misses/waits/timeouts нужны, чтобы подобрать размер пула под нагрузку.
+    """
+
+    def __init__(self, db_name, max_size=16, timeout=10.0, busy_timeout_ms=5000, metrics=None):
+        self.db_name = db_name
+        self.metrics = metrics
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+
+        self._cond = threading.Condition(threading.RLock())
+        self._reset()
+
+    def _reset(self):
+        """Сбросить состояние (при создании и после fork в воркере gunicorn)"""
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._idle = []
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def open_connection(self):
+        """Отдельное соединение вне лимита пула (поток-писатель держит его всё время)"""
+        return self._connect()
+
+    def open_reader(self):
+        """Отдельное соединение только для чтения (долгие выгрузки), вне лимита пула.
+
+        Не занимает слот пула; закрывает вызывающий код.
+        """
+        conn = sqlite3.connect(
+            f"file:{quote(os.path.abspath(self.db_name))}?mode=ro",
+            uri=True,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    def _release(self, conn):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def connection(self):
+        """Аренда соединения: with pool.connection() as conn"""
+        return _Lease(self)
+
+    def current(self):
+        """Соединение, которое текущий поток держит внутри with, или None"""
+        if self._pid != os.getpid():
+            return None
+        return getattr(self._local, 'conn', None)
+
+    def _acquire(self):
+        if self._pid != os.getpid():
+            # Соединения SQLite нельзя использовать после fork — просто забываем их
+            with self._cond:
+                if self._pid != os.getpid():
+                    self._reset()
+
+        if getattr(self._local, 'conn', None) is not None:
+            self._local.depth += 1
+            with self._cond:
+                self._hits += 1
+            return self._local.conn
+
+        with self._cond:
+            if self._idle:
+                conn = self._idle.pop()
+                self._hits += 1
+            elif self._size < self.max_size:
+                self._size += 1
+                self._misses += 1
+                conn = None
+            else:
+                self._waits += 1
+                started = time.monotonic()
+                deadline = started + self.timeout
+                while not self._idle:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._wait_time += time.monotonic() - started
+                        if self.metrics is not None:
+                            self.metrics.observe('lock', 'db_pool', time.monotonic() - started, error=True)
+                        raise PoolTimeout('Пул соединений исчерпан')
+                    self._cond.wait(remaining)
+                waited = time.monotonic() - started
+                self._wait_time += waited
+                conn = self._idle.pop()
+                if self.metrics is not None:
+                    self.metrics.observe('lock', 'db_pool', waited)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def stats(self):
+        """Счётчики пула для подбора размера"""
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'hits': self._hits,
+                'misses': self._misses,
+                'waits': self._waits,
+                'wait_time_seconds': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+            }
+
+    def close_all(self):
+        """Закрыть свободные соединения (занятые вернутся в пул после своих with)"""
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle = []
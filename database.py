@@ -1,97 +1,171 @@
 import sqlite3
-import random
 import json
-import hashlib
-import secrets
+import os
+import base64
+from connection_pool import ConnectionPool
+from ledger import CoinLedger, LedgerError, InsufficientCoins, MAX_COINS, MAX_COINS_PER_TRANSACTION
+from ledger_archive import LedgerArchive, ArchiveMismatch, ROW_COLUMNS, default_archive_path, summarize
+from prize_pool import PrizePool, NotEnoughPrizes
+from migrations import migrate
+from winners_feed import WinnersFeed
+from prizes_cache import PrizesCache
+from passwords import PasswordHasher, HasherBusy
+from events import EventBus
+from write_queue import WriteQueue
+from user_cache import UserCache
+from reconciler import BalanceReconciler, ReconcileConflict
+from metrics import Metrics, log
+
+def encode_cursor(*values):
+    """Непрозрачный курсор keyset-пагинации из значений ключей сортировки"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Значения ключей из курсора; ValueError, если курсор испорчен"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Неверный курсор')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Неверный курсор')
+    return values
+
+
+# Колонки профиля, которые отдаются клиенту (без хэша пароля)
+USER_COLUMNS = 'id, nickname, telegram, site_url, shadow_coins'
+
+
+def user_dict(row):
+    """Строка (USER_COLUMNS) -> словарь профиля"""
+    return {
+        'id': row[0],
+        'nickname': row[1],
+        'telegram': row[2],
+        'site_url': row[3],
+        'shadow_coins': row[4]
+    }
+
+
+# Сообщения при нарушении уникальности полей пользователя
+UNIQUE_MESSAGES = {
+    'users.nickname': 'Никнейм уже занят',
+    'users.telegram': 'Telegram уже зарегистрирован',
+    'users.site_url': 'Ссылка уже зарегистрирована',
+}
+
+# То же при изменении профиля (тексты прежнего /api/update_profile)
+PROFILE_UNIQUE_MESSAGES = {
+    'users.nickname': 'Никнейм уже занят',
+    'users.telegram': 'Telegram уже используется',
+    'users.site_url': 'Ссылка уже используется',
+}
+
+# Поля, которые пользователь меняет сам
+PROFILE_FIELDS = ('nickname', 'telegram', 'site_url')
+
 
 class RaffleDatabase:
     
-    def _hash_password(self, password):
-        salt = secrets.token_hex(16)
-        hash_obj = hashlib.sha256((password + salt).encode())
-        return f"{salt}:{hash_obj.hexdigest()}"
-    
-    def _verify_password(self, password, hashed):
-        if not hashed or ':' not in hashed:
-            return False
-        salt, hash_value = hashed.split(':')
-        hash_obj = hashlib.sha256((password + salt).encode())
-        return hash_obj.hexdigest() == hash_value
-    
     def register_with_password(self, nickname, password, telegram=None, site_url=None):
     
-        print(f"📝 Регистрация с паролем: {nickname}")
+        log.info('register_with_password', nickname=nickname)
         
+        # Все три уникальных поля — одним запросом, до дорогого хэширования
+        taken = self._registration_conflict(nickname, telegram, site_url)
+        if taken:
+            return {'success': False, 'message': taken}
+        
+        # Хешируем пароль (в пуле хэширования, не в потоке запроса)
+        try:
+            hashed_password = self.passwords.hash(password)
+        except HasherBusy as e:
+            return {'success': False, 'busy': True, 'message': str(e)}
+        
+        def insert(conn):
+            return conn.execute(f'''
+                INSERT INTO users (nickname, password, telegram, site_url, shadow_coins)
+                VALUES (?, ?, ?, ?, 0)
+                RETURNING {USER_COLUMNS}
+            ''', (nickname, hashed_password, telegram, site_url)).fetchone()
+        
+        token = self.user_cache.token()
+        try:
+            user = self._transaction(insert)
+        except sqlite3.IntegrityError as e:
+            # Поле заняли между проверкой и вставкой — сообщение по имени ограничения
+            return {'success': False, 'message': self._unique_violation_message(e)}
+        except Exception as e:
+            return {'success': False, 'message': f'Ошибка регистрации: {str(e)}'}
+        
+        user = user_dict(user)
+        self.user_cache.fill(user['id'], user, token)
+        return {'success': True, 'user': user}
+    
+    def _registration_conflict(self, nickname, telegram, site_url):
+        """Сообщение о первом занятом уникальном поле или None"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Проверяем уникальность
-            if self.check_nickname_exists(nickname):
-                return {'success': False, 'message': 'Никнейм уже занят'}
-            
-            if telegram and self.check_telegram_exists(telegram):
-                return {'success': False, 'message': 'Telegram уже зарегистрирован'}
-            
-            if site_url and self.check_site_url_exists(site_url):
-                return {'success': False, 'message': 'Ссылка уже зарегистрирована'}
-            
-            # Хешируем пароль
-            hashed_password = self._hash_password(password)
-            
-            try:
-                cursor.execute('''
-                    INSERT INTO users (nickname, password, telegram, site_url, shadow_coins)
-                    VALUES (?, ?, ?, ?, 0)
-                ''', (nickname, hashed_password, telegram, site_url))
-                conn.commit()
-                
-                cursor.execute("SELECT * FROM users WHERE nickname = ?", (nickname,))
-                user = cursor.fetchone()
-                
-                return {
-                    'success': True,
-                    'user': {
-                        'id': user[0],
-                        'nickname': user[1],
-                        'telegram': user[3],
-                        'site_url': user[4],
-                        'shadow_coins': user[5]
-                    }
-                }
-            except Exception as e:
-                return {'success': False, 'message': f'Ошибка регистрации: {str(e)}'}
+            taken = conn.execute('''
+                SELECT
+                    EXISTS (SELECT 1 FROM users WHERE nickname = ?),
+                    EXISTS (SELECT 1 FROM users WHERE telegram = ?),
+                    EXISTS (SELECT 1 FROM users WHERE site_url = ?)
+            ''', (nickname, telegram, site_url)).fetchone()
+        for column, is_taken in zip(('nickname', 'telegram', 'site_url'), taken):
+            if is_taken:
+                return UNIQUE_MESSAGES[f'users.{column}']
+        return None
+    
+    def _unique_violation_message(self, error, messages=UNIQUE_MESSAGES, prefix='Ошибка регистрации'):
+        """IntegrityError 'UNIQUE constraint failed: users.<поле>' -> текст для пользователя"""
+        for constraint, message in messages.items():
+            if constraint in str(error):
+                return message
+        return f'{prefix}: {error}'
             
     def login_with_password(self, nickname, password):
+        token = self.user_cache.token()
+        # Соединение нужно только на чтение строки: хэширование (и ожидание
+        # в его очереди) идёт без аренды, иначе поток входов займёт весь пул
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM users WHERE nickname = ?", (nickname,))
-            user = cursor.fetchone()
-            
-            if not user:
-                return {'success': False, 'message': 'Пользователь не найден'}
-            
-            # Проверяем пароль (user[2] - это поле password)
-            if not self._verify_password(password, user[2]):
-                return {'success': False, 'message': 'Неверный пароль'}
-            
-            # Обновляем время последнего входа
-            cursor.execute(
-                "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE nickname = ?",
+            user = conn.execute(
+                "SELECT id, nickname, password, telegram, site_url, shadow_coins FROM users WHERE nickname = ?",
                 (nickname,)
+            ).fetchone()
+        
+        if not user:
+            return {'success': False, 'message': 'Пользователь не найден'}
+        
+        # Проверяем пароль (user[2] - это поле password)
+        try:
+            ok, rehash = self.passwords.verify(password, user[2])
+            if ok and rehash:
+                # Старый формат или параметры — пересчитываем, пока пароль известен
+                new_hash = self.passwords.hash(password)
+        except HasherBusy as e:
+            return {'success': False, 'busy': True, 'message': str(e)}
+        
+        if not ok:
+            return {'success': False, 'message': 'Неверный пароль'}
+        
+        def touch(conn):
+            # Время последнего входа (и хэш, если его не сменили параллельно)
+            conn.execute(
+                "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
+                (user[0],)
             )
-            conn.commit()
-            
-            return {
-                'success': True,
-                'user': {
-                    'id': user[0],
-                    'nickname': user[1],
-                    'telegram': user[3],
-                    'site_url': user[4],
-                    'shadow_coins': user[5]
-                }
-            } 
+            if rehash:
+                conn.execute(
+                    "UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                    (new_hash, user[0], user[2])
+                )
+        
+        self._transaction(touch)
+        
+        # Свежий профиль — в кэш (если его не изменили, пока шёл вход)
+        profile = user_dict((user[0], user[1], user[3], user[4], user[5]))
+        self.user_cache.fill(user[0], profile, token)
+        return {'success': True, 'user': profile}
             
     def check_site_url_exists(self, site_url):
         if not site_url:
@@ -114,13 +188,87 @@ class RaffleDatabase:
             cursor.execute("SELECT id FROM users WHERE nickname = ?", (nickname,))
             return cursor.fetchone() is not None               
 
-    def __init__(self, db_name="raffle.db"):
+    def __init__(self, db_name="raffle.db", pool_size=None):
         self.db_name = db_name
+        # Гистограммы задержек методов, ожидания пула и очереди записи (/metrics)
+        self.metrics = Metrics()
+        self.pool = ConnectionPool(
+            db_name,
+            max_size=pool_size or int(os.environ.get('DB_POOL_SIZE', 16)),
+            metrics=self.metrics
+        )
+        self.ledger = CoinLedger()
+        # Файл, куда compact_ledger переносит старые строки coin_transactions
+        self.ledger_archive = LedgerArchive(default_archive_path(db_name))
+        self.prize_pool = PrizePool()
+        self.winners_feed = WinnersFeed()
+        self.prizes_cache = PrizesCache()
+        # Пул хэширования паролей: не больше PASSWORD_HASH_WORKERS ядер на входы
+        self.passwords = PasswordHasher(
+            algorithm=os.environ.get('PASSWORD_HASHER', 'scrypt'),
+            workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 1)),
+            max_pending=int(os.environ.get('PASSWORD_HASH_QUEUE', 32)),
+            scrypt_n=int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14)),
+            pbkdf2_iterations=int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+        )
+        self.events = EventBus(
+            max_subscribers=int(os.environ.get('SSE_MAX_CLIENTS', 100))
+        )
+        # Профили по id для /api/user-data; сбрасываются при каждой записи (и из других воркеров)
+        self.user_cache = UserCache(
+            max_size=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+            ttl=float(os.environ.get('USER_CACHE_TTL', 10)),
+            sync_interval=float(os.environ.get('USER_CACHE_SYNC_MS', 200)) / 1000
+        )
+        # Групповой коммит: изменения из всех потоков — пачками в одном потоке-писателе
+        self.writes = WriteQueue(
+            # У писателя своё соединение вне лимита пула: он держит его всё время
+            self.pool.open_connection,
+            max_batch=int(os.environ.get('WRITE_BATCH_MAX', 64)),
+            max_delay=float(os.environ.get('WRITE_BATCH_DELAY_MS', 2)) / 1000,
+            timeout=float(os.environ.get('WRITE_QUEUE_TIMEOUT', 30)),
+            metrics=self.metrics
+        )
+        # Сверка балансов с журналом по новым строкам (CLI reconciler.py или фоновый поток)
+        self.reconciler = BalanceReconciler(
+            self.pool.open_reader,
+            self._transaction,
+            batch_size=int(os.environ.get('RECONCILE_BATCH', 5000))
+        )
         self.init_database()
+        self.metrics.instrument(self, 'db', exclude=('get_connection',))
         
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
+        """Соединение из пула на время with (WAL и PRAGMA уже настроены)"""
+        return self.pool.connection()
+
+    def _transaction(self, fn):
+        """Выполнить fn(conn) в транзакции BEGIN IMMEDIATE.
+
+        Блокировка записи берется сразу, поэтому проверки внутри fn не
+        гоняются с другими писателями. Любое исключение откатывает всё, что
+        сделала fn. Транзакцию проводит очередь записи (WriteQueue) вместе с
+        операциями других потоков; результат возвращается после коммита.
+        """
+        if self.writes.in_writer():
+            conn = self.writes.conn
+        else:
+            conn = self.pool.current()
+            if conn is None or not conn.in_transaction:
+                return self.writes.submit(fn)
         
+        # Вложенный вызов (из операции писателя или внутри открытой транзакции) —
+        # достаточно точки сохранения
+        conn.execute("SAVEPOINT nested")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK TO nested")
+            conn.execute("RELEASE nested")
+            raise
+        conn.execute("RELEASE nested")
+        return result
+
     def init_database(self):
         with self.get_connection() as conn:
             cursor = conn.cursor()
@@ -176,20 +324,28 @@ class RaffleDatabase:
                 )
             ''')
             
+            # Колонки и индексы, появившиеся позже, — через версионированные миграции
+            migrate(conn)
+            
             # Проверяем, есть ли призы
             cursor.execute("SELECT COUNT(*) FROM prizes")
             count = cursor.fetchone()[0]
             
             if count == 0:
+                # Миниатюры заранее сгенерированы images.process_image
                 default_prizes = [
-                    ('Теневая карта #1', 'card6.png', 'Редкая теневая карта'),
-                    ('Теневая карта #2', 'card2.webp', 'Очень редкая теневая карта'),
-                    ('Теневая карта #3', 'card3.webp', 'Легендарная теневая карта'),
-                    ('Теневая карта #4', 'card4.webp', 'Мифическая теневая карта'),
-                    ('Теневая карта #5', 'card1.webp', 'Древняя теневая карта')
+                    ('Теневая карта #1', 'card6.png', 'Редкая теневая карта', None, None),
+                    ('Теневая карта #2', 'card2.webp', 'Очень редкая теневая карта',
+                     '92fc6a92c3eac8c6a8f6_thumb.webp', '92fc6a92c3eac8c6a8f6_detail.webp'),
+                    ('Теневая карта #3', 'card3.webp', 'Легендарная теневая карта',
+                     '177ceb76c5ff7164183e_thumb.webp', '177ceb76c5ff7164183e_detail.webp'),
+                    ('Теневая карта #4', 'card4.webp', 'Мифическая теневая карта',
+                     '7d96929b402be84d8d16_thumb.webp', '7d96929b402be84d8d16_detail.webp'),
+                    ('Теневая карта #5', 'card1.webp', 'Древняя теневая карта',
+                     '16ff86c467c081fc72f4_thumb.webp', '16ff86c467c081fc72f4_detail.webp')
                 ]
                 cursor.executemany(
-                    "INSERT INTO prizes (name, image, description) VALUES (?, ?, ?)",
+                    "INSERT INTO prizes (name, image, description, thumb, detail) VALUES (?, ?, ?, ?, ?)",
                     default_prizes
                 )
                 conn.commit()
@@ -199,215 +355,235 @@ class RaffleDatabase:
     
     def register_or_login(self, nickname, telegram=None, site_url=None):
         """Регистрация или вход пользователя (без стартовых монет)"""
-        print(f"📝 Регистрация/вход: {nickname}, tg: {telegram}, url: {site_url}")
+        log.info('register_or_login', nickname=nickname, telegram=telegram, site_url=site_url)
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Проверяем, существует ли пользователь
-            cursor.execute("SELECT * FROM users WHERE nickname = ?", (nickname,))
-            user = cursor.fetchone()
-            
+        def login_or_insert(conn):
+            # Обновляем время последнего входа и сразу получаем данные
+            user = conn.execute(f'''
+                UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE nickname = ?
+                RETURNING {USER_COLUMNS}
+            ''', (nickname,)).fetchone()
             if user:
-                # Обновляем время последнего входа
-                cursor.execute(
-                    "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE nickname = ?",
-                    (nickname,)
-                )
-                conn.commit()
-                
-                # Получаем обновленные данные
-                cursor.execute("SELECT * FROM users WHERE nickname = ?", (nickname,))
-                user = cursor.fetchone()
-                
-                return {
-                    'success': True,
-                    'new_user': False,
-                    'user': {
-                        'id': user[0],
-                        'nickname': user[1],
-                        'telegram': user[3],
-                        'site_url': user[4],
-                        'shadow_coins': user[5]
-                    }
-                }
-            else:
-                # Создаем нового пользователя (без монет!)
-                try:
-                    cursor.execute('''
-                        INSERT INTO users (nickname, telegram, site_url, shadow_coins)
-                        VALUES (?, ?, ?, 0)
-                    ''', (nickname, telegram, site_url))
-                    conn.commit()
-                    
-                    cursor.execute("SELECT * FROM users WHERE nickname = ?", (nickname,))
-                    user = cursor.fetchone()
-                    
-                    return {
-                        'success': True,
-                        'new_user': True,
-                        'user': {
-                            'id': user[0],
-                            'nickname': user[1],
-                            'telegram': user[3],
-                            'site_url': user[4],
-                            'shadow_coins': user[5]
-                        }
-                    }
-                except sqlite3.IntegrityError as e:
-                    return {'success': False, 'message': 'Никнейм уже занят'}
+                return user, False
+            
+            # Создаем нового пользователя (без монет!)
+            user = conn.execute(f'''
+                INSERT INTO users (nickname, telegram, site_url, shadow_coins)
+                VALUES (?, ?, ?, 0)
+                RETURNING {USER_COLUMNS}
+            ''', (nickname, telegram, site_url)).fetchone()
+            return user, True
+        
+        token = self.user_cache.token()
+        try:
+            user, new_user = self._transaction(login_or_insert)
+        except sqlite3.IntegrityError as e:
+            return {'success': False, 'message': self._unique_violation_message(e)}
+        
+        user = user_dict(user)
+        self.user_cache.fill(user['id'], user, token)
+        return {'success': True, 'new_user': new_user, 'user': user}
     
     def get_user_by_nickname(self, nickname):
         """Получить пользователя по нику"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE nickname = ?", (nickname,))
-            user = cursor.fetchone()
-            if user:
-                return {
-                    'id': user[0],
-                    'nickname': user[1],
-                    'telegram': user[3],
-                    'site_url': user[4],
-                    'shadow_coins': user[5]
-                }
-            return None
+            user = conn.execute(
+                f"SELECT {USER_COLUMNS} FROM users WHERE nickname = ?", (nickname,)
+            ).fetchone()
+        return user_dict(user) if user else None
     
     def get_user_by_id(self, user_id):
-        """Получить пользователя по ID"""
+        """Получить пользователя по ID (повторный запрос — из кэша, без SQLite)"""
+        if self.user_cache.needs_sync():
+            # Изменения из других воркеров
+            with self.get_connection() as conn:
+                self.user_cache.sync(conn)
+        user = self.user_cache.get(user_id)
+        if user is not None:
+            return user
+        
+        token = self.user_cache.token()
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
-            if user:
-                return {
-                    'id': user[0],
-                    'nickname': user[1],
-                    'telegram': user[3],
-                    'site_url': user[4],
-                    'shadow_coins': user[5]
-                }
+            user = conn.execute(
+                f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+        if not user:
             return None
+        user = user_dict(user)
+        self.user_cache.fill(user_id, user, token)
+        return user
+    
+    def update_profile(self, user_id, changes):
+        """Изменить ник, Telegram и ссылку одним UPDATE в одной транзакции.
+
+        changes — {поле: значение} только для меняемых полей из PROFILE_FIELDS;
+        пустой Telegram или ссылка (None или '') очищают поле. Значения уже
+        проверены маршрутом. Занятое поле ловится ограничением UNIQUE, а не
+        отдельным SELECT: между проверкой и записью его никто не перехватит.
+        """
+        changes = {field: changes[field] or None for field in PROFILE_FIELDS if field in changes}
+        if not changes:
+            user = self.get_user_by_id(user_id)
+            if not user:
+                return {'success': False, 'message': 'Пользователь не найден'}
+            return {'success': True, 'user': user}
+        
+        assignments = ', '.join(f'{field} = ?' for field in changes)
+        
+        def update(conn):
+            return conn.execute(f'''
+                UPDATE users SET {assignments} WHERE id = ?
+                RETURNING {USER_COLUMNS}
+            ''', (*changes.values(), user_id)).fetchone()
+        
+        try:
+            user = self._transaction(update)
+        except sqlite3.IntegrityError as e:
+            return {'success': False, 'message': self._unique_violation_message(
+                e, PROFILE_UNIQUE_MESSAGES, 'Ошибка обновления профиля')}
+        
+        if not user:
+            return {'success': False, 'message': 'Пользователь не найден'}
+        
+        # Ленту победителей со старым ником перечитают все воркеры: триггер
+        # миграции 10 уже увеличил её версию в той же транзакции
+        self.user_cache.invalidate(user_id)
+        return {'success': True, 'user': user_dict(user)}
     
     # ========== РАБОТА С ТЕНЕВЫМИ МОНЕТАМИ ==========
     
     def get_user_coins(self, user_id):
         """Получить баланс теневых монет"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else 0
+        user = self.get_user_by_id(user_id)
+        return user['shadow_coins'] if user else 0
     
     def add_shadow_coins(self, user_id, amount, reason="", admin_id=None):
         """Добавить теневые монеты пользователю (только для админа)"""
-        
+
         # Защита от слишком больших чисел
-        MAX_COINS = 1000000  # Максимальное количество монет
-        
-        # Проверка на превышение лимита
         if amount > MAX_COINS:
-            print(f"⚠️ Попытка добавить слишком много монет: {amount}")
+            log.warning('add_shadow_coins.too_many', user_id=user_id, amount=amount)
             return False
-        
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Проверяем текущий баланс
-            cursor.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,))
-            current = cursor.fetchone()[0]
-            
-            # Проверяем, что итоговый баланс не превысит лимит
-            if current + amount > MAX_COINS:
-                print(f"⚠️ Итоговый баланс превысит лимит: {current} + {amount} > {MAX_COINS}")
-                return False
-            
-            # Обновляем баланс
-            cursor.execute(
-                "UPDATE users SET shadow_coins = shadow_coins + ? WHERE id = ?",
-                (amount, user_id)
+
+        try:
+            # Лимит итогового баланса проверяется в самом UPDATE
+            self._transaction(
+                lambda conn: self.ledger.credit(conn, user_id, amount, reason, admin_id)
             )
-            
-            # Записываем транзакцию
-            cursor.execute('''
-                INSERT INTO coin_transactions (user_id, amount, reason, admin_id)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, amount, reason, admin_id))
-            
-            conn.commit()
+            self.user_cache.invalidate(user_id)
             return True
-        
+        except LedgerError as e:
+            log.warning('add_shadow_coins.rejected', user_id=user_id, amount=amount, reason=str(e))
+            return False
+
     def remove_shadow_coins(self, user_id, amount, reason="", admin_id=None):
-    
+
         # Защита от слишком больших чисел
-        MAX_COINS = 1000000
-        
         if amount > MAX_COINS:
-            print(f"⚠️ Попытка снять слишком много монет: {amount}")
+            log.warning('remove_shadow_coins.too_many', user_id=user_id, amount=amount)
             return False
-        
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Проверяем текущий баланс
-            cursor.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,))
-            current = cursor.fetchone()[0]
-            
-            # Проверяем, что баланс не уйдет в минус
-            if current - amount < 0:
-                print(f"⚠️ Недостаточно монет: текущий баланс {current}, попытка снять {amount}")
-                return False
-            
-            # Обновляем баланс (отрицательное число)
-            cursor.execute(
-                "UPDATE users SET shadow_coins = shadow_coins - ? WHERE id = ?",
-                (amount, user_id)
+
+        try:
+            # Баланс не уйдет в минус: условие проверяется в самом UPDATE
+            self._transaction(
+                lambda conn: self.ledger.debit(conn, user_id, amount, reason, admin_id)
             )
-            
-            # Записываем транзакцию (с отрицательным знаком)
-            cursor.execute('''
-                INSERT INTO coin_transactions (user_id, amount, reason, admin_id)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, -amount, reason, admin_id))
-            
-            conn.commit()
+            self.user_cache.invalidate(user_id)
             return True
-    
+        except LedgerError as e:
+            log.warning('remove_shadow_coins.rejected', user_id=user_id, amount=amount, reason=str(e))
+            return False
+
     def spend_shadow_coin(self, user_id):
         """Потратить 1 теневую монету на прокрутку"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Проверяем баланс
-            cursor.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,))
-            current = cursor.fetchone()[0]
-            
-            if current < 1:
-                return False
-            
-            # Списываем монету
-            cursor.execute(
-                "UPDATE users SET shadow_coins = shadow_coins - 1 WHERE id = ?",
-                (user_id,)
+        try:
+            self._transaction(
+                lambda conn: self.ledger.debit(conn, user_id, 1, 'Прокрутка рулетки')
             )
-            
-            # Записываем транзакцию
-            cursor.execute('''
-                INSERT INTO coin_transactions (user_id, amount, reason)
-                VALUES (?, ?, ?)
-            ''', (user_id, -1, 'Прокрутка рулетки'))
-            
-            conn.commit()
+            self.user_cache.invalidate(user_id)
             return True
-    
+        except LedgerError:
+            return False
+
+    def bulk_add_shadow_coins(self, entries, admin_id=None):
+        """Массовое начисление монет (для админа).
+
+        entries — список (nickname, amount, reason). Ники разрешаются одним
+        запросом, все начисления и транзакции пишутся одной транзакцией.
+        Возвращает результат по каждой строке в исходном порядке.
+        """
+        results = []
+        valid = []
+        for row, (nickname, amount, reason) in enumerate(entries, start=1):
+            result = {'row': row, 'nickname': nickname, 'success': False}
+            results.append(result)
+
+            if not nickname:
+                result['message'] = 'Введите никнейм'
+                continue
+            try:
+                amount = int(amount)
+            except (TypeError, ValueError):
+                result['message'] = 'Количество монет должно быть числом'
+                continue
+            if amount <= 0:
+                result['message'] = 'Введите положительное количество монет'
+                continue
+            if amount > MAX_COINS_PER_TRANSACTION:
+                result['message'] = f'Нельзя добавить больше {MAX_COINS_PER_TRANSACTION} монет за раз'
+                continue
+
+            valid.append((result, nickname, amount, reason or ''))
+
+        def apply(conn):
+            # Балансы читаем под блокировкой записи — между проверкой и записью никто не вклинится
+            users = {}
+            nicknames = list({nickname for _, nickname, _, _ in valid})
+            for i in range(0, len(nicknames), 500):
+                chunk = nicknames[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for user_id, nickname, coins in conn.execute(
+                    f"SELECT id, nickname, shadow_coins FROM users WHERE nickname IN ({placeholders})",
+                    chunk
+                ):
+                    users[nickname] = [user_id, coins]
+
+            credits = []
+            credited = {}
+            for result, nickname, amount, reason in valid:
+                user = users.get(nickname)
+                if user is None:
+                    result['message'] = 'Пользователь не найден'
+                    continue
+                if user[1] + amount > MAX_COINS:
+                    result['message'] = f'У пользователя слишком много монет (макс. {MAX_COINS})'
+                    continue
+                user[1] += amount
+                credits.append((user[0], amount, reason, admin_id))
+                credited[user[0]] = user[1]
+                result.update(success=True, new_balance=user[1])
+
+            self.ledger.credit_many(conn, credits)
+            return credited
+
+        credited = self._transaction(apply) if valid else {}
+        if credited:
+            self.user_cache.invalidate(*credited)
+
+        # Живые обновления — только после коммита
+        for user_id, coins in credited.items():
+            self.events.publish('balance', {'shadow_coins': coins}, user_id=user_id)
+
+        return results
+
     # ========== РОЗЫГРЫШ ==========
     
     def get_available_prizes(self):
-        """Получить доступные призы"""
+        """Получить доступные призы (thumb/detail — уменьшенные варианты, иначе оригинал)"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute(
-                "SELECT id, name, image, description FROM prizes WHERE available = 1"
+                "SELECT id, name, image, description, thumb, detail FROM prizes WHERE available = 1"
             )      
             prizes = cursor.fetchall()
             return [
@@ -415,78 +591,128 @@ class RaffleDatabase:
                     'id': p[0],
                     'name': p[1],
                     'image': p[2],
-                    'description': p[3] if p[3] else ''
+                    'description': p[3] if p[3] else '',
+                    'thumb': p[4] or p[2],
+                    'detail': p[5] or p[2]
                 }
                 for p in prizes
             ]
     
+    def get_available_prizes_json(self, prepare=None):
+        """Доступные призы как готовый JSON: (body, etag).
+        
+        prepare(prize) дополняет словарь приза перед сериализацией (адреса
+        картинок); результат кэшируется до следующего изменения prizes.
+        """
+        def load(conn):
+            prizes = self.get_available_prizes()
+            return [prepare(prize) for prize in prizes] if prepare else prizes
+        
+        with self.get_connection() as conn:
+            return self.prizes_cache.snapshot(conn, load)
+    
     def draw_prize(self, user_id):
         """Розыгрыш приза (1 попытка = 1 монета)"""
-        print(f"🎲 draw_prize для user_id: {user_id}")
-        
+        result = self.draw_prizes(user_id, 1)
+        if not result['success']:
+            return result
+        return {
+            'success': True,
+            'message': result['message'],
+            'prize': result['prizes'][0],
+            'new_balance': result['new_balance']
+        }
+
+    def draw_prizes(self, user_id, n):
+        """Розыгрыш n разных призов одной транзакцией (n попыток = n монет)"""
+        log.debug('draw_prizes', user_id=user_id, n=n)
+
+        def draw(conn):
+            def claim(prize):
+                # Помечаем приз как недоступный, если его ещё не разыграли
+                return conn.execute(
+                    "UPDATE prizes SET available = 0 WHERE id = ? AND available = 1",
+                    (prize[0],)
+                ).rowcount == 1
+
+            # Баланс — до захвата призов: без монет розыгрыш не трогает prizes.
+            # Транзакция уже держит блокировку записи, так что проверка не устареет
+            coins = conn.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,)).fetchone()
+            if coins is None or coins[0] < n:
+                raise InsufficientCoins('Недостаточно теневых монет')
+
+            # Подгружаем новые призы в индекс (без полного чтения таблицы)
+            self.prize_pool.sync(conn)
+
+            # Выбираем n разных призов с учётом веса
+            prizes = self.prize_pool.sample(n, claim)
+            if not prizes:
+                return None, None, None
+            if len(prizes) < n:
+                raise NotEnoughPrizes(f'Осталось призов: {len(prizes)}')
+
+            # Списываем n монет одним UPDATE, по транзакции на каждый приз
+            new_balance = self.ledger.debit_entries(
+                conn, user_id, [(1, f'Выигрыш: {prize[1]}') for prize in prizes]
+            )
+
+            # Записываем победителей одним INSERT (данные для ленты — сразу из RETURNING)
+            placeholders = ', '.join(['(?, ?)'] * len(prizes))
+            params = [value for prize in prizes for value in (user_id, prize[0])]
+            winners = conn.execute(f'''
+                INSERT INTO winners (user_id, prize_id)
+                VALUES {placeholders}
+                RETURNING id, prize_id, (SELECT nickname FROM users WHERE id = user_id), won_at
+            ''', params).fetchall()
+
+            return prizes, new_balance, sorted(winners)
+
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Проверяем баланс
-                cursor.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,))
-                user_coins = cursor.fetchone()[0]
-                
-                if user_coins < 1:
-                    return {'success': False, 'message': 'Недостаточно теневых монет'}
-                
-                # Получаем доступные призы
-                cursor.execute("SELECT id, name, image FROM prizes WHERE available = 1")
-                available_prizes = cursor.fetchall()
-                
-                if not available_prizes:
-                    return {'success': False, 'message': 'Призы закончились'}
-                
-                # Списываем монету
-                cursor.execute(
-                    "UPDATE users SET shadow_coins = shadow_coins - 1 WHERE id = ?",
-                    (user_id,)
-                )
-                
-                # Выбираем случайный приз
-                prize = random.choice(available_prizes)
-                
-                # Помечаем приз как недоступный
-                cursor.execute("UPDATE prizes SET available = 0 WHERE id = ?", (prize[0],))
-                
-                # Записываем победителя
-                cursor.execute('''
-                    INSERT INTO winners (user_id, prize_id) 
-                    VALUES (?, ?)
-                ''', (user_id, prize[0]))
-                
-                # Записываем транзакцию
-                cursor.execute('''
-                    INSERT INTO coin_transactions (user_id, amount, reason)
-                    VALUES (?, ?, ?)
-                ''', (user_id, -1, f'Выигрыш: {prize[1]}'))
-                
-                conn.commit()
-                
-                # Получаем обновленный баланс
-                cursor.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,))
-                new_balance = cursor.fetchone()[0]
-                
-                return {
-                    'success': True,
-                    'message': f'Поздравляем! Ты выиграл: {prize[1]}',
-                    'prize': {
-                        'id': prize[0],
-                        'name': prize[1],
-                        'image': prize[2]
-                    },
-                    'new_balance': new_balance
-                }
-                
+            prizes, new_balance, winners = self._transaction(draw)
+        except InsufficientCoins:
+            return {'success': False, 'message': 'Недостаточно теневых монет'}
+        except NotEnoughPrizes as e:
+            return {'success': False, 'message': f'Призов меньше, чем прокруток. {e}'}
         except Exception as e:
-            print(f"🔥 Ошибка в draw_prize: {e}")
+            log.error('draw_prizes.failed', user_id=user_id, n=n, error=repr(e))
             return {'success': False, 'message': 'Ошибка при розыгрыше'}
-    
+
+        if prizes is None:
+            return {'success': False, 'message': 'Призы закончились'}
+
+        self.user_cache.invalidate(user_id)
+        names = {prize[0]: prize[1] for prize in prizes}
+        for prize in prizes:
+            self.prize_pool.discard(prize[0])
+
+        for winner_id, prize_id, nickname, won_at in winners:
+            self.winners_feed.append(winner_id, nickname, names[prize_id], won_at)
+
+        # Живые обновления для /api/stream: весь розыгрыш — одним событием,
+        # клиент сам дописывает победителей и убирает разыгранные призы
+        self.events.publish('draw', {
+            'winners': [
+                {'nickname': nickname, 'prize_name': names[prize_id], 'won_at': won_at}
+                for _, prize_id, nickname, won_at in reversed(winners)
+            ],
+            'prize_ids': [prize[0] for prize in prizes]
+        })
+        self.events.publish('balance', {'shadow_coins': new_balance}, user_id=user_id)
+
+        return {
+            'success': True,
+            'message': f"Поздравляем! Ты выиграл: {', '.join(prize[1] for prize in prizes)}",
+            'prizes': [
+                {
+                    'id': prize[0],
+                    'name': prize[1],
+                    'image': prize[2]
+                }
+                for prize in prizes
+            ],
+            'new_balance': new_balance
+        }
+
     # ========== ИСТОРИЯ ВЫИГРЫШЕЙ ==========
     
     def get_user_wins(self, user_id):
@@ -498,7 +724,9 @@ class RaffleDatabase:
                     p.name as prize_name,
                     p.image as prize_image,
                     p.description,
-                    w.won_at
+                    w.won_at,
+                    COALESCE(p.thumb, p.image),
+                    COALESCE(p.detail, p.image)
                 FROM winners w
                 JOIN prizes p ON w.prize_id = p.id
                 WHERE w.user_id = ?
@@ -511,94 +739,354 @@ class RaffleDatabase:
     def get_public_winners(self):
         """Публичная таблица победителей (только ники и призы)"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT 
-                    u.nickname,
-                    p.name as prize_name,
-                    w.won_at
-                FROM winners w
-                JOIN users u ON w.user_id = u.id
-                JOIN prizes p ON w.prize_id = p.id
-                ORDER BY w.won_at DESC
-                LIMIT 50
-            ''')  
-            return cursor.fetchall()
+            return self._public_winners(conn)
     
-    # ========== ПОЛНАЯ ТАБЛИЦА ПОБЕДИТЕЛЕЙ (ДЛЯ АДМИНА) ==========
+    def _public_winners(self, conn):
+        return conn.execute('''
+            SELECT 
+                u.nickname,
+                p.name as prize_name,
+                w.won_at
+            FROM winners w
+            JOIN users u ON w.user_id = u.id
+            JOIN prizes p ON w.prize_id = p.id
+            ORDER BY w.won_at DESC
+            LIMIT 50
+        ''').fetchall()
     
-    def get_full_winners(self):
-        """Полная таблица победителей с контактами (только для админа)"""
+    def get_public_winners_feed(self):
+        """Публичная таблица победителей как готовый JSON: (body, etag)"""
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT 
-                    u.nickname,
-                    u.telegram,
-                    u.site_url,
-                    p.name as prize_name,
-                    w.won_at
+            return self.winners_feed.snapshot(conn, self._public_winners)
+    
+    # ========== ПОЛНАЯ ТАБЛИЦА ПОБЕДИТЕЛЕЙ (ДЛЯ АДМИНА) ==========
+    
+    def get_full_winners(self, limit=None, after=None):
+        """Полная таблица победителей с контактами (только для админа).
+        
+        Последняя колонка — w.id, по (won_at, id) строится курсор следующей страницы.
+        """
+        return self._page('''
+            SELECT 
+                u.nickname,
+                u.telegram,
+                u.site_url,
+                p.name as prize_name,
+                w.won_at,
+                w.id
+            FROM winners w
+            JOIN users u ON w.user_id = u.id
+            JOIN prizes p ON w.prize_id = p.id
+        ''', ['w.won_at', 'w.id'], limit=limit, after=after)
+    
+    # ========== ВЫГРУЗКА ИСТОРИИ (ДЛЯ АДМИНА) ==========
+    
+    EXPORTS = {
+        'winners': (
+            ['id', 'user_id', 'nickname', 'telegram', 'site_url', 'prize_id', 'prize_name', 'won_at'],
+            '''
+                SELECT w.id, w.user_id, u.nickname, u.telegram, u.site_url, w.prize_id, p.name, w.won_at
                 FROM winners w
                 JOIN users u ON w.user_id = u.id
                 JOIN prizes p ON w.prize_id = p.id
-                ORDER BY w.won_at DESC
-            ''')  
-            return cursor.fetchall()
+                ORDER BY w.id
+            '''
+        ),
+        'transactions': (
+            ['id', 'user_id', 'amount', 'reason', 'admin_id', 'created_at'],
+            '''
+                SELECT id, user_id, amount, reason, admin_id, created_at
+                FROM coin_transactions
+                ORDER BY id
+            '''
+        ),
+    }
+    
+    def export_batches(self, kind, batch_size=1000):
+        """Генератор пачек строк для выгрузки winners/transactions.
+        
+        Читает одним запросом через fetchmany на отдельном read-only
+        соединении: память не зависит от размера таблицы, слот пула не
+        занят, а выгрузка видит один согласованный снимок базы (WAL не
+        блокирует писателей). Сортировка по id идёт по rowid, без
+        временных таблиц, поэтому первые строки уходят сразу.
+        """
+        _, sql = self.EXPORTS[kind]
+        conn = self.pool.open_reader()
+        try:
+            cursor = conn.execute(sql)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
     
     # ========== АДМИН-ФУНКЦИИ ==========
     
-    def add_prize(self, name, image, description):
-        """Добавить новый приз (для админа)"""
+    def add_prize(self, name, image, description, weight=1, thumb=None, detail=None):
+        """Добавить новый приз (для админа).
+        
+        weight — относительный шанс выпадения, thumb/detail — уменьшенные
+        варианты изображения (images.process_image).
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT INTO prizes (name, image, description, available)
-                VALUES (?, ?, ?, 1)
-            ''', (name, image, description))
+                INSERT INTO prizes (name, image, description, available, weight, thumb, detail)
+                VALUES (?, ?, ?, 1, ?, ?, ?)
+            ''', (name, image, description, weight, thumb, detail))
             conn.commit()
+            self.prize_pool.sync(conn)
+            self.events.publish('prize_added', {
+                'id': cursor.lastrowid,
+                'name': name,
+                'image': image,
+                'thumb': thumb or image,
+                'detail': detail or image,
+                'description': description or ''
+            })
             return cursor.lastrowid
     
-    def get_all_users_admin(self):
-        """Получить всех пользователей с контактами (для админа)"""
+    def get_all_users_admin(self, limit=None, after=None):
+        """Получить всех пользователей с контактами (для админа), новые первыми.
+        
+        Страницы — по неизменному id: баланс меняется при каждом розыгрыше,
+        и курсор по (shadow_coins, id) пропускал бы или повторял пользователей.
+        """
+        return self._page('''
+            SELECT id, nickname, telegram, site_url, shadow_coins, created_at, last_login
+            FROM users
+        ''', ['id'], limit=limit, after=after)
+    
+    def get_all_prizes_admin(self, limit=None, after=None):
+        """Все призы (включая разыгранные) для админа, страница по (created_at, id)"""
+        return self._page('''
+            SELECT id, name, image, description, available, created_at
+            FROM prizes
+        ''', ['created_at', 'id'], limit=limit, after=after)
+    
+    def get_transactions(self, user_id=None, limit=100, after=None):
+        """Получить транзакции (для админа), страница по (created_at, id)"""
+        return self._page('''
+            SELECT * FROM coin_transactions
+        ''', ['created_at', 'id'],
+            where='user_id = ?' if user_id else None,
+            params=(user_id,) if user_id else (),
+            limit=limit, after=after)
+    
+    def get_table_counts(self):
+        """Количество строк в основных таблицах (из счётчиков stats, без выборки строк)"""
+        counters = self._stats_counters()
+        return {
+            table: counters[table]
+            for table in ('users', 'prizes', 'winners', 'coin_transactions')
+        }
+    
+    def get_stats(self, top_n=10):
+        """Статистика для админ-панели.
+        
+        Счётчики поддерживают триггеры (миграция 6), а топ читается с конца
+        индекса idx_users_coins, поэтому стоимость не зависит от размера таблиц.
+        """
+        counters = self._stats_counters()
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, nickname, telegram, site_url, shadow_coins, created_at, last_login
-                FROM users
+            top_users = conn.execute('''
+                SELECT nickname, shadow_coins FROM users
                 ORDER BY shadow_coins DESC
-            ''')
-            return cursor.fetchall()
+                LIMIT ?
+            ''', (top_n,)).fetchall()
+        return {
+            'total_users': counters['users'],
+            'available_prizes': counters['available_prizes'],
+            'total_winners': counters['winners'],
+            'total_coins': counters['total_coins'],
+            'top_users': [{'nickname': u[0], 'coins': u[1]} for u in top_users]
+        }
     
-    def get_all_prizes_admin(self):
-        """Все призы (включая разыгранные) для админа"""
+    def _stats_counters(self):
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, name, image, description, available, created_at
-                FROM prizes
-                ORDER BY created_at DESC
-            ''')
-            return cursor.fetchall()
+            return dict(conn.execute("SELECT name, value FROM stats"))
     
-    def get_transactions(self, user_id=None):
-        """Получить транзакции (для админа)"""
+    def _page(self, sql, keys, where=None, params=(), limit=None, after=None):
+        """Keyset-пагинация: сортировка по убыванию keys (последний — уникальный id).
+        
+        after — курсор из encode_cursor(); строки идут строго после него,
+        поэтому страница не сдвигается при вставке новых записей.
+        """
+        conditions = [where] if where else []
+        params = list(params)
+        if after:
+            conditions.append(f"({', '.join(keys)}) < ({', '.join('?' * len(keys))})")
+            params.extend(decode_cursor(after, len(keys)))
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ', '.join(f'{key} DESC' for key in keys)
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            if user_id:
-                cursor.execute('''
-                    SELECT * FROM coin_transactions 
-                    WHERE user_id = ? 
-                    ORDER BY created_at DESC
-                ''', (user_id,))
-            else:
-                cursor.execute('''
-                    SELECT * FROM coin_transactions 
-                    ORDER BY created_at DESC
-                    LIMIT 100
-                ''')
-            return cursor.fetchall()
-                         
-                               
-                   
+            return conn.execute(sql, params).fetchall()
+    
+    # ========== СЖАТИЕ ЖУРНАЛА МОНЕТ ==========
+    
+    SUMMARY_COLUMNS = 'user_id, day, credits, debits, tx_count, first_id, last_id, checksum'
+    
+    def compact_ledger(self, keep_days=30, batch_size=1000):
+        """Перенести строки coin_transactions старше keep_days дней в архив, оставив дневные итоги.
+        
+        Сегодняшний день не сжимается (keep_days не меньше 1). В архив уходят
+        только строки, уже учтённые сверкой балансов (id не больше её
+        watermark), поэтому сначала сверка догоняет журнал. Каждая пачка —
+        отдельная короткая транзакция очереди записи, поэтому розыгрыши не
+        ждут, пока сожмётся вся история. Подробности — в ledger_archive.py.
+        """
+        keep_days = max(1, int(keep_days))
+        try:
+            watermark = self.reconciler.run()['watermark']
+        except ReconcileConflict:
+            # Сверку в это же время двигает другой процесс — берём то, что уже учтено
+            watermark = self.reconciler.stats()['watermark']
+        with self.get_connection() as conn:
+            cutoff = conn.execute("SELECT date('now', ?)", (f'-{keep_days - 1} days',)).fetchone()[0]
+        
+        archived = summaries = 0
+        last_id = 0
+        archive = self.ledger_archive.connect()
+        try:
+            while True:
+                with self.get_connection() as conn:
+                    rows = conn.execute(f'''
+                        SELECT {ROW_COLUMNS}, date(created_at) FROM coin_transactions
+                        WHERE id > ? AND id <= ? AND created_at < ?
+                        ORDER BY id
+                        LIMIT ?
+                    ''', (last_id, watermark, cutoff, batch_size)).fetchall()
+                if not rows:
+                    break
+                
+                # Шаг 1: строки закоммичены в архиве до удаления из журнала
+                self.ledger_archive.store(archive, rows)
+                first_id, last_id = rows[0][0], rows[-1][0]
+                copied = {row[0] for row in rows}
+                
+                # Шаг 2: удалить и посчитать итоги по фактически удалённым строкам
+                deleted, written = self._transaction(
+                    lambda conn: self._compact_batch(conn, first_id, last_id, cutoff, copied)
+                )
+                archived += deleted
+                summaries += written
+        finally:
+            archive.close()
+        
+        log.info('compact_ledger', cutoff=cutoff, archived=archived, summaries=summaries)
+        return {'success': True, 'cutoff': cutoff, 'archived': archived, 'summaries': summaries}
+    
+    def _compact_batch(self, conn, first_id, last_id, cutoff, copied):
+        # Новые строки получают id больше last_id, поэтому диапазон совпадает со скопированной пачкой
+        deleted = sorted(conn.execute(f'''
+            DELETE FROM coin_transactions
+            WHERE id BETWEEN ? AND ? AND created_at < ?
+            RETURNING {ROW_COLUMNS}, date(created_at)
+        ''', (first_id, last_id, cutoff)).fetchall())
+        missing = [row[0] for row in deleted if row[0] not in copied]
+        if missing:
+            raise ArchiveMismatch(f'Строк нет в архиве: {missing[:10]}')
+        
+        existing = {}
+        for user_id, day in {(row[1], row[6]) for row in deleted}:
+            summary = conn.execute(
+                f"SELECT {self.SUMMARY_COLUMNS} FROM coin_daily_summaries WHERE user_id = ? AND day = ?",
+                (user_id, day)
+            ).fetchone()
+            if summary:
+                existing[(user_id, day)] = summary
+        
+        rows = summarize(deleted, existing)
+        conn.executemany('''
+            INSERT INTO coin_daily_summaries (user_id, day, credits, debits, tx_count, first_id, last_id, checksum)
+            VALUES (:user_id, :day, :credits, :debits, :tx_count, :first_id, :last_id, :checksum)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                credits = excluded.credits,
+                debits = excluded.debits,
+                tx_count = excluded.tx_count,
+                first_id = excluded.first_id,
+                last_id = excluded.last_id,
+                checksum = excluded.checksum,
+                compacted_at = CURRENT_TIMESTAMP
+        ''', rows)
+        return len(deleted), len(rows)
+    
+    def get_ledger_summaries(self, user_id, limit=100):
+        """Дневные итоги сжатого журнала пользователя, новые дни первыми"""
+        with self.get_connection() as conn:
+            return conn.execute('''
+                SELECT day, credits, debits, tx_count, first_id, last_id, checksum
+                FROM coin_daily_summaries
+                WHERE user_id = ?
+                ORDER BY day DESC
+                LIMIT ?
+            ''', (user_id, limit)).fetchall()
+    
+    def get_archived_transactions(self, user_id, day=None, limit=1000):
+        """Исходные строки журнала пользователя из архива (за день day, если задан)"""
+        conn = self.pool.open_reader()
+        try:
+            if not self.ledger_archive.attach(conn):
+                return []
+            sql = f"SELECT {ROW_COLUMNS} FROM archive.coin_transactions WHERE user_id = ?"
+            params = [user_id]
+            if day:
+                sql += " AND created_at >= ? AND created_at < date(?, '+1 day')"
+                params += [day, day]
+            sql += " ORDER BY id LIMIT ?"
+            params.append(limit)
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+    
+    def verify_ledger_archive(self, user_id=None):
+        """Пересчитать дневные итоги по архиву и сравнить с coin_daily_summaries.
+        
+        Вернуть список расхождений (пустой — всё сходится). Строки, которые
+        есть и в архиве, и в журнале (прерванное сжатие), в пересчёт не
+        входят: их досчитает следующий запуск compact_ledger.
+        """
+        where = " AND user_id = ?" if user_id else ""
+        params = (user_id,) if user_id else ()
+        conn = self.pool.open_reader()
+        try:
+            stored = {
+                (row[0], row[1]): row
+                for row in conn.execute(f"SELECT {self.SUMMARY_COLUMNS} FROM coin_daily_summaries WHERE 1 = 1{where}", params)
+            }
+            if not self.ledger_archive.attach(conn):
+                return [f'Архив {self.ledger_archive.path} не найден'] if stored else []
+            
+            pending = conn.execute(f'''
+                SELECT COUNT(*) FROM coin_transactions c
+                WHERE EXISTS (SELECT 1 FROM archive.coin_transactions a WHERE a.id = c.id){where}
+            ''', params).fetchone()[0]
+            rows = conn.execute(f'''
+                SELECT {ROW_COLUMNS}, date(created_at) FROM archive.coin_transactions a
+                WHERE NOT EXISTS (SELECT 1 FROM main.coin_transactions c WHERE c.id = a.id){where}
+                ORDER BY id
+            ''', params)
+            recomputed = {(s['user_id'], s['day']): s for s in summarize(rows, {})}
+        finally:
+            conn.close()
         
-           
\ No newline at end of file
+        problems = []
+        if pending:
+            problems.append(f'{pending} строк есть и в журнале, и в архиве — повторите сжатие')
+        for key in sorted(set(stored) | set(recomputed)):
+            summary, actual = stored.get(key), recomputed.get(key)
+            if summary is None:
+                problems.append(f'user {key[0]}, {key[1]}: строки в архиве без дневного итога')
+            elif actual is None:
+                problems.append(f'user {key[0]}, {key[1]}: итог без строк в архиве')
+            elif tuple(summary[2:]) != (actual['credits'], actual['debits'], actual['tx_count'],
+                                        actual['first_id'], actual['last_id'], actual['checksum']):
+                problems.append(f'user {key[0]}, {key[1]}: итог не совпадает с архивом')
+        return problems
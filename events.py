@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import json
+import threading
+from collections import deque
+
+
+class TooManySubscribers(Exception):
+    """Достигнут лимит одновременных подписчиков"""
+
+
+class Subscription:
+    """Очередь событий одного клиента.
+
+    Очередь ограничена: если клиент не успевает читать, старые события
+    вытесняются новыми (счётчик dropped), а память не растёт. Подписчик
+    из цикла asyncio (loop) ждёт через wait_async() и не занимает поток.
+    """
+
+    def __init__(self, user_id=None, maxlen=100, loop=None):
+        self.user_id = user_id
+        self.dropped = 0
+        self._queue = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+        self._loop = loop
+        self._ready = asyncio.Event() if loop is not None else None
+
+    def put(self, event):
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(event)
+            self._cond.notify()
+        if self._loop is not None:
+            # put() вызывают из потоков запросов — будим цикл потокобезопасно
+            try:
+                self._loop.call_soon_threadsafe(self._ready.set)
+            except RuntimeError:
+                pass  # цикл уже закрыт
+
+    def wait(self, timeout=None):
+        """Забрать накопившиеся события (пустой список по таймауту)"""
+        with self._cond:
+            if not self._queue:
+                self._cond.wait(timeout)
+            events = list(self._queue)
+            self._queue.clear()
+            return events
+
+    async def wait_async(self, timeout=None):
+        """То же, что wait(), для подписчика из цикла asyncio"""
+        with self._cond:
+            if self._queue:
+                events = list(self._queue)
+                self._queue.clear()
+                return events
+            self._ready.clear()
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            events = list(self._queue)
+            self._queue.clear()
+            return events
+
+
+class EventBus:
+    """Шина событий внутри процесса (победители, призы, балансы) для /api/stream.
+
+    События с user_id получает только подписчик этого пользователя,
+    остальные — все подписчики.
+    """
+
+    def __init__(self, max_subscribers=100, queue_size=100):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._published = 0
+        self._dropped = 0
+
+    def subscribe(self, user_id=None, loop=None):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise TooManySubscribers('Слишком много подключений к потоку событий')
+            sub = Subscription(user_id, self.queue_size, loop)
+            self._subscribers.add(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+            self._dropped += sub.dropped
+
+    def publish(self, event_type, data, user_id=None):
+        """Разослать событие подписчикам (не блокирует публикующего)"""
+        event = {
+            'id': next(self._ids),
+            'type': event_type,
+            'data': json.dumps(data)
+        }
+        with self._lock:
+            self._published += 1
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            if user_id is None or sub.user_id == user_id:
+                sub.put(event)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self._published,
+                'dropped': self._dropped + sum(s.dropped for s in self._subscribers),
+            }
+
+
+def format_sse(event):
+    """Событие в формате text/event-stream"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {event['data']}\n\n"
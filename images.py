@@ -0,0 +1,127 @@
+"""Обработка загруженных изображений призов (один раз, при загрузке).
+
+Из оригинала получаются:
+    <hash>_thumb.webp  — карточка рулетки и сетки призов (160x240, обрезка как object-fit: cover)
+    <hash>_detail.webp — модальное окно (вписано в 400x600, для экранов 2x)
+    <hash>.jpg/.png    — то же, что detail, в классическом формате (колонка image)
+
+Имена берутся из хэша содержимого, поэтому одинаковая картинка хранится
+один раз, а повторная загрузка не декодирует её заново.
+
+Запуск как скрипта досоздаёт варианты для призов, у которых их ещё нет:
+    python images.py [raffle.db]
+"""
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+THUMB_SIZE = (160, 240)   # .roulette-card в style.css
+DETAIL_SIZE = (400, 600)  # .modal-image img (до 200px) с запасом на плотность 2x
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+MAX_PIXELS = 40_000_000   # защита от «бомб» — маленьких файлов с огромным разрешением
+
+
+class ImageError(Exception):
+    """Файл не удалось разобрать как изображение"""
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+
+def process_image(data, folder):
+    """Сохранить варианты изображения в folder, вернуть имена файлов.
+
+    Возвращает {'image': ..., 'thumb': ..., 'detail': ...}. Если файлы с
+    таким хэшем уже есть, изображение не обрабатывается повторно.
+    """
+    digest = content_hash(data)
+    thumb = f"{digest}_thumb.webp"
+    detail = f"{digest}_detail.webp"
+
+    # Дубликат: классический вариант может быть .jpg или .png
+    for ext in ('jpg', 'png'):
+        names = {'image': f"{digest}.{ext}", 'thumb': thumb, 'detail': detail}
+        if all(os.path.exists(os.path.join(folder, name)) for name in names.values()):
+            return names
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > MAX_PIXELS:
+            raise ImageError('Слишком большое разрешение изображения')
+        img.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise ImageError('Файл не является изображением')
+
+    # Поворот по EXIF (фото с телефона), анимация — первый кадр
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+    img = img.convert('RGBA' if has_alpha else 'RGB')
+
+    small = ImageOps.fit(img, THUMB_SIZE, Image.LANCZOS)
+    large = img.copy()
+    large.thumbnail(DETAIL_SIZE, Image.LANCZOS)
+
+    if has_alpha:
+        image = f"{digest}.png"
+        _save(large, folder, image, 'PNG', optimize=True)
+    else:
+        image = f"{digest}.jpg"
+        _save(large, folder, image, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    _save(small, folder, thumb, 'WEBP', quality=WEBP_QUALITY, method=6)
+    _save(large, folder, detail, 'WEBP', quality=WEBP_QUALITY, method=6)
+
+    return {'image': image, 'thumb': thumb, 'detail': detail}
+
+
+def _save(img, folder, name, fmt, **params):
+    # Пишем во временный файл и переименовываем: параллельная загрузка
+    # того же изображения не увидит недописанный файл
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, fmt, **params)
+        # mkstemp создаёт файл с правами 0600 — статику должен читать и nginx
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, os.path.join(folder, name))
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def backfill(db, folder):
+    """Создать варианты для призов без миниатюр (после миграции старой базы)"""
+    with db.get_connection() as conn:
+        prizes = conn.execute(
+            "SELECT id, image FROM prizes WHERE thumb IS NULL"
+        ).fetchall()
+
+    done = 0
+    for prize_id, image in prizes:
+        path = os.path.join(folder, image)
+        try:
+            with open(path, 'rb') as f:
+                names = process_image(f.read(), folder)
+        except (OSError, ImageError) as e:
+            print(f"⚠️ Приз {prize_id}: {image} пропущен ({e})")
+            continue
+        # Колонку image не трогаем: оригинал остаётся доступным по старому имени
+        db._transaction(lambda conn: conn.execute(
+            "UPDATE prizes SET thumb = ?, detail = ? WHERE id = ?",
+            (names['thumb'], names['detail'], prize_id)
+        ))
+        done += 1
+    return done
+
+
+if __name__ == '__main__':
+    from database import RaffleDatabase
+
+    db = RaffleDatabase(sys.argv[1] if len(sys.argv) > 1 else 'raffle.db')
+    count = backfill(db, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images'))
+    print(f"✅ Миниатюры созданы для призов: {count}")
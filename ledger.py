@@ -0,0 +1,102 @@
+MAX_COINS = 1000000  # Максимальный баланс пользователя
+MAX_COINS_PER_TRANSACTION = 10000  # Максимум монет за одно начисление/снятие админом
+
+
+class LedgerError(Exception):
+    """Операция с монетами отклонена"""
+
+
+class InsufficientCoins(LedgerError):
+    """Не хватает монет для списания"""
+
+
+class BalanceLimitExceeded(LedgerError):
+    """Итоговый баланс превысит MAX_COINS"""
+
+
+class CoinLedger:
+    """Списания и начисления теневых монет одним условным UPDATE.
+
+    Проверка баланса делается в WHERE, а новый баланс возвращается через
+    RETURNING, поэтому нет окна между чтением и записью. Методы не
+    коммитят сами: их вызывают внутри транзакции BEGIN IMMEDIATE
+    (RaffleDatabase._transaction), и строка coin_transactions пишется
+    в той же транзакции. При отказе бросается LedgerError, и транзакция
+    откатывается целиком.
+    """
+
+    def __init__(self, max_balance=MAX_COINS):
+        self.max_balance = max_balance
+
+    def credit(self, conn, user_id, amount, reason="", admin_id=None):
+        """Начислить монеты, вернуть новый баланс"""
+        rows = conn.execute('''
+            UPDATE users SET shadow_coins = shadow_coins + ?
+            WHERE id = ? AND shadow_coins + ? <= ?
+            RETURNING shadow_coins
+        ''', (amount, user_id, amount, self.max_balance)).fetchall()
+
+        if not rows:
+            raise BalanceLimitExceeded(
+                f'Итоговый баланс превысит лимит {self.max_balance}'
+            )
+
+        self._record(conn, user_id, amount, reason, admin_id)
+        return rows[0][0]
+
+    def debit(self, conn, user_id, amount, reason="", admin_id=None):
+        """Списать монеты, вернуть новый баланс"""
+        rows = conn.execute('''
+            UPDATE users SET shadow_coins = shadow_coins - ?
+            WHERE id = ? AND shadow_coins >= ?
+            RETURNING shadow_coins
+        ''', (amount, user_id, amount)).fetchall()
+
+        if not rows:
+            raise InsufficientCoins('Недостаточно теневых монет')
+
+        self._record(conn, user_id, -amount, reason, admin_id)
+        return rows[0][0]
+
+    def debit_entries(self, conn, user_id, entries, admin_id=None):
+        """Списать сумму нескольких строк одним UPDATE.
+
+        entries — список (amount, reason); каждая строка попадает в
+        coin_transactions отдельной записью. Вернуть новый баланс.
+        """
+        total = sum(amount for amount, _ in entries)
+        rows = conn.execute('''
+            UPDATE users SET shadow_coins = shadow_coins - ?
+            WHERE id = ? AND shadow_coins >= ?
+            RETURNING shadow_coins
+        ''', (total, user_id, total)).fetchall()
+
+        if not rows:
+            raise InsufficientCoins('Недостаточно теневых монет')
+
+        conn.executemany('''
+            INSERT INTO coin_transactions (user_id, amount, reason, admin_id)
+            VALUES (?, ?, ?, ?)
+        ''', [(user_id, -amount, reason, admin_id) for amount, reason in entries])
+        return rows[0][0]
+
+    def credit_many(self, conn, credits):
+        """Пакетное начисление: credits — список (user_id, amount, reason, admin_id).
+
+        Лимиты балансов проверяет вызывающий код, прочитав балансы в той же
+        транзакции BEGIN IMMEDIATE, поэтому здесь только два executemany.
+        """
+        conn.executemany(
+            "UPDATE users SET shadow_coins = shadow_coins + ? WHERE id = ?",
+            [(amount, user_id) for user_id, amount, _, _ in credits]
+        )
+        conn.executemany('''
+            INSERT INTO coin_transactions (user_id, amount, reason, admin_id)
+            VALUES (?, ?, ?, ?)
+        ''', credits)
+
+    def _record(self, conn, user_id, amount, reason, admin_id):
+        conn.execute('''
+            INSERT INTO coin_transactions (user_id, amount, reason, admin_id)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, amount, reason, admin_id))
@@ -0,0 +1,155 @@
+"""Сжатие журнала coin_transactions: закрытые дни — в дневные итоги, строки — в архив.
+
+В горячей таблице coin_transactions остаются только последние keep_days
+дней. Более старые строки переносятся в отдельный файл архива (по
+умолчанию raffle-archive.db рядом с основной базой), а в основной базе
+вместо них остаётся одна строка coin_daily_summaries на пользователя и
+день: начисления, списания, число операций, диапазон id и контрольная
+сумма. Балансы users.shadow_coins не меняются, а для каждого
+пользователя сумма net по итогам плюс сумма amount в горячей таблице до
+и после сжатия одна и та же.
+
+Перенос идёт пачками в два шага:
+1. строки копируются в архив (INSERT OR IGNORE по id), архив коммитится;
+2. в основной базе одной транзакцией строки удаляются с RETURNING, и
+   итоги считаются ровно по удалённым строкам.
+Строка не удаляется из основной базы, пока не закоммичена в архиве; сбой
+между шагами оставит в архиве лишние копии, повтор их не задвоит.
+Сжимаются только строки, уже учтённые сверкой балансов (reconciler.py).
+
+Архив подключается к основной базе через ATTACH только для аудита
+(RaffleDatabase.verify_ledger_archive, get_archived_transactions).
+
+    python ledger_archive.py [raffle.db] [--keep-days 30] [--verify]
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+from urllib.parse import quote
+
+# Колонки строки журнала в том порядке, в котором их хэширует chain_checksum
+ROW_COLUMNS = 'id, user_id, amount, reason, admin_id, created_at'
+
+
+class ArchiveMismatch(Exception):
+    """Удаляемые строки не совпали с тем, что записано в архив"""
+
+
+def default_archive_path(db_name):
+    return os.environ.get('LEDGER_ARCHIVE_DB') or f'{os.path.splitext(db_name)[0]}-archive.db'
+
+
+def chain_checksum(checksum, rows):
+    """Продолжить цепочку контрольной суммы строками ROW_COLUMNS (по возрастанию id).
+
+    Каждая строка хэшируется вместе с предыдущим значением, поэтому итог
+    дня можно дополнить строками, пришедшими позже, не перечитывая архив.
+    """
+    for row in rows:
+        line = '\x1f'.join('' if value is None else str(value) for value in row)
+        checksum = hashlib.sha256(f'{checksum}\n{line}'.encode()).hexdigest()
+    return checksum
+
+
+def summarize(rows, existing):
+    """Дневные итоги по строкам ROW_COLUMNS + день (по возрастанию id).
+
+    existing — {(user_id, day): строка coin_daily_summaries} уже сжатых
+    дней; новые строки дописываются к ним.
+    """
+    summaries = {}
+    for row in rows:
+        key = (row[1], row[6])
+        if key not in summaries:
+            previous = existing.get(key)
+            summaries[key] = {
+                'user_id': row[1],
+                'day': row[6],
+                'credits': previous[2] if previous else 0,
+                'debits': previous[3] if previous else 0,
+                'tx_count': previous[4] if previous else 0,
+                'first_id': previous[5] if previous else row[0],
+                'last_id': previous[6] if previous else row[0],
+                'checksum': previous[7] if previous else '',
+            }
+        summary = summaries[key]
+        amount = row[2]
+        if amount >= 0:
+            summary['credits'] += amount
+        else:
+            summary['debits'] -= amount
+        summary['tx_count'] += 1
+        summary['first_id'] = min(summary['first_id'], row[0])
+        summary['last_id'] = max(summary['last_id'], row[0])
+        summary['checksum'] = chain_checksum(summary['checksum'], [row[:6]])
+    return list(summaries.values())
+
+
+class LedgerArchive:
+    """Файл архива журнала: своя схема, своё соединение на время переноса"""
+
+    def __init__(self, path, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Основная база удаляет строки только после этого коммита — он должен пережить сбой
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS coin_transactions (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                reason TEXT,
+                admin_id INTEGER,
+                created_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_archive_user_created ON coin_transactions (user_id, created_at)"
+        )
+        return conn
+
+    def store(self, conn, rows):
+        """Записать строки ROW_COLUMNS и закоммитить (повторная запись не меняет архив)"""
+        with conn:
+            conn.executemany(f'''
+                INSERT OR IGNORE INTO coin_transactions ({ROW_COLUMNS})
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [row[:6] for row in rows])
+
+    def attach(self, conn, name='archive'):
+        """Подключить архив к соединению основной базы только для чтения; False — архива нет"""
+        if not os.path.exists(self.path):
+            return False
+        conn.execute(
+            "ATTACH DATABASE ? AS " + name,
+            (f"file:{quote(os.path.abspath(self.path))}?mode=ro",)
+        )
+        return True
+
+
+if __name__ == '__main__':
+    from database import RaffleDatabase
+
+    parser = argparse.ArgumentParser(description='Сжатие и архивирование журнала монет')
+    parser.add_argument('db', nargs='?', default='raffle.db')
+    parser.add_argument('--keep-days', type=int, default=int(os.environ.get('LEDGER_KEEP_DAYS', 30)))
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--verify', action='store_true', help='только проверить итоги по архиву')
+    args = parser.parse_args()
+
+    db = RaffleDatabase(args.db)
+    if not args.verify:
+        result = db.compact_ledger(keep_days=args.keep_days, batch_size=args.batch_size)
+        print(f"📦 В архив: {result['archived']} строк, дневных итогов: {result['summaries']}")
+    problems = db.verify_ledger_archive()
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        raise SystemExit(1)
+    print("✅ Дневные итоги сходятся с архивом")
@@ -0,0 +1,187 @@
+"""Метрики горячего пути и структурированный журнал.
+
+Задержки маршрутов Flask, методов RaffleDatabase и ожидания блокировок
+копятся в гистограммах. Каждый поток пишет только в свой шард, поэтому
+замер не берёт блокировок; шарды сливаются при чтении (/metrics), а шард
+завершившегося потока переносится в общий итог. Метрики считаются на
+процесс — у каждого воркера gunicorn свои.
+"""
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+# Границы гистограмм, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Вид замера -> (гистограмма, счётчик ошибок, имя метки, описание)
+KINDS = {
+    'route': ('raffle_request_duration_seconds', 'raffle_request_errors_total', 'route', 'Время обработки запроса'),
+    'db': ('raffle_db_call_duration_seconds', 'raffle_db_call_errors_total', 'method', 'Время вызова метода RaffleDatabase'),
+    'lock': ('raffle_lock_wait_seconds', 'raffle_lock_wait_errors_total', 'lock', 'Ожидание блокировки или очереди'),
+}
+
+
+class _Shard:
+    """Замеры одного потока: (вид, имя) -> [счётчики корзин, сумма, число, ошибки]"""
+
+    def __init__(self, metrics):
+        self.entries = {}
+        weakref.finalize(self, metrics._retire, self.entries)
+
+
+class Metrics:
+    """Гистограммы задержек с раздельными шардами по потокам"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = weakref.WeakSet()
+        self._retired = {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(self)
+            with self._lock:
+                self._shards.add(shard)
+        return shard.entries
+
+    def observe(self, kind, name, seconds, error=False):
+        entries = self._shard()
+        entry = entries.get((kind, name))
+        if entry is None:
+            entry = entries[(kind, name)] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0]
+        entry[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        entry[1] += seconds
+        entry[2] += 1
+        if error:
+            entry[3] += 1
+
+    def timed(self, kind, name):
+        """Декоратор: замер времени и ошибок функции"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception:
+                    self.observe(kind, name, time.perf_counter() - started, error=True)
+                    raise
+                self.observe(kind, name, time.perf_counter() - started)
+                return result
+            return wrapper
+        return decorator
+
+    def instrument(self, obj, kind='db', exclude=()):
+        """Обернуть публичные методы объекта замером (генераторы и exclude не трогаем)"""
+        for name, method in inspect.getmembers(type(obj), inspect.isfunction):
+            if name.startswith('_') or name in exclude or inspect.isgeneratorfunction(method):
+                continue
+            setattr(obj, name, self.timed(kind, name)(getattr(obj, name)))
+        return obj
+
+    def _retire(self, entries):
+        # Поток завершился — его замеры переходят в общий итог
+        with self._lock:
+            self._merge(self._retired, entries)
+
+    def _merge(self, total, entries):
+        for key, (counts, seconds, count, errors) in list(entries.items()):
+            entry = total.setdefault(key, [[0] * len(counts), 0.0, 0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += seconds
+            entry[2] += count
+            entry[3] += errors
+
+    def snapshot(self):
+        """Сумма по всем потокам: (вид, имя) -> [счётчики корзин, сумма, число, ошибки]"""
+        total = {}
+        with self._lock:
+            self._merge(total, self._retired)
+            shards = list(self._shards)
+        for shard in shards:
+            # Копия словаря атомарна; значения поток-владелец может дописывать — это лишь +1 к замеру
+            self._merge(total, shard.entries.copy())
+        return total
+
+    def render(self, extra=()):
+        """Текст в формате Prometheus; extra — (имя{метки}, тип, описание, значение) дополнительных метрик"""
+        lines = []
+        snapshot = self.snapshot()
+        for kind, (metric, errors_metric, label, description) in KINDS.items():
+            entries = sorted((name, entry) for (k, name), entry in snapshot.items() if k == kind)
+            if not entries:
+                continue
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, (counts, seconds, count, _) in entries:
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{{label}="{_escape(name)}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}="{_escape(name)}"}} {seconds:.6f}')
+                lines.append(f'{metric}_count{{{label}="{_escape(name)}"}} {count}')
+
+            lines.append(f"# HELP {errors_metric} Число ошибок")
+            lines.append(f"# TYPE {errors_metric} counter")
+            for name, entry in entries:
+                lines.append(f'{errors_metric}{{{label}="{_escape(name)}"}} {entry[3]}')
+
+        described = set()
+        for name, metric_type, description, value in extra:
+            # Имя может содержать метки: HELP/TYPE — один раз на метрику
+            base = name.split('{', 1)[0]
+            if base not in described:
+                described.add(base)
+                lines.append(f"# HELP {base} {description}")
+                lines.append(f"# TYPE {base} {metric_type}")
+            lines.append(f"{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class EventLog:
+    """Структурированный журнал: одно событие — одна JSON-строка.
+
+    События debug/info на горячем пути пишутся выборочно (доля sample_rate),
+    warning и error — всегда. Уровень задаётся обычной настройкой logging.
+    """
+
+    def __init__(self, name='raffle', sample_rate=1.0):
+        self.logger = logging.getLogger(name)
+        self.sample_rate = sample_rate
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields, sampled=True)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields, sampled=True)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields, sampled=False)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields, sampled=False)
+
+    def _log(self, level, event, fields, sampled):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sampled and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        self.logger.log(level, json.dumps({'event': event, **fields}, ensure_ascii=False, default=str))
+
+
+log = EventLog(sample_rate=float(os.environ.get('LOG_SAMPLE_RATE', 0.01)))
@@ -0,0 +1,207 @@
+"""Версионированные миграции схемы (номер версии хранится в PRAGMA user_version).
+
+Планы горячих запросов на итоговой схеме проверяет tests/test_query_plans.py.
+"""
+
+
+def _add_prize_weight(conn):
+    # В базах после первой версии взвешенного розыгрыша колонка уже есть
+    columns = [c[1] for c in conn.execute("PRAGMA table_info(prizes)")]
+    if 'weight' not in columns:
+        conn.execute("ALTER TABLE prizes ADD COLUMN weight INTEGER NOT NULL DEFAULT 1")
+
+
+MIGRATIONS = [
+    # 1: вес приза для взвешенного розыгрыша
+    (1, [_add_prize_weight]),
+    # 2: индексы под выборки победителей, транзакций и доступных призов
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_winners_user_won ON winners (user_id, won_at, prize_id)",
+        "CREATE INDEX IF NOT EXISTS idx_winners_won ON winners (won_at, user_id, prize_id)",
+        "CREATE INDEX IF NOT EXISTS idx_coin_tx_user_created ON coin_transactions (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_coin_tx_created ON coin_transactions (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_prizes_available ON prizes (id) WHERE available = 1",
+    ]),
+    # 3: ключи keyset-пагинации админки (rowid в конце индекса даёт порядок по id)
+    (3, [
+        "CREATE INDEX IF NOT EXISTS idx_users_coins ON users (shadow_coins)",
+        "CREATE INDEX IF NOT EXISTS idx_prizes_created ON prizes (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_winners_won_at ON winners (won_at)",
+    ]),
+    # 4: уменьшенные варианты изображения приза (images.py)
+    (4, [
+        "ALTER TABLE prizes ADD COLUMN thumb TEXT",
+        "ALTER TABLE prizes ADD COLUMN detail TEXT",
+    ]),
+    # 5: счётчик версии списка призов для кэша /api/prizes (общий для всех воркеров)
+    (5, [
+        "CREATE TABLE IF NOT EXISTS cache_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('prizes', 0)",
+        '''CREATE TRIGGER IF NOT EXISTS trg_prizes_version_insert AFTER INSERT ON prizes BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'prizes';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_prizes_version_update AFTER UPDATE ON prizes BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'prizes';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_prizes_version_delete AFTER DELETE ON prizes BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'prizes';
+           END''',
+    ]),
+    # 6: счётчики админской статистики, их поддерживают триггеры (get_stats за O(1))
+    (6, [
+        "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)",
+        '''INSERT OR REPLACE INTO stats (name, value)
+           SELECT 'users', COUNT(*) FROM users
+           UNION ALL SELECT 'total_coins', COALESCE(SUM(shadow_coins), 0) FROM users
+           UNION ALL SELECT 'prizes', COUNT(*) FROM prizes
+           UNION ALL SELECT 'available_prizes', COUNT(*) FROM prizes WHERE available = 1
+           UNION ALL SELECT 'winners', COUNT(*) FROM winners
+           UNION ALL SELECT 'coin_transactions', COUNT(*) FROM coin_transactions''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_users_insert AFTER INSERT ON users BEGIN
+               UPDATE stats SET value = value + 1 WHERE name = 'users';
+               UPDATE stats SET value = value + COALESCE(NEW.shadow_coins, 0) WHERE name = 'total_coins';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_users_delete AFTER DELETE ON users BEGIN
+               UPDATE stats SET value = value - 1 WHERE name = 'users';
+               UPDATE stats SET value = value - COALESCE(OLD.shadow_coins, 0) WHERE name = 'total_coins';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_users_coins AFTER UPDATE OF shadow_coins ON users BEGIN
+               UPDATE stats SET value = value + COALESCE(NEW.shadow_coins, 0) - COALESCE(OLD.shadow_coins, 0)
+               WHERE name = 'total_coins';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_prizes_insert AFTER INSERT ON prizes BEGIN
+               UPDATE stats SET value = value + 1 WHERE name = 'prizes';
+               UPDATE stats SET value = value + (NEW.available = 1) WHERE name = 'available_prizes';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_prizes_delete AFTER DELETE ON prizes BEGIN
+               UPDATE stats SET value = value - 1 WHERE name = 'prizes';
+               UPDATE stats SET value = value - (OLD.available = 1) WHERE name = 'available_prizes';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_prizes_available AFTER UPDATE OF available ON prizes BEGIN
+               UPDATE stats SET value = value + (NEW.available = 1) - (OLD.available = 1)
+               WHERE name = 'available_prizes';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_winners_insert AFTER INSERT ON winners BEGIN
+               UPDATE stats SET value = value + 1 WHERE name = 'winners';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_winners_delete AFTER DELETE ON winners BEGIN
+               UPDATE stats SET value = value - 1 WHERE name = 'winners';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_coin_tx_insert AFTER INSERT ON coin_transactions BEGIN
+               UPDATE stats SET value = value + 1 WHERE name = 'coin_transactions';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_stats_coin_tx_delete AFTER DELETE ON coin_transactions BEGIN
+               UPDATE stats SET value = value - 1 WHERE name = 'coin_transactions';
+           END''',
+    ]),
+    # 7: дневные итоги сжатого журнала монет (ledger_archive.py)
+    (7, [
+        '''CREATE TABLE IF NOT EXISTS coin_daily_summaries (
+               user_id INTEGER NOT NULL,
+               day TEXT NOT NULL,
+               credits INTEGER NOT NULL,
+               debits INTEGER NOT NULL,
+               tx_count INTEGER NOT NULL,
+               first_id INTEGER NOT NULL,
+               last_id INTEGER NOT NULL,
+               checksum TEXT NOT NULL,
+               compacted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               PRIMARY KEY (user_id, day)
+           ) WITHOUT ROWID''',
+    ]),
+    # 8: состояние инкрементальной сверки балансов с журналом (reconciler.py)
+    (8, [
+        "CREATE TABLE IF NOT EXISTS reconcile_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        # full = 1: первый проход сверит всех пользователей, а не только затронутых
+        "INSERT OR IGNORE INTO reconcile_state (name, value) VALUES ('watermark', 0), ('full', 1)",
+        '''CREATE TABLE IF NOT EXISTS ledger_sums (
+               user_id INTEGER PRIMARY KEY,
+               total INTEGER NOT NULL DEFAULT 0,
+               dirty INTEGER NOT NULL DEFAULT 0
+           )''',
+        "CREATE INDEX IF NOT EXISTS idx_ledger_sums_dirty ON ledger_sums (user_id) WHERE dirty = 1",
+        # Уже сжатых строк в журнале нет — их суммы берём из дневных итогов
+        '''INSERT OR IGNORE INTO ledger_sums (user_id, total, dirty)
+           SELECT user_id, SUM(credits - debits), 1 FROM coin_daily_summaries GROUP BY user_id''',
+        '''CREATE TABLE IF NOT EXISTS balance_drift (
+               user_id INTEGER PRIMARY KEY,
+               balance INTEGER,
+               ledger INTEGER NOT NULL,
+               drift INTEGER NOT NULL,
+               watermark INTEGER NOT NULL,
+               detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+    ]),
+    # 9: id сразу после won_at даёт порядок keyset-пагинации (won_at, id),
+    # а user_id и prize_id оставляют ленту покрывающей
+    (9, [
+        "DROP INDEX IF EXISTS idx_winners_won",
+        "CREATE INDEX IF NOT EXISTS idx_winners_won_id ON winners (won_at, id, user_id, prize_id)",
+    ]),
+    # 10: версия ленты победителей (winners_feed.py). Новые победы видны по MAX(id),
+    # а смену ника или названия приза и удаления другие воркеры узнают по счётчику
+    (10, [
+        "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('winners', 0)",
+        '''CREATE TRIGGER IF NOT EXISTS trg_winners_version_nickname AFTER UPDATE OF nickname ON users
+           WHEN old.nickname IS NOT new.nickname BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'winners';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_winners_version_user_delete AFTER DELETE ON users BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'winners';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_winners_version_prize_name AFTER UPDATE OF name ON prizes
+           WHEN old.name IS NOT new.name BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'winners';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_winners_version_prize_delete AFTER DELETE ON prizes BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'winners';
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_winners_version_winner_delete AFTER DELETE ON winners BEGIN
+               UPDATE cache_versions SET version = version + 1 WHERE name = 'winners';
+           END''',
+    ]),
+    # 11: журнал изменённых пользователей для кэша профилей (user_cache.py): каждый
+    # воркер дочитывает его и сбрасывает чужие изменения. Хранятся последние 10000 записей
+    (11, [
+        "CREATE TABLE IF NOT EXISTS user_changes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL)",
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_changes_update
+           AFTER UPDATE OF shadow_coins, nickname, telegram, site_url ON users BEGIN
+               INSERT INTO user_changes (user_id) VALUES (new.id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_changes_delete AFTER DELETE ON users BEGIN
+               INSERT INTO user_changes (user_id) VALUES (old.id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_changes_prune AFTER INSERT ON user_changes
+           WHEN new.id % 1000 = 0 BEGIN
+               DELETE FROM user_changes WHERE id <= new.id - 10000;
+           END''',
+    ]),
+    # 12: idx_winners_won_at (миграция 3) повторяет ведущую колонку idx_winners_won_id
+    (12, [
+        "DROP INDEX IF EXISTS idx_winners_won_at",
+    ]),
+]
+
+
+def migrate(conn):
+    """Применить недостающие миграции. Возвращает итоговую версию схемы"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Версию читаем под блокировкой записи: воркеры стартуют параллельно
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, steps in MIGRATIONS:
+            if target <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {target}")
+            version = target
+            print(f"✅ Схема обновлена до версии {target}")
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return version
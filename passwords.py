@@ -0,0 +1,157 @@
+"""Хэширование паролей: scrypt / PBKDF2 из hashlib с параметрами в самом хэше.
+
+Формат хранения:
+    scrypt$n=16384,r=8,p=1$<соль>$<хэш>
+    pbkdf2_sha256$i=600000$<соль>$<хэш>
+    <соль>:<sha256>              — старые хэши, только для проверки
+
+Хэш, посчитанный с другим алгоритмом или параметрами, чем текущие,
+считается устаревшим: после успешного входа его пересчитывают
+(needs_rehash). Вычисления идут в ограниченном пуле потоков — scrypt и
+pbkdf2_hmac отпускают GIL, а пул не даёт всплеску входов занять больше
+ядер, чем ему выделено, и оставляет процессор /api/draw.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 600000
+
+
+class HasherBusy(Exception):
+    """Очередь хэширования переполнена (всплеск входов)"""
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _parse_params(text):
+    return {key: int(value) for key, value in (item.split('=') for item in text.split(','))}
+
+
+class ScryptHasher:
+    name = 'scrypt'
+
+    def __init__(self, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.params = {'n': n, 'r': r, 'p': p}
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        digest = self._derive(password, salt, self.params)
+        params = ','.join(f'{key}={value}' for key, value in self.params.items())
+        return f"{self.name}${params}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, params, salt, digest):
+        return hmac.compare_digest(self._derive(password, salt, params), digest)
+
+    def _derive(self, password, salt, params):
+        n, r, p = params['n'], params['r'], params['p']
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p,
+            maxmem=256 * n * r * p, dklen=32
+        )
+
+
+class Pbkdf2Hasher:
+    name = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=PBKDF2_ITERATIONS):
+        self.params = {'i': iterations}
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        digest = self._derive(password, salt, self.params)
+        return f"{self.name}$i={self.params['i']}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, params, salt, digest):
+        return hmac.compare_digest(self._derive(password, salt, params), digest)
+
+    def _derive(self, password, salt, params):
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params['i'])
+
+
+def verify_legacy(password, hashed):
+    """Старый формат <соль>:<sha256(пароль + соль)>"""
+    salt, hash_value = hashed.split(':', 1)
+    hash_obj = hashlib.sha256((password + salt).encode())
+    return hmac.compare_digest(hash_obj.hexdigest(), hash_value)
+
+
+class PasswordHasher:
+    """Текущий алгоритм для новых хэшей + проверка всех известных форматов.
+
+    hash() и verify() выполняются в пуле из workers потоков; если в работе
+    и очереди уже max_pending задач, сразу бросается HasherBusy.
+    """
+
+    def __init__(self, algorithm='scrypt', workers=1, max_pending=32, **cost):
+        self.hashers = {
+            ScryptHasher.name: ScryptHasher(
+                n=cost.get('scrypt_n', SCRYPT_N),
+                r=cost.get('scrypt_r', SCRYPT_R),
+                p=cost.get('scrypt_p', SCRYPT_P)
+            ),
+            Pbkdf2Hasher.name: Pbkdf2Hasher(cost.get('pbkdf2_iterations', PBKDF2_ITERATIONS)),
+        }
+        if algorithm == 'pbkdf2':
+            algorithm = Pbkdf2Hasher.name
+        if algorithm not in self.hashers:
+            raise ValueError(f'Неизвестный алгоритм хэширования: {algorithm}')
+        self.current = self.hashers[algorithm]
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def hash(self, password):
+        """Хэш пароля текущим алгоритмом"""
+        return self._run(self.current.hash, password)
+
+    def verify(self, password, hashed):
+        """(пароль верен, хэш нужно пересчитать с текущими параметрами)"""
+        return self._run(self._verify, password, hashed)
+
+    def needs_rehash(self, hashed):
+        parts = hashed.split('$')
+        if len(parts) != 4 or parts[0] != self.current.name:
+            return True
+        return _parse_params(parts[1]) != self.current.params
+
+    def _verify(self, password, hashed):
+        if not hashed:
+            return False, False
+        parts = hashed.split('$')
+        if len(parts) == 1:
+            if ':' not in hashed:
+                return False, False
+            return verify_legacy(password, hashed), True
+
+        if len(parts) != 4 or parts[0] not in self.hashers:
+            return False, False
+        name, params, salt, digest = parts
+        try:
+            ok = self.hashers[name].verify(password, _parse_params(params), _unb64(salt), _unb64(digest))
+        except (ValueError, KeyError):
+            return False, False
+        return ok, ok and self.needs_rehash(hashed)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('Слишком много одновременных входов, попробуйте позже')
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
@@ -0,0 +1,150 @@
+import random
+import threading
+
+
+class NotEnoughPrizes(Exception):
+    """Доступных призов меньше, чем запрошено прокруток"""
+
+
+class FenwickTree:
+    """Дерево Фенвика по весам слотов: обновление и выбор за O(log n)"""
+
+    def __init__(self, weights):
+        self.size = 1
+        while self.size < max(len(weights), 1):
+            self.size *= 2
+        self.tree = [0] * (self.size + 1)
+        # Построение за O(n): суммы поднимаются и через пустые слоты (n, size],
+        # иначе корень tree[size] не получит веса хвоста после степени двойки
+        for i, w in enumerate(weights, start=1):
+            self.tree[i] = w
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+
+    def add(self, slot, delta):
+        i = slot + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        return self.tree[self.size]
+
+    def find(self, value):
+        """Слот, в чей диапазон весов попадает value (0 <= value < total)"""
+        pos = 0
+        step = self.size
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= value:
+                pos = nxt
+                value -= self.tree[nxt]
+            step //= 2
+        return pos
+
+
+class PrizePool:
+    """Индекс доступных призов в памяти с взвешенным выбором.
+
+    Призы подгружаются инкрементально (id > последнего известного), так
+    что розыгрыш не читает таблицу prizes целиком. Выбранный приз
+    убирается из индекса только после коммита (discard), а устаревшие
+    записи (приз уже разыграл другой воркер) отсеиваются в sample().
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._max_id = 0
+        self._slots = []     # слот -> (id, name, image) или None
+        self._weights = []   # слот -> вес
+        self._index = {}     # id приза -> слот
+        self._tree = FenwickTree([])
+
+    def __len__(self):
+        return len(self._index)
+
+    def sync(self, conn):
+        """Подгрузить призы, добавленные после последней синхронизации"""
+        rows = conn.execute('''
+            SELECT id, name, image, weight FROM prizes
+            WHERE id > ? AND available = 1
+            ORDER BY id
+        ''', (self._max_id,)).fetchall()
+        if not rows:
+            return
+        with self._lock:
+            for prize_id, name, image, weight in rows:
+                self._add(prize_id, name, image, weight)
+            self._max_id = max(self._max_id, rows[-1][0])
+
+    def _add(self, prize_id, name, image, weight):
+        if prize_id in self._index or weight <= 0:
+            return
+        slot = len(self._slots)
+        self._slots.append((prize_id, name, image))
+        self._weights.append(weight)
+        self._index[prize_id] = slot
+        if slot < self._tree.size:
+            self._tree.add(slot, weight)
+        else:
+            self._rebuild()
+
+    def discard(self, prize_id):
+        """Убрать приз из индекса (разыгран)"""
+        with self._lock:
+            slot = self._index.pop(prize_id, None)
+            if slot is None:
+                return
+            self._tree.add(slot, -self._weights[slot])
+            self._slots[slot] = None
+            self._weights[slot] = 0
+            # Не даём пустым слотам разрастаться
+            if len(self._slots) > 2 * len(self._index) + 64:
+                self._rebuild()
+
+    def _rebuild(self):
+        live = [i for i, prize in enumerate(self._slots) if prize is not None]
+        self._slots = [self._slots[i] for i in live]
+        self._weights = [self._weights[i] for i in live]
+        self._index = {prize[0]: slot for slot, prize in enumerate(self._slots)}
+        self._tree = FenwickTree(self._weights)
+
+    def sample(self, n, claim):
+        """Выбрать до n разных призов с учётом весов.
+
+        claim(prize) помечает приз разыгранным в базе и возвращает False,
+        если его уже забрал другой воркер, — такой приз сразу убирается из
+        индекса. Выбранные призы остаются в индексе до discard() после
+        коммита, так что откат транзакции ничего не теряет.
+        """
+        picked = []
+        with self._lock:
+            try:
+                while len(picked) < n:
+                    total = self._tree.total()
+                    if total <= 0:
+                        break
+                    slot = self._tree.find(random.randrange(total))
+                    prize = self._slots[slot]
+
+                    # Временно исключаем из выбора, чтобы не выпал повторно
+                    self._tree.add(slot, -self._weights[slot])
+                    try:
+                        claimed = claim(prize)
+                    except BaseException:
+                        # Ошибка базы — приз остаётся в розыгрыше
+                        self._tree.add(slot, self._weights[slot])
+                        raise
+                    if claimed:
+                        picked.append(slot)
+                    else:
+                        # Без _rebuild: номера слотов в picked должны остаться прежними
+                        del self._index[prize[0]]
+                        self._slots[slot] = None
+                        self._weights[slot] = 0
+            finally:
+                for slot in picked:
+                    self._tree.add(slot, self._weights[slot])
+            return [self._slots[slot] for slot in picked]
@@ -0,0 +1,38 @@
+import hashlib
+import json
+import threading
+
+
+class PrizesCache:
+    """Готовый JSON списка доступных призов с ETag.
+
+    Любое изменение таблицы prizes (розыгрыш, добавление приза) триггером
+    увеличивает счётчик в cache_versions в той же транзакции, поэтому
+    воркеры gunicorn узнают об изменении друг друга. Проверка свежести —
+    один SELECT по первичному ключу вместо выборки и сборки словарей.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._body = None
+        self._etag = None
+
+    def snapshot(self, conn, load):
+        """Вернуть (body, etag). load(conn) — список призов для JSON"""
+        # Версию читаем до данных: если приз изменится между запросами,
+        # кэш окажется под старой версией и перечитается в следующий раз
+        version = conn.execute(
+            "SELECT version FROM cache_versions WHERE name = 'prizes'"
+        ).fetchone()[0]
+        with self._lock:
+            if self._body is not None and self._version == version:
+                return self._body, self._etag
+
+        body = json.dumps({'success': True, 'prizes': load(conn)}).encode()
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            self._version = version
+            self._body = body
+            self._etag = etag
+        return body, etag
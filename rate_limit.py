@@ -0,0 +1,169 @@
+"""Ограничение частоты запросов и допуск к пишущим маршрутам.
+
+Корзины токенов (по IP и по пользователю) лежат в отдельном файле SQLite,
+общем для всех воркеров gunicorn на машине, но не в raffle.db: проверка
+лимита не конкурирует с розыгрышами за блокировку записи основной базы.
+Кроме корзин, число одновременно выполняемых пишущих запросов в воркере
+ограничено: лишние сразу получают 429, а не ждут в очереди до таймаута.
+У маршрутов с дорогим хэшированием паролей (вход, регистрация) свои
+слоты, поэтому поток входов не отнимает слоты у розыгрыша.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import log
+
+# Удалять корзины, к которым не обращались дольше (секунды)
+IDLE_BUCKET_SECONDS = 3600
+CLEANUP_EVERY = 1000
+
+
+class TokenBuckets:
+    """Корзины токенов в SQLite: одна проверка — один INSERT ... ON CONFLICT ... RETURNING"""
+
+    def __init__(self, path, busy_timeout_ms=1000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._checks = 0
+        self.connection().execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # После fork соединение родителя не используем
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Потеря нескольких последних списаний при сбое питания не страшна
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, capacity):
+        """Взять токен; вернуть 0, если он был, иначе — через сколько секунд появится"""
+        now = time.time()
+        conn = self.connection()
+        # Пополнение за прошедшее время считается в том же запросе, что и списание
+        row = conn.execute('''
+            INSERT INTO buckets (key, tokens, updated) VALUES (?, ? - 1, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                tokens = MIN(?, tokens + (excluded.updated - updated) * ?) - 1,
+                updated = excluded.updated
+            WHERE MIN(?, tokens + (excluded.updated - updated) * ?) >= 1
+            RETURNING tokens
+        ''', (key, capacity, now, capacity, rate, capacity, rate)).fetchone()
+
+        self._checks += 1
+        if self._checks % CLEANUP_EVERY == 0:
+            conn.execute("DELETE FROM buckets WHERE updated < ?", (now - IDLE_BUCKET_SECONDS,))
+
+        if row is not None:
+            return 0
+        tokens, updated = conn.execute(
+            "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+        ).fetchone()
+        available = min(capacity, tokens + (now - updated) * rate)
+        return max((1 - available) / rate, 0.001)
+
+
+class AdmissionControl:
+    """Лимиты маршрутов и общий предел одновременных пишущих запросов.
+
+    limits — {маршрут: {'ip': (токенов в секунду, ёмкость), 'user': (...)}};
+    route_writes — {маршрут: свой предел одновременных запросов}, остальные
+    маршруты делят общий max_writes.
+    """
+
+    def __init__(self, buckets, limits, max_writes=8, route_writes=None):
+        self.buckets = buckets
+        self.limits = limits
+        self.max_writes = max_writes
+        self.route_writes = dict(route_writes or {})
+        self._writes = threading.BoundedSemaphore(max_writes)
+        self._route_slots = {
+            route: threading.BoundedSemaphore(limit) for route, limit in self.route_writes.items()
+        }
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._shed = {}  # (маршрут, причина) -> число отказов
+
+    def check(self, route, keys):
+        """Списать токены по всем ключам ({'ip': ..., 'user': ...}); вернуть Retry-After или 0"""
+        for kind, value in keys.items():
+            limit = self.limits.get(route, {}).get(kind)
+            if limit is None or value is None:
+                continue
+            try:
+                retry_after = self.buckets.take(f'{route}:{kind}:{value}', *limit)
+            except sqlite3.Error as e:
+                # Хранилище лимитов недоступно — пропускаем, а не роняем розыгрыш
+                log.warning('rate_limit.store_failed', route=route, error=repr(e))
+                return 0
+            if retry_after:
+                self._count_shed(route, kind)
+                return retry_after
+        return 0
+
+    def enter(self, route):
+        """Занять слот пишущего запроса (не ждёт); False — слотов нет"""
+        if not self._slots(route).acquire(blocking=False):
+            self._count_shed(route, 'concurrency')
+            return False
+        with self._lock:
+            self._admitted += 1
+        return True
+
+    def leave(self, route):
+        self._slots(route).release()
+
+    def _slots(self, route):
+        return self._route_slots.get(route, self._writes)
+
+    def _count_shed(self, route, reason):
+        with self._lock:
+            self._shed[(route, reason)] = self._shed.get((route, reason), 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_writes': self.max_writes,
+                'route_writes': self.route_writes,
+                'admitted': self._admitted,
+                'shed': [
+                    {'route': route, 'reason': reason, 'count': count}
+                    for (route, reason), count in sorted(self._shed.items())
+                ],
+            }
+
+
+def load_rate_limits(defaults, override):
+    """Лимиты по умолчанию с заменами из JSON, например RATE_LIMITS='{"draw": {"ip": [50, 100]}}'.
+
+    null вместо пары снимает лимит по этому ключу.
+    """
+    limits = {route: dict(kinds) for route, kinds in defaults.items()}
+    for route, kinds in json.loads(override).items():
+        for kind, limit in kinds.items():
+            if limit is None:
+                limits.setdefault(route, {}).pop(kind, None)
+            else:
+                rate, capacity = float(limit[0]), float(limit[1])
+                if rate <= 0 or capacity < 1:
+                    raise ValueError(f'RATE_LIMITS: {route}.{kind} — нужна скорость > 0 и ёмкость >= 1')
+                limits.setdefault(route, {})[kind] = (rate, capacity)
+    return limits
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
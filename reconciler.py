@@ -0,0 +1,337 @@
+"""Сверка балансов users.shadow_coins с журналом coin_transactions.
+
+Полный SUM(amount) GROUP BY user_id по всему журналу слишком дорог,
+поэтому сверка инкрементальная. В основной базе хранятся:
+- reconcile_state.watermark — последний учтённый id журнала;
+- ledger_sums — сумма amount по пользователю для строк до watermark
+  (вместе со сжатыми в coin_daily_summaries), dirty = 1 у тех, чьи новые
+  строки учтены, но баланс ещё не сверен;
+- balance_drift — пользователи, у которых баланс разошёлся с журналом.
+
+Каждый проход читает в одном снимке (отдельное соединение, BEGIN) не
+больше max_rows новых строк. Когда журнал дочитан до конца снимка,
+балансы затронутых пользователей сравниваются в том же снимке — монеты и
+строка журнала пишутся одной транзакцией, поэтому в снимке они согласованы.
+Результат записывается одной транзакцией очереди записи с проверкой, что
+watermark не сдвинул параллельный проход (другой воркер или CLI).
+
+Ограничение: инкрементальный проход сверяет только пользователей с новыми
+строками журнала. Баланс, изменённый без строки журнала (ручной UPDATE,
+ошибка в коде), сам по себе он не заметит. Поэтому каждый проход, дочитавший
+журнал, ещё сравнивает общие суммы: SUM(users.shadow_coins) против суммы
+ledger_sums (с учётом уже известных расхождений). Если остаётся разница
+(hidden_drift), следующий проход сверяет всех пользователей и находит
+виновника; run() делает его сразу. Ручной полный проход — --full (reset()).
+
+compact_ledger архивирует только строки до watermark: они уже учтены.
+
+    python reconciler.py [raffle.db] [--batch 5000] [--full]
+"""
+import argparse
+import os
+import threading
+import time
+
+from metrics import log
+
+# Сколько пользователей сверять одним запросом IN (...)
+CHUNK = 500
+
+
+class ReconcileConflict(Exception):
+    """Watermark сдвинул другой проход сверки"""
+
+
+class BalanceReconciler:
+    """Инкрементальная сверка: open_reader() — соединение только для чтения,
+    transaction(fn) — RaffleDatabase._transaction."""
+
+    def __init__(self, open_reader, transaction, batch_size=5000):
+        self.open_reader = open_reader
+        self.transaction = transaction
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._last_run = None
+
+    # ========== ПРОХОД ==========
+
+    def run_once(self, max_rows=None):
+        """Учесть не больше max_rows новых строк; вернуть отчёт прохода"""
+        max_rows = max_rows or self.batch_size
+        conn = self.open_reader()
+        try:
+            # Всё чтение — в одном снимке WAL
+            conn.execute("BEGIN")
+            state = dict(conn.execute("SELECT name, value FROM reconcile_state"))
+            watermark = state.get('watermark', 0)
+            batch = '''
+                SELECT id, user_id, amount FROM coin_transactions
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            '''
+            rows, new_watermark = conn.execute(
+                f"SELECT COUNT(*), MAX(id) FROM ({batch})", (watermark, max_rows)
+            ).fetchone()
+            deltas = dict(conn.execute(
+                f"SELECT user_id, SUM(amount) FROM ({batch}) GROUP BY user_id", (watermark, max_rows)
+            ))
+            caught_up = rows < max_rows
+            new_watermark = new_watermark or watermark
+
+            full = bool(state.get('full'))
+            checked = {}
+            hidden = 0
+            if caught_up:
+                checked = self._balances(conn, deltas, full=full)
+                hidden = self._hidden_drift(conn, deltas, checked)
+        finally:
+            conn.close()
+
+        drift = {
+            user_id: (balance, ledger)
+            for user_id, (balance, ledger) in checked.items()
+            if (balance or 0) != ledger
+        }
+
+        def save(conn):
+            cursor = conn.execute(
+                "UPDATE reconcile_state SET value = ? WHERE name = 'watermark' AND value = ?",
+                (new_watermark, watermark)
+            )
+            if cursor.rowcount != 1:
+                raise ReconcileConflict('Сверку уже продвинул другой проход')
+            conn.executemany('''
+                INSERT INTO ledger_sums (user_id, total, dirty) VALUES (?, ?, 1)
+                ON CONFLICT (user_id) DO UPDATE SET total = total + excluded.total, dirty = 1
+            ''', deltas.items())
+            if caught_up:
+                # Всех dirty из снимка только что сверили, других писателей ledger_sums нет
+                conn.execute("UPDATE ledger_sums SET dirty = 0 WHERE dirty = 1")
+                # Разница общих сумм без известного виновника — следующий проход сверит всех
+                conn.execute(
+                    "UPDATE reconcile_state SET value = ? WHERE name = 'full'", (int(bool(hidden)),)
+                )
+                conn.executemany(
+                    "DELETE FROM balance_drift WHERE user_id = ?",
+                    [(user_id,) for user_id in checked if user_id not in drift]
+                )
+                conn.executemany('''
+                    INSERT INTO balance_drift (user_id, balance, ledger, drift, watermark)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        balance = excluded.balance,
+                        ledger = excluded.ledger,
+                        drift = excluded.drift,
+                        watermark = excluded.watermark,
+                        detected_at = CURRENT_TIMESTAMP
+                ''', [
+                    (user_id, balance, ledger, (balance or 0) - ledger, new_watermark)
+                    for user_id, (balance, ledger) in drift.items()
+                ])
+
+        self.transaction(save)
+
+        for user_id, (balance, ledger) in drift.items():
+            log.warning('reconcile.drift', user_id=user_id, balance=balance, ledger=ledger)
+        if hidden:
+            log.warning('reconcile.hidden_drift', amount=hidden, watermark=new_watermark)
+        return {
+            'rows': rows,
+            'watermark': new_watermark,
+            'caught_up': caught_up,
+            'full': full,
+            'hidden_drift': hidden,
+            'users_checked': len(checked),
+            'drift': [
+                {'user_id': user_id, 'balance': balance, 'ledger': ledger, 'drift': (balance or 0) - ledger}
+                for user_id, (balance, ledger) in sorted(drift.items())
+            ],
+        }
+
+    def _balances(self, conn, deltas, full=False):
+        """{user_id: (баланс, сумма по журналу)} для сверяемых пользователей в текущем снимке.
+
+        Обычно это затронутые новыми строками и помеченные dirty; при full —
+        все пользователи (первый проход или после reset).
+        """
+        if full:
+            result = {
+                user_id: (balance, total + deltas.get(user_id, 0))
+                for user_id, balance, total in conn.execute('''
+                    SELECT u.id, u.shadow_coins, COALESCE(s.total, 0)
+                    FROM users u LEFT JOIN ledger_sums s ON s.user_id = u.id
+                ''')
+            }
+            # Строки журнала удалённых пользователей
+            for user_id, total in conn.execute(
+                "SELECT user_id, total FROM ledger_sums WHERE user_id NOT IN (SELECT id FROM users)"
+            ):
+                result[user_id] = (None, total + deltas.get(user_id, 0))
+            for user_id in deltas.keys() - result.keys():
+                result[user_id] = (None, deltas[user_id])
+            return result
+
+        totals = dict(conn.execute("SELECT user_id, total FROM ledger_sums WHERE dirty = 1"))
+        for user_id in deltas:
+            totals.setdefault(user_id, None)
+        missing = [user_id for user_id, total in totals.items() if total is None]
+        for start in range(0, len(missing), CHUNK):
+            chunk = missing[start:start + CHUNK]
+            totals.update(conn.execute(
+                f"SELECT user_id, total FROM ledger_sums WHERE user_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+
+        ids = list(totals)
+        balances = {}
+        for start in range(0, len(ids), CHUNK):
+            chunk = ids[start:start + CHUNK]
+            balances.update(conn.execute(
+                f"SELECT id, shadow_coins FROM users WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return {
+            user_id: (balances.get(user_id), (totals[user_id] or 0) + deltas.get(user_id, 0))
+            for user_id in ids
+        }
+
+    def _hidden_drift(self, conn, deltas, checked):
+        """Разница общих сумм балансов и журнала, не объяснённая известными расхождениями.
+
+        Удалённые пользователи в суммы не входят. Известные расхождения —
+        найденные в этом проходе и сохранённые в balance_drift раньше у тех,
+        кого этот проход не сверял.
+        """
+        balances, ledger = conn.execute('''
+            SELECT
+                (SELECT COALESCE(SUM(shadow_coins), 0) FROM users),
+                (SELECT COALESCE(SUM(s.total), 0) FROM ledger_sums s JOIN users u ON u.id = s.user_id)
+        ''').fetchone()
+        known = {
+            user_id: drift
+            for user_id, drift in conn.execute(
+                "SELECT user_id, drift FROM balance_drift WHERE balance IS NOT NULL"
+            )
+            if user_id not in checked
+        }
+        for user_id, (balance, total) in checked.items():
+            if balance is None:
+                continue
+            # В ledger_sums снимка новых строк ещё нет
+            ledger += deltas.get(user_id, 0)
+            known[user_id] = balance - total
+        return balances - ledger - sum(known.values())
+
+    def run(self, max_rows=None, duty=1.0):
+        """Проходы до конца журнала; duty < 1 — доля времени работы (остальное — сон)"""
+        report = {'rows': 0, 'users_checked': 0, 'drift': []}
+        while True:
+            started = time.perf_counter()
+            result = self.run_once(max_rows)
+            report['rows'] += result['rows']
+            report['users_checked'] += result['users_checked']
+            report['drift'] += result['drift']
+            report['watermark'] = result['watermark']
+            if result['caught_up'] and not (result['hidden_drift'] and not result['full']):
+                self._last_run = time.time()
+                return report
+            if duty < 1:
+                time.sleep((time.perf_counter() - started) * (1 - duty) / duty)
+
+    def reset(self):
+        """Начать сверку заново: следующий проход сверит всех пользователей"""
+        def clear(conn):
+            conn.execute("DELETE FROM ledger_sums")
+            conn.execute("DELETE FROM balance_drift")
+            # Сжатые строки в горячей таблице уже не прочитать — берём их итоги
+            conn.execute('''
+                INSERT INTO ledger_sums (user_id, total, dirty)
+                SELECT user_id, SUM(credits - debits), 1 FROM coin_daily_summaries GROUP BY user_id
+            ''')
+            conn.execute("UPDATE reconcile_state SET value = 0 WHERE name = 'watermark'")
+            conn.execute("UPDATE reconcile_state SET value = 1 WHERE name = 'full'")
+        self.transaction(clear)
+
+    # ========== ФОНОВЫЙ ПОТОК ==========
+
+    def ensure_running(self, interval, duty=0.05):
+        """Запустить фоновую сверку раз в interval секунд (один поток на процесс)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # После fork поток родителя в воркере не существует — запускаем свой
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._loop, args=(interval, duty), name='reconciler', daemon=True
+            )
+            self._thread.start()
+
+    def _loop(self, interval, duty):
+        while True:
+            time.sleep(interval)
+            try:
+                self.run(duty=duty)
+            except ReconcileConflict:
+                # Тот же журнал сверил другой воркер
+                pass
+            except Exception as e:
+                log.error('reconcile.failed', error=repr(e))
+
+    def stats(self):
+        """Watermark, отставание от журнала и расхождения (для админки и /metrics)"""
+        conn = self.open_reader()
+        try:
+            watermark = conn.execute(
+                "SELECT value FROM reconcile_state WHERE name = 'watermark'"
+            ).fetchone()[0]
+            last_id = conn.execute("SELECT MAX(id) FROM coin_transactions").fetchone()[0] or 0
+            drift = conn.execute('''
+                SELECT user_id, balance, ledger, drift, watermark, detected_at
+                FROM balance_drift ORDER BY ABS(drift) DESC, user_id
+            ''').fetchall()
+        finally:
+            conn.close()
+        return {
+            'watermark': watermark,
+            'lag_rows': max(last_id - watermark, 0),
+            'last_run': self._last_run,
+            'drift': [
+                dict(zip(('user_id', 'balance', 'ledger', 'drift', 'watermark', 'detected_at'), row))
+                for row in drift
+            ],
+        }
+
+
+if __name__ == '__main__':
+    from database import RaffleDatabase
+
+    parser = argparse.ArgumentParser(
+        description='Сверка балансов с журналом монет',
+        epilog='Обычный проход сверяет только пользователей с новыми строками журнала; баланс, '
+               'изменённый без строки журнала, выдаёт разница общих сумм (hidden_drift), '
+               'после неё сверяются все. --full сверяет всех сразу.'
+    )
+    parser.add_argument('db', nargs='?', default='raffle.db')
+    parser.add_argument('--batch', type=int, default=5000, help='строк журнала за проход')
+    parser.add_argument('--duty', type=float, default=1.0, help='доля времени работы (0..1]')
+    parser.add_argument('--full', action='store_true', help='сбросить watermark и сверить всех')
+    args = parser.parse_args()
+
+    db = RaffleDatabase(args.db)
+    if args.full:
+        db.reconciler.reset()
+    report = db.reconciler.run(args.batch, args.duty)
+    print(f"🔎 Учтено строк: {report['rows']}, сверено пользователей: {report['users_checked']}, "
+          f"watermark: {report['watermark']}")
+    if report.get('hidden_drift'):
+        print(f"⚠️ Общие суммы расходятся на {report['hidden_drift']:+d} без известного пользователя")
+    for row in report['drift']:
+        print(f"❌ user {row['user_id']}: баланс {row['balance']}, по журналу {row['ledger']} ({row['drift']:+d})")
+    if report['drift']:
+        raise SystemExit(1)
+    print("✅ Балансы сходятся с журналом")
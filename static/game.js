@@ -26,6 +26,58 @@ class ShadowRaffleGame {
         });
         
         this.loadSection('game');
+        this.connectStream();
+    }
+    
+    // Живые обновления через Server-Sent Events вместо повторных запросов.
+    // Подключаемся, только если сервер объявил поток (data-sse на <body>).
+    // Розыгрыш приходит одним событием draw и применяется на месте, без запросов
+    connectStream() {
+        if (document.body.dataset.sse !== 'on') return;
+        if (!window.EventSource || !this.currentUser) return;
+        
+        this.eventSource = new EventSource(`/api/stream?user_id=${this.currentUser.id}`);
+        
+        let connected = false;
+        this.eventSource.addEventListener('open', () => {
+            // После обрыва события могли потеряться — перечитываем всё один раз
+            if (connected) this.scheduleRefresh();
+            connected = true;
+        });
+        
+        this.eventSource.addEventListener('draw', (e) => {
+            if (this.currentSection !== 'game') return;
+            const data = JSON.parse(e.data);
+            if (this.publicWinners) {
+                this.publicWinners = [...data.winners, ...this.publicWinners].slice(0, 50);
+                this.renderPublicWinners();
+            }
+            if (this.rouletteCards) {
+                const claimed = new Set(data.prize_ids);
+                this.renderPrizes(this.rouletteCards.filter(prize => !claimed.has(prize.id)));
+            }
+        });
+        
+        // Новый приз (редкое действие админа) — перечитываем список, но не все клиенты сразу
+        this.eventSource.addEventListener('prize_added', () => this.scheduleRefresh());
+        
+        this.eventSource.addEventListener('balance', (e) => {
+            const data = JSON.parse(e.data);
+            this.currentUser.shadow_coins = data.shadow_coins;
+            localStorage.setItem('shadowUser', JSON.stringify(this.currentUser));
+            this.updateUserDisplay();
+        });
+    }
+    
+    // Одно перечитывание призов и победителей на пачку событий, со случайной задержкой
+    scheduleRefresh() {
+        if (this.refreshTimer) return;
+        this.refreshTimer = setTimeout(() => {
+            this.refreshTimer = null;
+            if (this.currentSection !== 'game') return;
+            this.loadPrizes();
+            this.loadPublicWinners();
+        }, 1000 + Math.random() * 4000);
     }
     
     async loadUserFromStorage() {
@@ -176,41 +228,8 @@ class ShadowRaffleGame {
             const response = await fetch('/api/prizes');
             const data = await response.json();
             
-            const grid = document.getElementById('prizesGrid');
-            const spinBtn = document.getElementById('spinButton');
-            
             if (data.success) {
-                // Сохраняем призы для рулетки
-                this.rouletteCards = data.prizes;
-                
-                // Обновляем отображение в сетке призов
-                if (grid) {
-                    if (data.prizes.length > 0) {
-                        grid.innerHTML = data.prizes.map(prize => `
-                            <div class="prize-card" onclick="window.gameInstance.showPrizeDetails(${JSON.stringify(prize).replace(/"/g, '&quot;')})">
-                                <img src="/static/images/${prize.image}" alt="${prize.name}">
-                            </div>
-                        `).join('');
-                    } else {
-                        grid.innerHTML = '<p class="no-prizes">✨ Все карты разыграны! ✨</p>';
-                    }
-                }
-                
-                // Обновляем кнопку
-                if (spinBtn) {
-                    if (data.prizes.length === 0) {
-                        spinBtn.textContent = '✨ ВСЕ КАРТЫ РАЗЫГРАНЫ ✨';
-                        spinBtn.disabled = true;
-                    } else {
-                        spinBtn.textContent = '🌑 КРУТИТЬ РУЛЕТКУ (1 теневая монета) 🌑';
-                        spinBtn.disabled = false;
-                    }
-                }
-                
-                // Обновляем рулетку ТОЛЬКО если не идет прокрутка
-                if (!this.isSpinning) {
-                    this.initRoulette();
-                }
+                this.renderPrizes(data.prizes);
             }
 
         } catch (error) {
@@ -218,6 +237,43 @@ class ShadowRaffleGame {
         }
     }
 
+        renderPrizes(prizes) {
+            const grid = document.getElementById('prizesGrid');
+            const spinBtn = document.getElementById('spinButton');
+            
+            // Сохраняем призы для рулетки
+            this.rouletteCards = prizes;
+            
+            // Обновляем отображение в сетке призов
+            if (grid) {
+                if (prizes.length > 0) {
+                    grid.innerHTML = prizes.map(prize => `
+                        <div class="prize-card" onclick="window.gameInstance.showPrizeDetails(${JSON.stringify(prize).replace(/"/g, '&quot;')})">
+                            <img src="${prize.thumb_url}" alt="${prize.name}" width="160" height="240" loading="lazy" decoding="async">
+                        </div>
+                    `).join('');
+                } else {
+                    grid.innerHTML = '<p class="no-prizes">✨ Все карты разыграны! ✨</p>';
+                }
+            }
+            
+            // Обновляем кнопку
+            if (spinBtn) {
+                if (prizes.length === 0) {
+                    spinBtn.textContent = '✨ ВСЕ КАРТЫ РАЗЫГРАНЫ ✨';
+                    spinBtn.disabled = true;
+                } else {
+                    spinBtn.textContent = '🌑 КРУТИТЬ РУЛЕТКУ (1 теневая монета) 🌑';
+                    spinBtn.disabled = false;
+                }
+            }
+            
+            // Обновляем рулетку ТОЛЬКО если не идет прокрутка
+            if (!this.isSpinning) {
+                this.initRoulette();
+            }
+    }
+
         safeRefreshRoulette() {
             const track = document.getElementById('rouletteTrack');
             if (!track) return;
@@ -268,7 +324,7 @@ class ShadowRaffleGame {
             
             track.innerHTML = cards.map(prize => `
                 <div class="roulette-card">
-                    <img src="/static/images/${prize.image}" alt="${prize.name}">
+                    <img src="${prize.thumb_url}" alt="${prize.name}" width="160" height="240" decoding="async">
                 </div>
             `).join('');
             
@@ -293,7 +349,7 @@ class ShadowRaffleGame {
             <div class="modal-content">
                 <button class="modal-close" onclick="this.closest('.modal-overlay').remove()">✕</button>
                 <div class="modal-image">
-                    <img src="/static/images/${prize.image}" alt="${prize.name}">
+                    <img src="${prize.detail_url || prize.image_url}" alt="${prize.name}">
                 </div>
                 <h2 class="modal-title">${prize.name}</h2>
                 <div class="modal-description">
@@ -322,7 +378,7 @@ class ShadowRaffleGame {
             <div class="modal-content" style="border-color: #ffaa00;">
                 <button class="modal-close" onclick="this.closest('.modal-overlay').remove()">✕</button>
                 <div class="modal-image">
-                    <img src="/static/images/${prize.image}" alt="${prize.name}">
+                    <img src="${prize.detail_url || prize.image_url}" alt="${prize.name}">
                 </div>
                 <h2 class="modal-title" style="color: #ffaa00;">🎉 ПОБЕДА! 🎉</h2>
                 <div class="modal-description">
@@ -443,8 +499,8 @@ class ShadowRaffleGame {
             
             if (data.success && data.wins.length > 0) {
                 grid.innerHTML = data.wins.map(win => `
-                    <div class="prize-card" onclick="window.gameInstance.showPrizeDetails({name: '${win.name}', image: '${win.image}', description: '${win.description || ''}'})">
-                        <img src="/static/images/${win.image}" alt="${win.name}">
+                    <div class="prize-card" onclick="window.gameInstance.showPrizeDetails({name: '${win.name}', image: '${win.image}', detail_url: '${win.detail_url}', description: '${win.description || ''}'})">
+                        <img src="${win.thumb_url}" alt="${win.name}" width="160" height="240" loading="lazy" decoding="async">
                     </div>
                 `).join('');
             } else {
@@ -461,13 +517,23 @@ class ShadowRaffleGame {
             const response = await fetch('/api/public-winners');
             const data = await response.json();
             
+            if (data.success) {
+                this.publicWinners = data.winners;
+                this.renderPublicWinners();
+            }
+        } catch (error) {
+            console.error('Ошибка загрузки победителей:', error);
+        }
+    }
+    
+        renderPublicWinners() {
             const container = document.getElementById('publicWinners');
             if (!container) return;
             
-            if (data.success && data.winners.length > 0) {
+            if (this.publicWinners.length > 0) {
                 container.innerHTML = `
                     <div class="winners-list">
-                        ${data.winners.map(w => `
+                        ${this.publicWinners.map(w => `
                             <div class="winner-item">
                                 <span class="nickname">${w.nickname}</span>
                                 <span class="prize">${w.prize_name}</span>
@@ -479,9 +545,6 @@ class ShadowRaffleGame {
             } else {
                 container.innerHTML = '<p>Пока нет победителей</p>';
             }
-        } catch (error) {
-            console.error('Ошибка загрузки победителей:', error);
-        }
     }
     
     showMessage(text, type) {
@@ -549,33 +612,7 @@ class ShadowRaffleGame {
             return;
         }
         
-        try {
-            const response = await fetch('/api/update_profile', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    user_id: this.currentUser.id,
-                    nickname: newNickname
-                })
-            });
-            
-            const data = await response.json();
-            
-            if (data.success) {
-                this.currentUser = data.user;
-                localStorage.setItem('shadowUser', JSON.stringify(this.currentUser));
-                document.querySelector('.modal-overlay').remove();
-                this.showMessage('Никнейм успешно изменён!', 'success');
-                this.loadSection('profile');
-                this.updateUserDisplay();
-            } else {
-                this.showMessage(data.message, 'error');
-            }
-        } catch (error) {
-            this.showMessage('Ошибка соединения с сервером', 'error');
-        }
+        await this.saveProfile({ nickname: newNickname }, 'Никнейм успешно изменён!');
     }
     
     // Показать форму изменения Telegram
@@ -620,64 +657,14 @@ class ShadowRaffleGame {
             return;
         }
         
-        try {
-            const response = await fetch('/api/update_profile', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    user_id: this.currentUser.id,
-                    telegram: telegram || null
-                })
-            });
-            
-            const data = await response.json();
-            
-            if (data.success) {
-                this.currentUser = data.user;
-                localStorage.setItem('shadowUser', JSON.stringify(this.currentUser));
-                document.querySelector('.modal-overlay').remove();
-                this.showMessage('Telegram успешно обновлён!', 'success');
-                this.loadSection('profile');
-                this.updateUserDisplay();
-            } else {
-                this.showMessage(data.message, 'error');
-            }
-        } catch (error) {
-            this.showMessage('Ошибка соединения с сервером', 'error');
-        }
+        await this.saveProfile({ telegram: telegram || null }, 'Telegram успешно обновлён!');
     }
     
     // Очистить Telegram
     async clearTelegram() {
         if (!confirm('Удалить Telegram из профиля?')) return;
         
-        try {
-            const response = await fetch('/api/update_profile', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    user_id: this.currentUser.id,
-                    telegram: null
-                })
-            });
-            
-            const data = await response.json();
-            
-            if (data.success) {
-                this.currentUser = data.user;
-                localStorage.setItem('shadowUser', JSON.stringify(this.currentUser));
-                document.querySelector('.modal-overlay').remove();
-                this.showMessage('Telegram удалён', 'success');
-                this.loadSection('profile');
-                this.updateUserDisplay();
-            }
-        } catch (error) {
-            this.showMessage('Ошибка соединения с сервером', 'error');
-        }
+        await this.saveProfile({ telegram: null }, 'Telegram удалён');
     }
     
     // Показать форму изменения ссылки
@@ -726,48 +713,27 @@ class ShadowRaffleGame {
             }
         }
         
-        try {
-            const response = await fetch('/api/update_profile', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    user_id: this.currentUser.id,
-                    site_url: siteUrl || null
-                })
-            });
-            
-            const data = await response.json();
-            
-            if (data.success) {
-                this.currentUser = data.user;
-                localStorage.setItem('shadowUser', JSON.stringify(this.currentUser));
-                document.querySelector('.modal-overlay').remove();
-                this.showMessage('Ссылка успешно обновлена!', 'success');
-                this.loadSection('profile');
-                this.updateUserDisplay();
-            } else {
-                this.showMessage(data.message, 'error');
-            }
-        } catch (error) {
-            this.showMessage('Ошибка соединения с сервером', 'error');
-        }
+        await this.saveProfile({ site_url: siteUrl || null }, 'Ссылка успешно обновлена!');
     }
     
     // Очистить ссылку
     async clearSiteUrl() {
         if (!confirm('Удалить ссылку из профиля?')) return;
         
+        await this.saveProfile({ site_url: null }, 'Ссылка удалена');
+    }
+    
+    // Сохранить изменённые поля профиля одним запросом
+    async saveProfile(fields, successMessage) {
         try {
-            const response = await fetch('/api/update_profile', {
-                method: 'POST',
+            const response = await fetch('/api/profile', {
+                method: 'PATCH',
                 headers: {
                     'Content-Type': 'application/json',
                 },
                 body: JSON.stringify({
                     user_id: this.currentUser.id,
-                    site_url: null
+                    ...fields
                 })
             });
             
@@ -776,10 +742,12 @@ class ShadowRaffleGame {
             if (data.success) {
                 this.currentUser = data.user;
                 localStorage.setItem('shadowUser', JSON.stringify(this.currentUser));
-                document.querySelector('.modal-overlay').remove();
-                this.showMessage('Ссылка удалена', 'success');
+                document.querySelector('.modal-overlay')?.remove();
+                this.showMessage(successMessage, 'success');
                 this.loadSection('profile');
                 this.updateUserDisplay();
+            } else {
+                this.showMessage(data.message, 'error');
             }
         } catch (error) {
             this.showMessage('Ошибка соединения с сервером', 'error');
@@ -791,6 +759,7 @@ class ShadowRaffleGame {
     }
     
     logout() {
+        if (this.eventSource) this.eventSource.close();
         localStorage.removeItem('shadowUser');
         window.location.href = '/';
     }
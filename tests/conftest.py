@@ -0,0 +1,18 @@
+import os
+import sys
+
+# Модули приложения лежат в корне репозитория
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """RaffleDatabase во временном каталоге с дешёвым хэшированием паролей"""
+    from database import RaffleDatabase
+    monkeypatch.setenv('PASSWORD_SCRYPT_N', '1024')
+    monkeypatch.delenv('LEDGER_ARCHIVE_DB', raising=False)
+    return RaffleDatabase(str(tmp_path / 'raffle.db'))
@@ -0,0 +1,22 @@
+from database import encode_cursor
+
+
+def test_users_pages_survive_balance_changes(db):
+    for i in range(1, 13):
+        db.register_with_password(f'user{i}', 'secret', f'@user{i}')
+    first = db.get_all_users_admin(limit=5)
+
+    # Балансы меняются между страницами — пропусков и повторов быть не должно
+    for user in first:
+        db.add_shadow_coins(user[0], 100, 'Тест')
+    db.add_shadow_coins(1, 500, 'Тест')
+
+    seen = [user[0] for user in first]
+    after = encode_cursor(first[-1][0])
+    while True:
+        page = db.get_all_users_admin(limit=5, after=after)
+        seen += [user[0] for user in page]
+        if len(page) < 5:
+            break
+        after = encode_cursor(page[-1][0])
+    assert seen == list(range(12, 0, -1))
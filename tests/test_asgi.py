@@ -0,0 +1,40 @@
+import asyncio
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def asgi(tmp_path, monkeypatch):
+    monkeypatch.setenv('RAFFLE_DB', str(tmp_path / 'raffle.db'))
+    monkeypatch.setenv('RATE_LIMIT_DB', str(tmp_path / 'ratelimit.db'))
+    monkeypatch.setenv('RECONCILE_INTERVAL', '3600')
+    monkeypatch.delenv('LEDGER_ARCHIVE_DB', raising=False)
+    import app
+    importlib.reload(app)
+    import asgi
+    return importlib.reload(asgi)
+
+
+def call(asgi, scope, messages):
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    return sent
+
+
+def test_websocket_is_refused(asgi):
+    sent = call(asgi, {'type': 'websocket', 'path': '/api/stream'}, [{'type': 'websocket.connect'}])
+    assert [message['type'] for message in sent] == ['websocket.close']
+
+
+def test_lifespan_starts_reconciler(asgi):
+    sent = call(asgi, {'type': 'lifespan'}, [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+    assert [message['type'] for message in sent] == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert asgi.db.reconciler._thread.is_alive()
@@ -0,0 +1,78 @@
+from ledger import MAX_COINS
+
+
+def make_user(db, nickname='alice'):
+    return db.register_with_password(nickname, 'secret', f'@{nickname}')['user']['id']
+
+
+def ledger_rows(db, user_id):
+    with db.get_connection() as conn:
+        return conn.execute(
+            "SELECT amount, reason FROM coin_transactions WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+
+
+def balance(db, user_id):
+    with db.get_connection() as conn:
+        return conn.execute("SELECT shadow_coins FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+
+
+def test_debit_beyond_balance_is_rejected_without_ledger_row(db):
+    user_id = make_user(db)
+    assert db.add_shadow_coins(user_id, 5, 'Пополнение')
+
+    assert not db.remove_shadow_coins(user_id, 6, 'Списание')
+    assert not db.spend_shadow_coin(make_user(db, 'bob'))
+    assert balance(db, user_id) == 5
+    assert ledger_rows(db, user_id) == [(5, 'Пополнение')]
+
+
+def test_credit_above_limit_is_rejected(db):
+    user_id = make_user(db)
+    assert db.add_shadow_coins(user_id, MAX_COINS, 'Пополнение')
+    assert not db.add_shadow_coins(user_id, 1, 'Сверх лимита')
+    assert balance(db, user_id) == MAX_COINS
+    assert len(ledger_rows(db, user_id)) == 1
+
+
+def test_every_balance_change_has_a_ledger_row(db):
+    user_id = make_user(db)
+    db.add_shadow_coins(user_id, 10, 'Пополнение')
+    db.remove_shadow_coins(user_id, 2, 'Списание')
+    db.spend_shadow_coin(user_id)
+    assert db.draw_prizes(user_id, 2)['success']
+
+    rows = ledger_rows(db, user_id)
+    assert [amount for amount, _ in rows] == [10, -2, -1, -1, -1]
+    assert sum(amount for amount, _ in rows) == balance(db, user_id) == 5
+    assert db.get_user_by_id(user_id)['shadow_coins'] == 5
+
+
+def test_bulk_credit_reports_each_row_in_order(db):
+    alice = make_user(db, 'alice')
+    bob = make_user(db, 'bob')
+    db.add_shadow_coins(bob, MAX_COINS - 5, 'Пополнение')
+
+    results = db.bulk_add_shadow_coins([
+        ('alice', 10, 'Бонус'),
+        ('', 5, ''),
+        ('ghost', 5, ''),
+        ('alice', 'много', ''),
+        ('bob', 10, 'Сверх лимита'),
+        ('bob', 5, 'До лимита'),
+        ('alice', -1, ''),
+        ('alice', 3, ''),
+    ])
+
+    assert [(r['row'], r['success']) for r in results] == [
+        (1, True), (2, False), (3, False), (4, False), (5, False), (6, True), (7, False), (8, True)
+    ]
+    assert results[0]['new_balance'] == 10
+    assert results[7]['new_balance'] == 13
+    assert results[2]['message'] == 'Пользователь не найден'
+    assert results[5]['new_balance'] == MAX_COINS
+
+    assert balance(db, alice) == 13
+    assert ledger_rows(db, alice) == [(10, 'Бонус'), (3, '')]
+    assert balance(db, bob) == MAX_COINS
+    assert ledger_rows(db, bob)[-1] == (5, 'До лимита')
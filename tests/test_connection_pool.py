@@ -0,0 +1,40 @@
+import pytest
+
+from connection_pool import ConnectionPool
+
+
+def make_pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'p.db'), max_size=2)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER)")
+    return pool
+
+
+def count(pool):
+    other = pool.open_connection()
+    try:
+        return other.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+    finally:
+        other.close()
+
+
+def test_nested_with_does_not_commit_outer_transaction(tmp_path):
+    pool = make_pool(tmp_path)
+    with pool.connection() as conn:
+        conn.execute("INSERT INTO t VALUES (1)")
+        with pool.connection() as inner:
+            assert inner is conn
+            inner.execute("INSERT INTO t VALUES (2)")
+        assert count(pool) == 0
+    assert count(pool) == 2
+
+
+def test_failure_after_nested_with_rolls_back_everything(tmp_path):
+    pool = make_pool(tmp_path)
+    with pytest.raises(RuntimeError):
+        with pool.connection() as conn:
+            with pool.connection() as inner:
+                inner.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError('сбой')
+    assert count(pool) == 0
+    assert pool.current() is None
@@ -0,0 +1,62 @@
+import json
+
+
+def make_player(db, coins):
+    user_id = db.register_with_password('player', 'secret', '@player')['user']['id']
+    if coins:
+        db.add_shadow_coins(user_id, coins, 'Тест')
+    return user_id
+
+
+def test_draw_publishes_one_event_per_draw(db):
+    user_id = make_player(db, 3)
+    subscription = db.events.subscribe()
+    result = db.draw_prizes(user_id, 3)
+    assert result['success']
+
+    events = [event for event in subscription.wait(timeout=0) if event['type'] == 'draw']
+    assert len(events) == 1
+    data = json.loads(events[0]['data'])
+    assert sorted(data['prize_ids']) == sorted(prize['id'] for prize in result['prizes'])
+    assert [w['nickname'] for w in data['winners']] == ['player'] * 3
+
+
+def snapshot(db, user_id):
+    with db.get_connection() as conn:
+        return conn.execute('''
+            SELECT
+                (SELECT shadow_coins FROM users WHERE id = ?),
+                (SELECT COUNT(*) FROM coin_transactions WHERE user_id = ?),
+                (SELECT COUNT(*) FROM prizes WHERE available = 1),
+                (SELECT COUNT(*) FROM winners)
+        ''', (user_id, user_id)).fetchone()
+
+
+def test_not_enough_prizes_rolls_back_everything(db):
+    user_id = make_player(db, 100)
+    before = snapshot(db, user_id)
+    available = before[2]
+
+    result = db.draw_prizes(user_id, available + 1)
+    assert not result['success']
+    assert 'Призов меньше' in result['message']
+    assert snapshot(db, user_id) == before
+
+    # Индекс призов после отката цел: можно разыграть все
+    assert db.draw_prizes(user_id, available)['success']
+    assert snapshot(db, user_id)[2] == 0
+
+
+def test_draw_without_coins_claims_no_prizes(db):
+    user_id = make_player(db, 2)
+    claimed = []
+    sample = db.prize_pool.sample
+
+    def tracked_sample(n, claim):
+        return sample(n, lambda prize: claimed.append(prize[0]) or claim(prize))
+
+    db.prize_pool.sample = tracked_sample
+    result = db.draw_prizes(user_id, 3)
+    assert result == {'success': False, 'message': 'Недостаточно теневых монет'}
+    assert claimed == []
+    assert db.draw_prizes(user_id, 2)['success']
@@ -0,0 +1,17 @@
+import io
+import os
+import stat
+
+from PIL import Image
+
+from images import process_image
+
+
+def test_variants_are_world_readable(tmp_path):
+    buffer = io.BytesIO()
+    Image.new('RGB', (400, 600), 'purple').save(buffer, 'PNG')
+    names = process_image(buffer.getvalue(), str(tmp_path))
+
+    for name in names.values():
+        mode = stat.S_IMODE(os.stat(tmp_path / name).st_mode)
+        assert mode & 0o444 == 0o444, f'{name}: {oct(mode)}'
@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+
+from ledger_archive import ROW_COLUMNS
+
+
+def seed(db, users=5, credits=4):
+    """Пользователи с начислениями и списаниями; половина журнала — 40 дней назад"""
+    ids = []
+    for i in range(1, users + 1):
+        user_id = db.register_with_password(f'user{i}', 'secret', f'@user{i}')['user']['id']
+        for _ in range(credits):
+            db.add_shadow_coins(user_id, 10, 'Тест')
+        db.remove_shadow_coins(user_id, 3, 'Тест')
+        ids.append(user_id)
+    with db.get_connection() as conn:
+        conn.execute('''
+            UPDATE coin_transactions SET created_at = datetime('now', '-40 days')
+            WHERE id % 2 = 0
+        ''')
+    return ids
+
+
+def ledger_balances(db):
+    """{user_id: (баланс, итоги + горячий журнал)}"""
+    with db.get_connection() as conn:
+        return {
+            user_id: (coins, ledger)
+            for user_id, coins, ledger in conn.execute('''
+                SELECT u.id, u.shadow_coins,
+                    COALESCE((SELECT SUM(credits - debits) FROM coin_daily_summaries s WHERE s.user_id = u.id), 0)
+                    + COALESCE((SELECT SUM(amount) FROM coin_transactions c WHERE c.user_id = u.id), 0)
+                FROM users u
+            ''')
+        }
+
+
+def archive_rows(db):
+    conn = sqlite3.connect(db.ledger_archive.path)
+    try:
+        return conn.execute(f"SELECT {ROW_COLUMNS} FROM coin_transactions ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_compaction_keeps_balances_equal_to_summaries_and_ledger(db):
+    seed(db)
+    with db.get_connection() as conn:
+        old = conn.execute(
+            "SELECT COUNT(*) FROM coin_transactions WHERE created_at < date('now', '-29 days')"
+        ).fetchone()[0]
+
+    result = db.compact_ledger(keep_days=30, batch_size=3)
+    assert result['archived'] == old > 0
+    assert len(archive_rows(db)) == old
+
+    for user_id, (coins, ledger) in ledger_balances(db).items():
+        assert coins == ledger, f'user {user_id}'
+    with db.get_connection() as conn:
+        assert conn.execute(
+            "SELECT COUNT(*) FROM coin_transactions WHERE created_at < date('now', '-29 days')"
+        ).fetchone()[0] == 0
+    assert db.verify_ledger_archive() == []
+
+
+def test_verify_reports_tampered_archive(db):
+    seed(db)
+    db.compact_ledger(keep_days=30)
+    assert db.verify_ledger_archive() == []
+
+    conn = sqlite3.connect(db.ledger_archive.path)
+    with conn:
+        conn.execute("UPDATE coin_transactions SET amount = amount + 1 WHERE id = (SELECT MIN(id) FROM coin_transactions)")
+    conn.close()
+
+    problems = db.verify_ledger_archive()
+    assert len(problems) == 1
+    assert 'user' in problems[0]
+
+
+def test_rerun_is_idempotent(db):
+    seed(db)
+    db.compact_ledger(keep_days=30)
+    summaries = db.get_ledger_summaries(1)
+    rows = archive_rows(db)
+
+    assert db.compact_ledger(keep_days=30)['archived'] == 0
+    assert db.get_ledger_summaries(1) == summaries
+    assert archive_rows(db) == rows
+    assert db.verify_ledger_archive() == []
+
+
+def test_interrupted_compaction_is_finished_without_duplicates(db):
+    seed(db)
+    db.reconciler.run()
+    # Сбой между шагами: строки уже в архиве, но ещё в журнале
+    with db.get_connection() as conn:
+        copied = conn.execute(f'''
+            SELECT {ROW_COLUMNS}, date(created_at) FROM coin_transactions
+            WHERE created_at < date('now', '-29 days') ORDER BY id LIMIT 4
+        ''').fetchall()
+    archive = db.ledger_archive.connect()
+    db.ledger_archive.store(archive, copied)
+    archive.close()
+    assert 'повторите сжатие' in db.verify_ledger_archive()[0]
+
+    db.compact_ledger(keep_days=30)
+    ids = [row[0] for row in archive_rows(db)]
+    assert len(ids) == len(set(ids))
+    assert db.verify_ledger_archive() == []
+    for coins, ledger in ledger_balances(db).values():
+        assert coins == ledger
+
+
+def test_compaction_alongside_writes(db):
+    ids = seed(db, users=4, credits=10)
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        while not stop.is_set():
+            for user_id in ids:
+                try:
+                    db.add_shadow_coins(user_id, 1, 'Параллельно')
+                    db.remove_shadow_coins(user_id, 1, 'Параллельно')
+                except Exception as e:
+                    errors.append(e)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        result = db.compact_ledger(keep_days=30, batch_size=2)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert not errors
+    assert result['archived'] > 0
+    for user_id, (coins, ledger) in ledger_balances(db).items():
+        assert coins == ledger, f'user {user_id}'
+    assert db.verify_ledger_archive() == []
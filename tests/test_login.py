@@ -0,0 +1,28 @@
+def test_login_holds_no_connection_while_hashing(db):
+    db.register_with_password('alice', 'secret', '@alice')
+    verify = db.passwords.verify
+    leased = []
+
+    def tracked_verify(*args):
+        leased.append(db.pool.current())
+        return verify(*args)
+
+    db.passwords.verify = tracked_verify
+    result = db.login_with_password('alice', 'secret')
+    assert result['success']
+    assert leased == [None]
+
+
+def test_login_updates_last_login_through_write_queue(db):
+    db.register_with_password('alice', 'secret', '@alice')
+    operations = db.writes.stats()['operations']
+    assert db.login_with_password('alice', 'secret')['success']
+    assert db.writes.stats()['operations'] == operations + 1
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT last_login FROM users WHERE nickname = 'alice'").fetchone()[0]
+
+
+def test_login_rejects_wrong_password(db):
+    db.register_with_password('alice', 'secret', '@alice')
+    assert db.login_with_password('alice', 'wrong') == {'success': False, 'message': 'Неверный пароль'}
+    assert db.login_with_password('bob', 'secret')['message'] == 'Пользователь не найден'
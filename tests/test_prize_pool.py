@@ -0,0 +1,60 @@
+import pytest
+
+from prize_pool import FenwickTree, PrizePool
+
+SIZES = [1, 2, 3, 5, 6, 7, 9, 12, 17, 31, 33, 100]
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_total_counts_every_weight(n):
+    weights = [i % 4 + 1 for i in range(n)]
+    assert FenwickTree(weights).total() == sum(weights)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_every_slot_can_be_found(n):
+    weights = [i % 4 + 1 for i in range(n)]
+    tree = FenwickTree(weights)
+    found = set()
+    offset = 0
+    for slot, weight in enumerate(weights):
+        for value in range(offset, offset + weight):
+            assert tree.find(value) == slot
+        found.add(slot)
+        offset += weight
+    assert found == set(range(n))
+
+
+@pytest.mark.parametrize('n', [5, 9, 13])
+def test_pool_draws_every_prize_after_rebuild(n):
+    pool = PrizePool()
+    for prize_id in range(1, n + 1):
+        pool._add(prize_id, f'Приз {prize_id}', '', 1)
+    # _rebuild() строит дерево тем же конструктором
+    pool._rebuild()
+
+    drawn = pool.sample(n, claim=lambda prize: True)
+    assert sorted(prize[0] for prize in drawn) == list(range(1, n + 1))
+
+
+def test_failed_claim_keeps_prize_drawable():
+    pool = PrizePool()
+    for prize_id in range(1, 4):
+        pool._add(prize_id, f'Приз {prize_id}', '', 1)
+    pool._rebuild()
+
+    calls = []
+
+    def failing_claim(prize):
+        calls.append(prize[0])
+        if len(calls) == 2:
+            raise RuntimeError('database is locked')
+        return True
+
+    with pytest.raises(RuntimeError):
+        pool.sample(3, failing_claim)
+
+    # Ни выбранный, ни упавший на claim приз не теряют вес
+    assert pool._tree.total() == 3
+    drawn = pool.sample(3, claim=lambda prize: True)
+    assert sorted(prize[0] for prize in drawn) == [1, 2, 3]
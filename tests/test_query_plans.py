@@ -0,0 +1,92 @@
+"""Горячие запросы RaffleDatabase не должны сканировать таблицы.
+
+SQL не копируется сюда: тест вызывает сами методы на базе, созданной
+RaffleDatabase (со всеми миграциями), собирает выполненные SELECT через
+set_trace_callback и прогоняет по каждому EXPLAIN QUERY PLAN. Тест падает,
+если план ушёл в полный SCAN таблицы или во временное B-дерево для сортировки.
+"""
+import sqlite3
+
+import pytest
+
+import connection_pool
+from database import RaffleDatabase, encode_cursor
+
+# Таблицы из пары строк (счётчики, состояние сверки) читаются целиком намеренно
+SMALL_TABLES = ('stats', 'reconcile_state')
+
+# Метод -> вызов; курсоры ведут на середину тестовых данных
+HOT_CALLS = {
+    'get_user_by_id': lambda db: db.get_user_by_id(1),
+    'get_user_by_nickname': lambda db: db.get_user_by_nickname('user1'),
+    'check_nickname_exists': lambda db: db.check_nickname_exists('user1'),
+    'get_user_wins': lambda db: db.get_user_wins(1),
+    'get_public_winners': lambda db: db.get_public_winners(),
+    'get_available_prizes': lambda db: db.get_available_prizes(),
+    'get_transactions': lambda db: db.get_transactions(limit=100),
+    'get_transactions(after)': lambda db: db.get_transactions(limit=100, after=encode_cursor('2030-01-01', 10)),
+    'get_transactions(user_id, after)': lambda db: db.get_transactions(
+        1, limit=100, after=encode_cursor('2030-01-01', 10)),
+    'get_stats': lambda db: db.get_stats(),
+    'get_table_counts': lambda db: db.get_table_counts(),
+    'get_all_users_admin(after)': lambda db: db.get_all_users_admin(limit=100, after=encode_cursor(10)),
+    'get_all_prizes_admin(after)': lambda db: db.get_all_prizes_admin(
+        limit=100, after=encode_cursor('2030-01-01', 10)),
+    'get_full_winners(after)': lambda db: db.get_full_winners(limit=100, after=encode_cursor('2030-01-01', 10)),
+    'get_ledger_summaries': lambda db: db.get_ledger_summaries(1),
+    'draw_prize': lambda db: db.draw_prize(1),
+}
+
+
+def plan_problems(detail):
+    """Что плохого в строке плана: полный SCAN или сортировка во временном B-дереве"""
+    if detail.startswith('SCAN') and 'USING' not in detail:
+        if detail.split()[1] in SMALL_TABLES:
+            return None
+        return 'полный просмотр таблицы'
+    if 'USE TEMP B-TREE' in detail:
+        return 'сортировка во временном B-дереве'
+    return None
+
+
+@pytest.fixture(scope='module')
+def traced(tmp_path_factory):
+    """(db, statements): RaffleDatabase с данными и список выполненных SQL"""
+    statements = []
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    mp = pytest.MonkeyPatch()
+    mp.setattr(connection_pool.sqlite3, 'connect', traced_connect)
+    db = RaffleDatabase(str(tmp_path_factory.mktemp('plans') / 'plans.db'))
+    for i in range(1, 21):
+        db.register_with_password(f'user{i}', 'password', f'@user{i}')
+        db.add_shadow_coins(i, 10, 'Тест')
+    db.draw_prize(1)
+    yield db, statements
+    mp.undo()
+
+
+@pytest.mark.parametrize('name', list(HOT_CALLS))
+def test_hot_query_uses_indexes(traced, name):
+    db, statements = traced
+    # Из кэша профилей метод не дошёл бы до SQLite
+    db.user_cache.clear()
+    statements.clear()
+    HOT_CALLS[name](db)
+
+    selects = [sql for sql in statements if sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE'))]
+    assert selects, f'{name} не выполнил ни одного запроса'
+
+    problems = []
+    with db.get_connection() as conn:
+        for sql in selects:
+            for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                problem = plan_problems(row[-1])
+                if problem:
+                    problems.append(f"{problem} ({row[-1]}): {' '.join(sql.split())}")
+    assert not problems, '\n'.join(problems)
@@ -0,0 +1,28 @@
+import pytest
+
+from rate_limit import AdmissionControl, TokenBuckets, load_rate_limits
+
+
+def test_password_routes_have_own_slots(tmp_path):
+    admission = AdmissionControl(TokenBuckets(str(tmp_path / 'rl.db')), {}, max_writes=1,
+                                 route_writes={'login': 2})
+    # Два входа в процессе хэширования не занимают слот розыгрыша
+    assert admission.enter('login') and admission.enter('login')
+    assert not admission.enter('login')
+    assert admission.enter('draw')
+    assert not admission.enter('draw')
+    admission.leave('login')
+    assert admission.enter('login')
+
+
+def test_override_replaces_and_removes_limits():
+    defaults = {'draw': {'ip': (20, 60), 'user': (5, 20)}}
+    limits = load_rate_limits(defaults, '{"draw": {"ip": [50, 100], "user": null}, "login": {"ip": [1, 5]}}')
+    assert limits == {'draw': {'ip': (50.0, 100.0)}, 'login': {'ip': (1.0, 5.0)}}
+    assert defaults == {'draw': {'ip': (20, 60), 'user': (5, 20)}}
+
+
+@pytest.mark.parametrize('limit', ['[0, 5]', '[-1, 5]', '[1, 0]'])
+def test_override_rejects_zero_rate(limit):
+    with pytest.raises(ValueError):
+        load_rate_limits({}, '{"draw": {"ip": %s}}' % limit)
@@ -0,0 +1,86 @@
+def make_users(db, n=3):
+    ids = []
+    for i in range(1, n + 1):
+        user_id = db.register_with_password(f'user{i}', 'secret', f'@user{i}')['user']['id']
+        db.add_shadow_coins(user_id, 20, 'Тест')
+        ids.append(user_id)
+    return ids
+
+
+def last_ledger_id(db):
+    with db.get_connection() as conn:
+        return conn.execute("SELECT MAX(id) FROM coin_transactions").fetchone()[0]
+
+
+def tamper(db, user_id, amount):
+    """Изменить баланс мимо журнала"""
+    with db.get_connection() as conn:
+        conn.execute("UPDATE users SET shadow_coins = shadow_coins + ? WHERE id = ?", (amount, user_id))
+
+
+def test_watermark_advances_in_batches(db):
+    ids = make_users(db, 5)
+    db.reconciler.reset()
+
+    first = db.reconciler.run_once(max_rows=2)
+    assert first['rows'] == 2 and not first['caught_up']
+
+    report = db.reconciler.run(max_rows=2)
+    assert report['watermark'] == last_ledger_id(db)
+    assert report['drift'] == []
+
+    db.remove_shadow_coins(ids[0], 5, 'Тест')
+    result = db.reconciler.run_once()
+    assert result['rows'] == 1
+    assert result['watermark'] == last_ledger_id(db)
+    assert db.reconciler.stats()['lag_rows'] == 0
+
+
+def test_drift_is_reported_for_the_user_who_transacts(db):
+    ids = make_users(db)
+    db.reconciler.run()
+
+    tamper(db, ids[1], 7)
+    db.add_shadow_coins(ids[1], 1, 'Тест')
+    report = db.reconciler.run()
+    assert [(row['user_id'], row['drift']) for row in report['drift']] == [(ids[1], 7)]
+    assert [row['user_id'] for row in db.reconciler.stats()['drift']] == [ids[1]]
+
+    # Баланс вернули — расхождение снимается следующей сверкой этого пользователя
+    tamper(db, ids[1], -7)
+    db.add_shadow_coins(ids[1], 1, 'Тест')
+    assert db.reconciler.run()['drift'] == []
+    assert db.reconciler.stats()['drift'] == []
+
+
+def test_change_without_ledger_row_is_found_by_totals(db):
+    ids = make_users(db)
+    db.reconciler.run()
+
+    # Пользователь ничего не делает — инкрементальный проход его не сверяет,
+    # но общие суммы расходятся и запускают полную сверку
+    tamper(db, ids[2], -4)
+    report = db.reconciler.run()
+    assert [(row['user_id'], row['drift']) for row in report['drift']] == [(ids[2], -4)]
+
+    # Известное расхождение не считается скрытым
+    assert db.reconciler.run_once()['hidden_drift'] == 0
+
+
+def test_reset_rebuilds_from_summaries_after_compaction(db):
+    ids = make_users(db)
+    for user_id in ids:
+        db.remove_shadow_coins(user_id, 3, 'Тест')
+    with db.get_connection() as conn:
+        conn.execute("UPDATE coin_transactions SET created_at = datetime('now', '-40 days')")
+    assert db.compact_ledger(keep_days=30)['archived'] > 0
+    with db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM coin_transactions").fetchone()[0] == 0
+
+    db.reconciler.reset()
+    report = db.reconciler.run()
+    assert report['drift'] == []
+    assert report['users_checked'] >= len(ids)
+    with db.get_connection() as conn:
+        totals = dict(conn.execute("SELECT user_id, total FROM ledger_sums"))
+    assert totals == {user_id: 17 for user_id in ids}
@@ -0,0 +1,26 @@
+from database import RaffleDatabase
+
+
+def test_balance_change_in_another_worker_reaches_cache(db, monkeypatch):
+    monkeypatch.setenv('USER_CACHE_SYNC_MS', '0')
+    worker = RaffleDatabase(db.db_name)
+    reader = RaffleDatabase(db.db_name)
+    user_id = worker.register_with_password('user1', 'secret', '@user1')['user']['id']
+
+    assert reader.get_user_by_id(user_id)['shadow_coins'] == 0
+    assert reader.get_user_by_id(user_id)['shadow_coins'] == 0  # из кэша
+
+    worker.add_shadow_coins(user_id, 15, 'Тест')
+    assert reader.get_user_by_id(user_id)['shadow_coins'] == 15
+
+
+def test_pruned_changes_clear_whole_cache(db):
+    user_id = db.register_with_password('user1', 'secret', '@user1')['user']['id']
+    db.user_cache.sync_interval = 0
+    db.get_user_by_id(user_id)
+
+    with db.get_connection() as conn:
+        conn.execute("UPDATE users SET shadow_coins = 5 WHERE id = ?", (user_id,))
+        conn.execute("DELETE FROM user_changes")
+        conn.execute("INSERT INTO user_changes (id, user_id) VALUES (100000, 0)")
+    assert db.get_user_by_id(user_id)['shadow_coins'] == 5
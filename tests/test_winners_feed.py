@@ -0,0 +1,71 @@
+import json
+import sqlite3
+
+from winners_feed import WinnersFeed
+
+
+def make_conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE winners (id INTEGER PRIMARY KEY, nickname TEXT, prize TEXT, won_at TEXT)")
+    conn.execute("CREATE TABLE cache_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    conn.execute("INSERT INTO cache_versions VALUES ('winners', 0)")
+    conn.commit()
+    return conn
+
+
+def load(conn):
+    return conn.execute(
+        "SELECT nickname, prize, won_at FROM winners ORDER BY id DESC LIMIT 50"
+    ).fetchall()
+
+
+def test_append_ignores_winner_already_loaded():
+    conn = make_conn()
+    conn.execute("INSERT INTO winners VALUES (1, 'alice', 'Приз', '2026-01-01')")
+    conn.commit()
+    feed = WinnersFeed()
+    feed.snapshot(conn, load)
+
+    # Победитель 1 уже прочитан из базы; повторный append после коммита его не задвоит
+    feed.append(1, 'alice', 'Приз', '2026-01-01')
+    body, _ = feed.snapshot(conn, load)
+    assert len(json.loads(body)['winners']) == 1
+
+
+def test_append_extends_buffer_in_order():
+    conn = make_conn()
+    conn.execute("INSERT INTO winners VALUES (1, 'alice', 'Приз', '2026-01-01')")
+    conn.commit()
+    feed = WinnersFeed()
+    feed.snapshot(conn, load)
+
+    conn.execute("INSERT INTO winners VALUES (2, 'bob', 'Приз 2', '2026-01-02')")
+    conn.commit()
+    feed.append(2, 'bob', 'Приз 2', '2026-01-02')
+    body, _ = feed.snapshot(conn, load)
+    assert [w['nickname'] for w in json.loads(body)['winners']] == ['bob', 'alice']
+
+
+def test_snapshot_keeps_callers_transaction_open():
+    conn = make_conn()
+    conn.execute("INSERT INTO winners VALUES (1, 'alice', 'Приз', '2026-01-01')")
+    assert conn.in_transaction
+    WinnersFeed().snapshot(conn, load)
+    assert conn.in_transaction
+
+
+def test_nickname_change_reaches_other_workers(db):
+    from database import RaffleDatabase
+
+    user_id = db.register_with_password('alice', 'secret', '@alice')['user']['id']
+    db.add_shadow_coins(user_id, 1, 'Тест')
+    db.draw_prize(user_id)
+
+    # Второй воркер с той же базой уже закэшировал ленту
+    other = RaffleDatabase(db.db_name)
+    body, _ = other.get_public_winners_feed()
+    assert json.loads(body)['winners'][0]['nickname'] == 'alice'
+
+    assert db.update_profile(user_id, {'nickname': 'alice2'})['success']
+    body, _ = other.get_public_winners_feed()
+    assert json.loads(body)['winners'][0]['nickname'] == 'alice2'
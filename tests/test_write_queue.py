@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+
+import pytest
+
+from write_queue import WriteQueue, WriteTimeout
+
+
+def make_connect(path):
+    def connect():
+        conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        conn.execute("CREATE TABLE IF NOT EXISTS t (x INTEGER)")
+        return conn
+    return connect
+
+
+def test_failed_connect_fails_submit_and_restarts_writer(tmp_path):
+    connect = make_connect(str(tmp_path / 'w.db'))
+    attempts = []
+
+    def flaky_connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('unable to open database file')
+        return connect()
+
+    writes = WriteQueue(flaky_connect, timeout=5)
+    with pytest.raises(sqlite3.OperationalError, match='unable to open'):
+        writes.submit(lambda conn: conn.execute("INSERT INTO t VALUES (1)"))
+    assert writes.stats()['writer_failures'] == 1
+
+    # Следующая операция запускает нового писателя
+    assert writes.submit(lambda conn: conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]) == 0
+    assert len(attempts) == 2
+
+
+def test_submit_times_out_and_skips_operation(tmp_path):
+    connect = make_connect(str(tmp_path / 'w.db'))
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocked_connect():
+        started.set()
+        release.wait()
+        return connect()
+
+    writes = WriteQueue(blocked_connect, timeout=0.1)
+    with pytest.raises(WriteTimeout):
+        writes.submit(lambda conn: conn.execute("INSERT INTO t VALUES (1)"))
+    assert started.is_set()
+    assert writes.stats()['timeouts'] == 1
+
+    # Снятая по таймауту операция не выполняется, когда писатель оживает
+    release.set()
+    writes.timeout = 5
+    assert writes.submit(lambda conn: conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]) == 0
+
+
+def test_base_exception_in_operation_goes_to_its_caller(tmp_path):
+    writes = WriteQueue(make_connect(str(tmp_path / 'w.db')), timeout=5)
+
+    def stop(conn):
+        conn.execute("INSERT INTO t VALUES (1)")
+        raise SystemExit(1)
+
+    with pytest.raises(SystemExit):
+        writes.submit(stop)
+    # Писатель жив, операция откачена
+    assert writes.submit(lambda conn: conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]) == 0
+    assert writes.stats()['writer_failures'] == 0
+
+
+def test_writer_failure_is_reported_and_writer_restarts(tmp_path, monkeypatch):
+    writes = WriteQueue(make_connect(str(tmp_path / 'w.db')), timeout=5)
+    record = writes._record
+
+    def broken_record(*args):
+        monkeypatch.setattr(writes, '_record', record)
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(writes, '_record', broken_record)
+    with pytest.raises(KeyboardInterrupt):
+        writes.submit(lambda conn: conn.execute("INSERT INTO t VALUES (1)"))
+    assert writes.stats()['writer_failures'] == 1
+
+    assert writes.submit(lambda conn: conn.execute("SELECT COUNT(*) FROM t").fetchone()[0]) == 1
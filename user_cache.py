@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """Профили пользователей по id в памяти (LRU, не больше max_size, живут ttl секунд).
+
+    Любая запись, затрагивающая пользователя (монеты, профиль, вход),
+    вызывает invalidate() после коммита. Чтение, начавшееся до такой
+    записи, не положит в кэш устаревшие данные: fill() принимает отметку
+    token(), взятую до SELECT, и ничего не сохраняет, если с тех пор была
+    инвалидация.
+
+    Изменения из других воркеров gunicorn приходят через таблицу
+    user_changes (её пишут триггеры, миграция 11): sync() не чаще раза в
+    sync_interval секунд дочитывает новые записи и сбрасывает эти профили.
+    Чужое изменение видно не позже чем через sync_interval; ttl — страховка.
+    """
+
+    def __init__(self, max_size=10000, ttl=10.0, sync_interval=0.2):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._last_change = None  # последний прочитанный id user_changes
+        self._synced_at = None
+        self._entries = OrderedDict()  # id -> (истекает, словарь пользователя)
+        self._invalidations = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id):
+        """Копия профиля или None, если его нет в кэше или он устарел"""
+        user_id = _key(user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._hits += 1
+            return dict(entry[1])
+
+    def token(self):
+        """Отметка перед чтением из базы (для fill)"""
+        with self._lock:
+            return self._invalidations
+
+    def fill(self, user_id, user, token):
+        """Сохранить прочитанный профиль, если после token() его не меняли"""
+        user_id = _key(user_id)
+        if user_id is None:
+            return
+        with self._lock:
+            if token != self._invalidations:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, dict(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            self._invalidations += 1
+            for user_id in user_ids:
+                self._entries.pop(_key(user_id), None)
+
+    def needs_sync(self):
+        """Пора дочитать user_changes (перед чтением из кэша)"""
+        return self._synced_at is None or time.monotonic() - self._synced_at >= self.sync_interval
+
+    def sync(self, conn):
+        """Сбросить профили, изменённые после прошлого sync (в том числе другими воркерами)"""
+        if not self._sync_lock.acquire(blocking=False):
+            return  # дочитывает другой поток
+        try:
+            started = time.monotonic()
+            if self._last_change is None:
+                # Первый запуск: кэш пуст, достаточно запомнить позицию
+                self._last_change = conn.execute("SELECT COALESCE(MAX(id), 0) FROM user_changes").fetchone()[0]
+            else:
+                rows = conn.execute(
+                    "SELECT id, user_id FROM user_changes WHERE id > ? ORDER BY id", (self._last_change,)
+                ).fetchall()
+                if rows and rows[0][0] != self._last_change + 1:
+                    # Часть записей уже вычищена — не знаем, кого сбросить
+                    self.clear()
+                elif rows:
+                    self.invalidate(*{user_id for _, user_id in rows})
+                if rows:
+                    self._last_change = rows[-1][0]
+            self._synced_at = started
+        finally:
+            self._sync_lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'sync_interval_seconds': self.sync_interval,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+
+def _key(user_id):
+    # id приходит и числом, и строкой из запроса
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import threading
+from collections import deque
+
+
+class WinnersFeed:
+    """Кольцевой буфер последних победителей с готовым JSON и ETag.
+
+    draw_prize дописывает победителя после коммита. Если победа случилась
+    в другом воркере (id не следует подряд за последним известным), буфер
+    перечитывается из базы при следующем запросе. Смену ника или названия
+    приза и удаления отмечают триггеры счётчиком 'winners' в cache_versions
+    (миграция 10), поэтому о них узнают и другие воркеры. Проверка свежести —
+    один SELECT по первичным ключам.
+    """
+
+    def __init__(self, size=50):
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=size)
+        self._last_id = None
+        self._version = None
+        self._body = None
+        self._etag = None
+
+    def append(self, winner_id, nickname, prize_name, won_at):
+        """Добавить победителя, записанного в этом процессе"""
+        with self._lock:
+            if self._last_id is not None and winner_id <= self._last_id:
+                # Уже в буфере: перечитан из базы вместе с этой записью
+                return
+            if self._last_id is None or winner_id != self._last_id + 1:
+                # Пропустили чужие записи — пусть буфер перечитается
+                self._last_id = None
+                self._body = None
+                return
+            self._entries.appendleft({
+                'nickname': nickname,
+                'prize_name': prize_name,
+                'won_at': won_at
+            })
+            self._last_id = winner_id
+            self._serialize()
+
+    def snapshot(self, conn, load):
+        """Вернуть (body, etag). load(conn) — строки (nickname, prize_name, won_at)"""
+        # MAX(id) и строки читаются в одном снимке: иначе победитель, записанный
+        # между ними, попал бы в буфер при старом last_id и задвоился в append()
+        own = not conn.in_transaction
+        if own:
+            conn.execute("BEGIN")
+        try:
+            last_id, version = conn.execute('''
+                SELECT
+                    (SELECT MAX(id) FROM winners),
+                    (SELECT version FROM cache_versions WHERE name = 'winners')
+            ''').fetchone()
+            last_id = last_id or 0
+            with self._lock:
+                if self._body is not None and self._last_id == last_id and self._version == version:
+                    return self._body, self._etag
+            rows = load(conn)
+        finally:
+            if own:
+                conn.commit()
+
+        with self._lock:
+            self._entries.clear()
+            self._entries.extend(
+                {'nickname': r[0], 'prize_name': r[1], 'won_at': r[2]}
+                for r in rows
+            )
+            self._last_id = last_id
+            self._version = version
+            self._serialize()
+            return self._body, self._etag
+
+    def _serialize(self):
+        self._body = json.dumps({
+            'success': True,
+            'winners': list(self._entries)
+        }).encode()
+        self._etag = hashlib.sha1(self._body).hexdigest()
@@ -0,0 +1,229 @@
+"""Групповой коммит изменений (розыгрыш, монеты, регистрация).
+
+Все изменения процесса выполняет один поток-писатель: он забирает из
+очереди операции, накопившиеся за max_delay секунд (не больше max_batch),
+и проводит их одной транзакцией BEGIN IMMEDIATE — одна блокировка записи
+и одна синхронизация журнала на пачку вместо одной на запрос. Каждая
+операция идёт в своей точке сохранения, поэтому ошибка одной откатывает
+только её: вызывающий получает свой результат или своё исключение.
+
+Если писатель не смог открыть соединение (или упал), ожидающие операции
+получают эту ошибку, а следующий submit запускает писателя заново. submit ждёт не
+дольше timeout секунд: операция, которую писатель ещё не взял, снимается
+с очереди и не выполнится, а вызывающий получает WriteTimeout.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from metrics import log
+
+# Границы гистограммы размеров пачек
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class WriteTimeout(sqlite3.OperationalError):
+    """Операция не дождалась потока-писателя за отведённое время"""
+
+
+class WriteQueue:
+    """Очередь записи с одним потоком-писателем.
+
+    connect() вызывается в потоке-писателе и возвращает его собственное
+    соединение (оно не возвращается в пул);
+    metrics (metrics.Metrics) получает ожидание в очереди и блокировки записи;
+    timeout — сколько submit ждёт результата (None — без ограничения).
+    """
+
+    def __init__(self, connect, max_batch=64, max_delay=0.002, timeout=30.0, metrics=None):
+        self.connect = connect
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Сбросить состояние (при создании и после fork в воркере gunicorn)"""
+        self._pid = os.getpid()
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self.conn = None  # соединение писателя (для вложенных вызовов из операций)
+        self._batches = 0
+        self._operations = 0
+        self._failed_operations = 0
+        self._failed_batches = 0
+        self._timeouts = 0
+        self._writer_failures = 0
+        self._max_batch_size = 0
+        self._batch_sizes = dict.fromkeys(BATCH_BUCKETS, 0)
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._commit_time = 0.0
+
+    def in_writer(self):
+        """Вызов из самой операции (в потоке-писателе)"""
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn):
+        """Выполнить fn(conn) в ближайшей пачке и вернуть её результат (или бросить её исключение)"""
+        future = Future()
+        with self._lock:
+            # Постановка и проверка писателя под той же блокировкой, что и
+            # _fail_pending: операция не попадёт в уже вычищенную очередь без писателя
+            if self._pid != os.getpid():
+                # Поток писателя не переживает fork — запускаем свой в каждом воркере
+                self._reset()
+            self._queue.put((fn, future, time.monotonic()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Писатель уже выполняет операцию — её результат вот-вот будет
+            if not future.cancel():
+                return future.result()
+        with self._lock:
+            self._timeouts += 1
+        raise WriteTimeout(f'Очередь записи не ответила за {self.timeout} с')
+
+    def _run(self):
+        try:
+            self.conn = conn = self.connect()
+        except BaseException as e:
+            log.error('write_queue.connect_failed', error=repr(e))
+            self._fail_pending(e)
+            return
+        batch = []
+        try:
+            self._loop(conn, batch)
+        except BaseException as e:
+            # Сбой вне операций (учёт, метрики): пачке и очереди — ошибка, писатель перезапустится
+            log.error('write_queue.writer_failed', error=repr(e))
+            self.conn = None
+            try:
+                conn.close()
+            except Exception:
+                pass
+            # Сначала снимаем писателя: вызывающий, получив ошибку, запустит нового
+            self._fail_pending(e)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _loop(self, conn, batch):
+        while True:
+            batch[:] = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    # После истечения задержки забираем только то, что уже в очереди
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Операции, чьи вызывающие уже получили WriteTimeout, не выполняем
+            batch[:] = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if batch:
+                self._execute(conn, batch)
+
+    def _fail_pending(self, error):
+        """Писатель остановился: ожидающим — его ошибка, следующий submit запустит нового"""
+        with self._lock:
+            if self._thread is threading.current_thread():
+                self._thread = None
+            self._writer_failures += 1
+            while True:
+                try:
+                    _, future, _ = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(error)
+
+    def _execute(self, conn, batch):
+        started = time.monotonic()
+        locked = None
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            locked = time.monotonic()
+            for fn, future, queued in batch:
+                conn.execute("SAVEPOINT batch_op")
+                try:
+                    result = fn(conn)
+                except BaseException as e:
+                    # В том числе SystemExit и т.п. из операции: достаются её вызывающему
+                    conn.execute("ROLLBACK TO batch_op")
+                    conn.execute("RELEASE batch_op")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE batch_op")
+                    outcomes.append((future, result, None))
+            conn.commit()
+            batch_error = None
+        except BaseException as e:
+            # Не удалось начать или зафиксировать пачку — откатываем её целиком
+            if conn.in_transaction:
+                conn.rollback()
+            batch_error = e
+        finished = time.monotonic()
+
+        errors = {id(future): error for future, _, error in outcomes if error is not None}
+        self._record(batch, started, finished, batch_error, len(errors))
+        if self.metrics is not None:
+            # Ожидание блокировки записи SQLite (другие процессы) и ожидание в очереди
+            self.metrics.observe('lock', 'sqlite_write', (locked or finished) - started, error=locked is None)
+            for _, _, queued in batch:
+                self.metrics.observe('lock', 'write_queue', started - queued)
+
+        results = {id(future): result for future, result, _ in outcomes}
+        for _, future, _ in batch:
+            error = errors.get(id(future)) or batch_error
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results[id(future)])
+
+    def _record(self, batch, started, finished, batch_error, failed):
+        with self._lock:
+            size = len(batch)
+            self._batches += 1
+            self._operations += size
+            self._failed_operations += size if batch_error is not None else failed
+            self._failed_batches += batch_error is not None
+            self._max_batch_size = max(self._max_batch_size, size)
+            bucket = next((b for b in BATCH_BUCKETS if size <= b), BATCH_BUCKETS[-1])
+            self._batch_sizes[bucket] += 1
+            for _, _, queued in batch:
+                wait = started - queued
+                self._wait_time += wait
+                self._max_wait = max(self._max_wait, wait)
+            self._commit_time += finished - started
+
+    def stats(self):
+        """Размеры пачек и время ожидания в очереди"""
+        with self._lock:
+            return {
+                'max_batch': self.max_batch,
+                'max_delay_ms': self.max_delay * 1000,
+                'pending': self._queue.qsize(),
+                'batches': self._batches,
+                'operations': self._operations,
+                'failed_operations': self._failed_operations,
+                'failed_batches': self._failed_batches,
+                'timeouts': self._timeouts,
+                'writer_failures': self._writer_failures,
+                'avg_batch_size': round(self._operations / self._batches, 2) if self._batches else 0,
+                'max_batch_size': self._max_batch_size,
+                'batch_sizes': {f'<={b}': n for b, n in self._batch_sizes.items()},
+                'avg_queue_wait_ms': round(self._wait_time / self._operations * 1000, 3) if self._operations else 0,
+                'max_queue_wait_ms': round(self._max_wait * 1000, 3),
+                'avg_batch_time_ms': round(self._commit_time / self._batches * 1000, 3) if self._batches else 0,
+            }